@@ -0,0 +1,248 @@
+#!/usr/bin/python
+
+from concurrent.futures import ProcessPoolExecutor
+from Controller import Controller
+from optparse import OptionParser
+import copy
+import glob
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import subprocess
+import sys
+import time
+
+REPOSITORY_DIRECTORY = os.path.dirname(os.path.dirname(os.path.abspath(
+    __file__)))
+
+# The bundled scenarios that are benchmarked by default.
+DEFAULT_SCENARIO_PATTERNS = (
+    os.path.join(REPOSITORY_DIRECTORY, 'test_cases_fast', '*.json'),
+    os.path.join(REPOSITORY_DIRECTORY, 'test_cases_reno', '*.json'),
+)
+
+# The number of copies of the bundled scenarios in the scaled-up scenarios.
+DEFAULT_SCALES = (10,)
+
+
+def replicate_network(network, copies):
+    """Returns a network made of independent copies of the given network. The
+    ids of the copies are suffixed with '_' and the copy number.
+
+    Args:
+        network: The parsed JSON representation of the network.
+        copies: The number of copies.
+    """
+    def rename(x, index):
+        return '%s_%d' % (x, index)
+
+    replicated = {'routers': [], 'hosts': [], 'links': [], 'flows': []}
+    for index in range(copies):
+        for json_router in network['routers']:
+            router = copy.deepcopy(json_router)
+            router['id'] = rename(router['id'], index)
+            router['links'] = [rename(x, index) for x in router['links']]
+            if 'routing_table' in router:
+                router['routing_table'] = {
+                    rename(host_id, index): rename(link_ids, index)
+                    if isinstance(link_ids, str) else
+                    [rename(x, index) for x in link_ids]
+                    for host_id, link_ids in router['routing_table'].items()
+                }
+            replicated['routers'].append(router)
+        for json_host in network['hosts']:
+            host = copy.deepcopy(json_host)
+            host['id'] = rename(host['id'], index)
+            host['links'] = [rename(x, index) for x in host['links']]
+            replicated['hosts'].append(host)
+        for json_link in network['links']:
+            link = copy.deepcopy(json_link)
+            for key in ('id', 'left_device_id', 'right_device_id'):
+                link[key] = rename(link[key], index)
+            replicated['links'].append(link)
+        for json_flow in network['flows']:
+            flow = copy.deepcopy(json_flow)
+            for key in ('id', 'src_id', 'dst_id'):
+                flow[key] = rename(flow[key], index)
+            replicated['flows'].append(flow)
+    return replicated
+
+
+def peak_rss_kb():
+    """Returns the peak resident set size of this process, in kilobytes."""
+    # On Linux, ru_maxrss is carried over from the parent through fork and
+    # exec, so it would report the benchmark's own peak. VmHWM is not.
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1])
+    except IOError:
+        pass
+    # ru_maxrss is in kilobytes on Linux, but in bytes on macOS.
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        peak_rss //= 1024
+    return peak_rss
+
+
+def run_scenario(name, network, num_seconds):
+    """Runs one headless simulation and measures it. Executed in a fresh
+    process so that the peak RSS belongs to this scenario alone.
+
+    Args:
+        name: The name of the scenario.
+        network: The parsed JSON representation of the network.
+        num_seconds: The number of simulated seconds to run.
+
+    Returns:
+        A dictionary with the measurements.
+    """
+    controller = Controller({
+        'filename': None,
+        'debug': False,
+        'network': network,
+    })
+    start = time.perf_counter()
+    controller.run(num_seconds)
+    wall_time = time.perf_counter() - start
+
+    num_events = controller.get_num_events()
+    num_packets = controller.get_num_packets_transmitted()
+    simulated_time = controller.get_current_time()
+    peak_rss = peak_rss_kb()
+    return {
+        'scenario': name,
+        'num_links': len(network['links']),
+        'num_flows': len(network['flows']),
+        'events': num_events,
+        'packets': num_packets,
+        'simulated_seconds': simulated_time,
+        'wall_seconds': wall_time,
+        'events_per_second': num_events / wall_time,
+        'packets_per_second': num_packets / wall_time,
+        'simulated_seconds_per_second': simulated_time / wall_time,
+        'peak_rss_kb': peak_rss,
+    }
+
+
+def load_scenarios(filenames, scales):
+    """Returns the list of (name, network) scenarios to benchmark.
+
+    Args:
+        filenames: The JSON files of the networks.
+        scales: For each scale above 1, a scaled-up scenario made of that
+            many copies of each network is added as well.
+    """
+    scenarios = []
+    for filename in filenames:
+        with open(filename) as f:
+            network = json.loads(f.read())
+        name = os.path.relpath(filename, REPOSITORY_DIRECTORY)
+        scenarios.append((name, network))
+        for scale in scales:
+            if scale <= 1:
+                continue
+            scenarios.append(('%s x%d' % (name, scale),
+                replicate_network(network, scale)))
+    return scenarios
+
+
+def git_revision():
+    """Returns the current git commit of the repository, or None."""
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', 'HEAD'], cwd=REPOSITORY_DIRECTORY,
+            stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def benchmark(scenarios, num_seconds, repeat=1):
+    """Runs every scenario and returns the benchmark report.
+
+    Args:
+        scenarios: The list of (name, network) scenarios.
+        num_seconds: The number of simulated seconds to run each scenario.
+        repeat: The number of times each scenario is run. The fastest run is
+            reported.
+    """
+    context = multiprocessing.get_context('spawn')
+    results = []
+    for name, network in scenarios:
+        runs = []
+        for _ in range(repeat):
+            with ProcessPoolExecutor(max_workers=1, mp_context=context) as \
+                    executor:
+                runs.append(executor.submit(run_scenario, name, network,
+                    num_seconds).result())
+        results.append(min(runs, key=lambda x: x['wall_seconds']))
+    return {
+        'revision': git_revision(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'num_seconds': num_seconds,
+        'results': results,
+    }
+
+
+def print_report(report, baseline=None):
+    """Prints the results as a table, with the speedup over a baseline report
+    for the scenarios that are in both. The speedup compares simulated seconds
+    per wall second, since changes to the simulator may change the number of
+    events needed for the same work."""
+    baseline_results = {}
+    if baseline is not None:
+        baseline_results = {x['scenario']: x for x in baseline['results']}
+
+    print('%-32s %10s %10s %10s %9s %9s' % ('scenario', 'events/s',
+        'packets/s', 'sim s/s', 'RSS (MB)', 'speedup'))
+    for result in report['results']:
+        speedup = ''
+        if result['scenario'] in baseline_results:
+            old = baseline_results[result['scenario']]
+            speedup = '%.2fx' % (result['simulated_seconds_per_second'] /
+                old['simulated_seconds_per_second'])
+        print('%-32s %10.0f %10.0f %10.2f %9.1f %9s' % (result['scenario'],
+            result['events_per_second'], result['packets_per_second'],
+            result['simulated_seconds_per_second'],
+            result['peak_rss_kb'] / 1024.0, speedup))
+
+
+if __name__ == '__main__':
+    parser = OptionParser(usage="usage: %prog [options] [jsonfile ...]")
+    parser.add_option("-t", "--time", dest="num_seconds", type="float",
+        default=30.0, help="Simulated seconds per scenario (default: 30)")
+    parser.add_option("-s", "--scale", dest="scales", type="int",
+        action="append", help="Also benchmark each scenario replicated this "
+        "many times; may be repeated, and 1 disables it (default: 10)")
+    parser.add_option("-r", "--repeat", dest="repeat", type="int", default=1,
+        help="Runs per scenario; the fastest is reported")
+    parser.add_option("-o", "--output", dest="output_filename",
+        help="Write the results to this JSON file")
+    parser.add_option("-c", "--compare", dest="baseline_filename",
+        help="Compare against the results in this JSON file")
+    options, args = parser.parse_args()
+
+    filenames = args
+    if not filenames:
+        filenames = sorted(
+            x for pattern in DEFAULT_SCENARIO_PATTERNS for x in glob.glob(
+                pattern))
+    scales = options.scales if options.scales is not None else DEFAULT_SCALES
+
+    report = benchmark(load_scenarios(filenames, scales), options.num_seconds,
+        options.repeat)
+
+    baseline_report = None
+    if options.baseline_filename is not None:
+        with open(options.baseline_filename) as f:
+            baseline_report = json.loads(f.read())
+    print_report(report, baseline_report)
+
+    if options.output_filename is not None:
+        with open(options.output_filename, 'w') as f:
+            f.write(json.dumps(report, indent=2))
@@ -0,0 +1,705 @@
+from collections import deque
+import math
+
+
+class FlowStates(object):
+    """Enum for the different flow states in the TCP algorithms."""
+
+    RenoSlowStartPart1 = 0
+    RenoSlowStartPart2 = 1
+    RenoFastRecovery = 2
+    RenoCA = 3
+    Fast = 4
+    CubicSlowStart = 5
+    CubicCA = 6
+    CubicRecovery = 7
+    BbrStartup = 8
+    BbrDrain = 9
+    BbrProbeBW = 10
+    BbrProbeRTT = 11
+
+
+# The congestion control algorithms by name, as given in the 'tcp' field of a
+# flow in the JSON file.
+CONGESTION_CONTROL_ALGORITHMS = {}
+
+
+def register_congestion_control(name):
+    """Class decorator that registers a CongestionControl subclass under a
+    name, so that flows can select it with their 'tcp' field."""
+    def register(cls):
+        cls.NAME = name
+        CONGESTION_CONTROL_ALGORITHMS[name] = cls
+        return cls
+    return register
+
+
+def create_congestion_control(name, flow, controller):
+    """Returns a new instance of the congestion control algorithm registered
+    under a name, for a flow.
+
+    Raises:
+        NotImplementedError: If no algorithm is registered under the name.
+    """
+    if name not in CONGESTION_CONTROL_ALGORITHMS:
+        raise NotImplementedError(
+            "Unsupported TCP Congestion Control Algorithm: %s" % name)
+    return CONGESTION_CONTROL_ALGORITHMS[name](flow, controller)
+
+
+class CongestionControl(object):
+    """The congestion control algorithm of a flow, which a flow binds once
+    when it is created and calls on every ack.
+
+    The flow keeps the sequence numbers and the window size. The algorithm
+    sets the window size and, on a loss, moves the flow's next sequence
+    number back or picks a packet to retransmit. The tunable constants of the
+    algorithms are Flow class attributes, so that they can be swept.
+
+    Attributes:
+        NAME: The name the algorithm is registered under.
+        RETRANSMIT_IMMEDIATELY: True if a packet picked for retransmission is
+            sent even when the window is full.
+        _flow: The flow.
+        _controller: The controller object.
+    """
+
+    NAME = None
+    RETRANSMIT_IMMEDIATELY = False
+
+    def __init__(self, flow, controller):
+        self._flow = flow
+        self._controller = controller
+
+    def get_state(self):
+        """Returns the congestion control state, one of FlowStates."""
+        raise NotImplementedError
+
+    def get_window_start(self):
+        """Returns the sequence number the window starts at."""
+        return self._flow.get_last_ack_number()
+
+    def is_recovering(self):
+        """Returns whether a loss is being recovered from."""
+        return False
+
+    def get_pacing_rate(self):
+        """Returns the rate in packets per second to pace the data packets
+        at, or None to send them as fast as the link takes them."""
+        return None
+
+    def receive_ack(self, ack_packet, rtt):
+        """Updates the window on an ack. Called before the flow records the
+        ack number as the last one received.
+
+        Args:
+            ack_packet: The ack packet.
+            rtt: The round trip time measured from the ack.
+        """
+        raise NotImplementedError
+
+    def skip_to(self, ack_number):
+        """Called when the fluid model moves the flow forward to an ack
+        number, with every packet sent before it acked."""
+        pass
+
+    def on_send(self, packet):
+        """Called when the flow sends a data packet."""
+        pass
+
+    def on_timeout(self):
+        """Called when the retransmission timer of the flow expires, after
+        the flow went back to its last ack, see Flow.go_back_to."""
+        pass
+
+    def keeps_retransmit_timer(self):
+        """Returns whether the last ack, which acked new data, leaves the
+        retransmission timer of the flow running instead of restarting it."""
+        return False
+
+
+@register_congestion_control('reno')
+class RenoCongestionControl(CongestionControl):
+    """TCP Reno: slow start, congestion avoidance and fast recovery. If the
+    retransmission timer of the flow expires, it goes back to slow start.
+
+    Attributes:
+        _state: The FlowStates state.
+        _ss_threshold: The slow start threshold.
+        _old_window_size: The window size before fast recovery.
+        _num_acks_repeated: The number of repeated acknowledgements.
+    """
+
+    def __init__(self, flow, controller):
+        super().__init__(flow, controller)
+        self._state = FlowStates.RenoSlowStartPart1
+        self._ss_threshold = float('inf')
+        self._old_window_size = None
+        self._num_acks_repeated = 0
+
+    def get_state(self):
+        return self._state
+
+    def is_recovering(self):
+        return self._state == FlowStates.RenoFastRecovery
+
+    def skip_to(self, ack_number):
+        self._num_acks_repeated = 0
+
+    def on_timeout(self):
+        flow = self._flow
+        # Transition into slow start.
+        if self._state == FlowStates.RenoFastRecovery:
+            self._ss_threshold = self._old_window_size / 2
+        else:
+            self._ss_threshold = flow.get_window_size() / 2
+        flow.set_window_size(1.0)
+        self._state = FlowStates.RenoSlowStartPart2
+        self._num_acks_repeated = 0
+
+    def handle_SS1(self, ack_number):
+        flow = self._flow
+        if flow.get_last_ack_number() == ack_number:
+            self._ss_threshold = flow.get_window_size() / 2
+            flow.set_window_size(1.0)
+            self._state = FlowStates.RenoSlowStartPart2
+            flow.go_back_to(ack_number)
+        else:
+            flow.set_window_size(flow.get_window_size() + 1)
+
+    def handle_SS2(self, ack_number):
+        flow = self._flow
+        if flow.get_window_size() < self._ss_threshold:
+            flow.set_window_size(flow.get_window_size() + 1)
+        else:
+            self._state = FlowStates.RenoCA
+
+    def handle_duplicate_ack(self, ack_number):
+        flow = self._flow
+        if flow.get_last_ack_number() == ack_number:
+            self._num_acks_repeated += 1
+            if self._num_acks_repeated == flow.NUM_ACKS_THRESHOLD - 1:
+                # Retransmit.
+                flow.retransmit(ack_number)
+                # Store for when we break out of the repetitions.
+                self._old_window_size = flow.get_window_size()
+                self._state = FlowStates.RenoFastRecovery
+                if flow.uses_sack():
+                    # The window only counts the packets in flight, so it is
+                    # not inflated by the duplicate acks.
+                    flow.set_window_size(self._old_window_size / 2)
+                    return
+                flow.set_window_size(self._old_window_size / 2 +
+                    flow.NUM_ACKS_THRESHOLD - 1)
+                flow.set_sequence_number(flow.get_sequence_number() - 1)
+
+    def handle_FR(self, ack_number):
+        flow = self._flow
+        if flow.get_last_ack_number() == ack_number:
+            self._num_acks_repeated += 1
+            if (self._num_acks_repeated > flow.NUM_ACKS_THRESHOLD - 1 and
+                    not flow.uses_sack()):
+                flow.set_window_size(flow.get_window_size() + 1)
+        elif self._num_acks_repeated >= flow.NUM_ACKS_THRESHOLD - 1:
+            flow.set_window_size(self._old_window_size / 2.5)
+            self._state = FlowStates.RenoCA
+            self._num_acks_repeated = 0
+
+    def handle_CA(self, ack_number):
+        flow = self._flow
+        flow.set_window_size(flow.get_window_size() +
+            1.0 / flow.get_window_size())
+        self.handle_duplicate_ack(ack_number)
+
+    def receive_ack(self, ack_packet, rtt):
+        flow = self._flow
+        ack_number = ack_packet.get_ack_number()
+        if self._state == FlowStates.RenoSlowStartPart1:
+            self.handle_SS1(ack_number)
+        elif self._state == FlowStates.RenoSlowStartPart2:
+            self.handle_SS2(ack_number)
+        elif self._state == FlowStates.RenoCA:
+            self.handle_CA(ack_number)
+        elif self._state == FlowStates.RenoFastRecovery:
+            self.handle_FR(ack_number)
+
+        if ack_number > flow.get_sequence_number():
+            flow.set_sequence_number(ack_number)
+            self._num_acks_repeated = 0
+
+
+@register_congestion_control('fast')
+class FastCongestionControl(CongestionControl):
+    """FAST TCP: the window is scaled by the ratio of the base round trip
+    time to the measured one, plus FAST_ALPHA, on every ack. The window
+    slides with the highest ack received.
+
+    Attributes:
+        _window_start: The sequence number the window starts at.
+        _num_acks_repeated: The number of repeated acknowledgements.
+        _base_rtt: The smallest round trip time measured, or -1 before the
+            first ack.
+    """
+
+    def __init__(self, flow, controller):
+        super().__init__(flow, controller)
+        self._window_start = 0
+        self._num_acks_repeated = 0
+        self._base_rtt = flow.FAST_BASE_RTT
+
+    def get_state(self):
+        return FlowStates.Fast
+
+    def get_window_start(self):
+        return self._window_start
+
+    def skip_to(self, ack_number):
+        self._window_start = ack_number
+        self._num_acks_repeated = 0
+
+    def on_timeout(self):
+        # The window only depends on the delays, so it is kept.
+        self._num_acks_repeated = 0
+
+    def receive_ack(self, ack_packet, rtt):
+        flow = self._flow
+        ack_number = ack_packet.get_ack_number()
+        if (flow.get_last_ack_number() == ack_number):
+            self._num_acks_repeated += 1
+            if self._num_acks_repeated == flow.NUM_ACKS_THRESHOLD - 1:
+                flow.go_back_to(ack_number)
+
+        if (ack_number > self._window_start):
+            # Slide the window upon receipt of an ack above the window_start variable.
+            self._window_start = ack_number
+
+        if(self._base_rtt == -1):
+            flow.set_window_size(flow.get_window_size() + flow.FAST_ALPHA)
+            self._base_rtt = rtt
+        else:
+            flow.set_window_size((self._base_rtt/rtt)*flow.get_window_size() +
+                flow.FAST_ALPHA)
+            if(self._base_rtt > rtt):
+                self._base_rtt = rtt
+
+
+class RecoveringCongestionControl(CongestionControl):
+    """Base class of the algorithms that share a NewReno-style loss
+    recovery, and only differ in how they set the window.
+
+    A loss is detected on the NUM_ACKS_THRESHOLD - 1th duplicate ack, and the
+    missing packet is retransmitted right away, outside of the window. Until
+    everything sent before the loss is acked, each partial ack retransmits
+    the next missing packet. Only the first partial ack restarts the
+    retransmission timer of the flow, as in the Impatient variant of RFC
+    6582: one packet per round trip is too slow to recover from a burst of
+    losses, so if the recovery outlasts the timeout, or a retransmission is
+    lost too, the timer expires and the flow goes back to its last ack. With
+    SACK, the flow also retransmits the other lost packets during the
+    recovery, see Flow.retransmit. Subclasses implement on_ack and on_loss,
+    and extend on_timeout.
+
+    Attributes:
+        _num_acks_repeated: The number of repeated acknowledgements.
+        _recovery_point: The sequence number that ends the current recovery
+            once acked, or None if not recovering.
+        _num_partial_acks: The number of partial acks in the current
+            recovery.
+        _min_rtt: The smallest round trip time measured, or None before the
+            first ack.
+    """
+
+    RETRANSMIT_IMMEDIATELY = True
+
+    def __init__(self, flow, controller):
+        super().__init__(flow, controller)
+        self._num_acks_repeated = 0
+        self._recovery_point = None
+        self._num_partial_acks = 0
+        self._min_rtt = None
+
+    def is_recovering(self):
+        return self._recovery_point is not None
+
+    def skip_to(self, ack_number):
+        self._num_acks_repeated = 0
+
+    def receive_ack(self, ack_packet, rtt):
+        flow = self._flow
+        ack_number = ack_packet.get_ack_number()
+        last_ack_number = flow.get_last_ack_number()
+        if self._min_rtt is None or rtt < self._min_rtt:
+            self._min_rtt = rtt
+
+        if ack_number > last_ack_number:
+            self._num_acks_repeated = 0
+            if self._recovery_point is not None:
+                if ack_number >= self._recovery_point:
+                    self._recovery_point = None
+                    self._num_partial_acks = 0
+                else:
+                    # A partial ack: the next missing packet was lost too.
+                    self._num_partial_acks += 1
+                    flow.retransmit(ack_number)
+            if ack_number > flow.get_sequence_number():
+                flow.set_sequence_number(ack_number)
+            self.on_ack(ack_number, ack_number - last_ack_number, rtt)
+        else:
+            if flow.get_sequence_number() > ack_number:
+                self._num_acks_repeated += 1
+                if (self._num_acks_repeated == flow.NUM_ACKS_THRESHOLD - 1 and
+                        self._recovery_point is None):
+                    self._recovery_point = flow.get_sequence_number()
+                    flow.retransmit(ack_number)
+                    self.on_loss()
+            self.on_ack(ack_number, 0, rtt)
+
+    def on_timeout(self):
+        self._recovery_point = None
+        self._num_partial_acks = 0
+        self._num_acks_repeated = 0
+
+    def keeps_retransmit_timer(self):
+        # With SACK, the lost packets are all retransmitted in about a round
+        # trip, so every partial ack restarts the timer, as in RFC 6675.
+        return self._num_partial_acks > 1 and not self._flow.uses_sack()
+
+    def on_ack(self, ack_number, num_acked, rtt):
+        """Updates the window on an ack.
+
+        Args:
+            ack_number: The ack number.
+            num_acked: The number of packets newly acked, 0 for a duplicate
+                ack.
+            rtt: The round trip time measured from the ack.
+        """
+        raise NotImplementedError
+
+    def on_loss(self):
+        """Called when a loss is detected from duplicate acks."""
+        raise NotImplementedError
+
+
+@register_congestion_control('cubic')
+class CubicCongestionControl(RecoveringCongestionControl):
+    """CUBIC (RFC 8312). After a loss, the window follows a cubic function of
+    the time since the loss, C * (t - K)^3 + W_max, which is flat around the
+    window W_max the loss happened at and grows quickly away from it, so
+    that the growth does not depend on the round trip time. The window never
+    grows slower than the Reno window would (the TCP-friendly region).
+
+    Attributes:
+        _ss_threshold: The slow start threshold.
+        _w_max: The window size before the last window reduction.
+        _epoch_start: The time the current cubic epoch started, or None.
+        _origin: The window size the cubic function plateaus at.
+        _k: The time after the epoch start when the cubic function reaches
+            _origin.
+        _w_est: The window size Reno would have in the same epoch.
+    """
+
+    def __init__(self, flow, controller):
+        super().__init__(flow, controller)
+        self._ss_threshold = float('inf')
+        self._w_max = 0.0
+        self._epoch_start = None
+        self._origin = 0.0
+        self._k = 0.0
+        self._w_est = 0.0
+
+    def get_state(self):
+        if self._recovery_point is not None:
+            return FlowStates.CubicRecovery
+        if self._flow.get_window_size() < self._ss_threshold:
+            return FlowStates.CubicSlowStart
+        return FlowStates.CubicCA
+
+    def on_ack(self, ack_number, num_acked, rtt):
+        if num_acked == 0 or self._recovery_point is not None:
+            return
+        flow = self._flow
+        window_size = flow.get_window_size()
+        if window_size < self._ss_threshold:
+            flow.set_window_size(window_size + num_acked)
+            return
+
+        now = self._controller.get_current_time()
+        if self._epoch_start is None:
+            self._epoch_start = now
+            if window_size < self._w_max:
+                self._k = ((self._w_max - window_size) / flow.CUBIC_C) ** \
+                    (1.0 / 3)
+                self._origin = self._w_max
+            else:
+                self._k = 0.0
+                self._origin = window_size
+            self._w_est = window_size
+        t = now + self._min_rtt - self._epoch_start
+        target = self._origin + flow.CUBIC_C * (t - self._k) ** 3
+        if target > window_size:
+            window_size += num_acked * (target - window_size) / window_size
+        else:
+            window_size += num_acked * 0.01 / window_size
+        beta = flow.CUBIC_BETA
+        self._w_est += num_acked * 3 * (1 - beta) / (1 + beta) / window_size
+        flow.set_window_size(max(window_size, self._w_est))
+
+    def _reduce(self):
+        """Starts a new epoch after a loss, and returns the reduced window."""
+        flow = self._flow
+        window_size = flow.get_window_size()
+        self._epoch_start = None
+        if window_size < self._w_max:
+            # Fast convergence: release bandwidth to newer flows.
+            self._w_max = window_size * (1 + flow.CUBIC_BETA) / 2
+        else:
+            self._w_max = window_size
+        return max(window_size * flow.CUBIC_BETA, 2.0)
+
+    def on_loss(self):
+        window_size = self._reduce()
+        self._ss_threshold = window_size
+        self._flow.set_window_size(window_size)
+
+    def on_timeout(self):
+        super().on_timeout()
+        self._ss_threshold = self._reduce()
+        self._flow.set_window_size(1.0)
+
+
+@register_congestion_control('bbr')
+class BbrCongestionControl(RecoveringCongestionControl):
+    """A BBR-style model-based algorithm. It estimates the bottleneck
+    bandwidth as the largest delivery rate measured over the last
+    BW_WINDOW_ROUNDS round trips and the propagation delay as the smallest
+    round trip time over the last MIN_RTT_WINDOW seconds, paces the packets
+    at a gain times the bandwidth and caps the packets in flight at a gain
+    times the bandwidth-delay product. Losses are retransmitted but do not
+    change the model.
+
+    The flow starts in BbrStartup, doubling its rate every round trip until
+    the bandwidth stops growing by FULL_BW_GROWTH for FULL_BW_ROUNDS rounds,
+    drains the queue this built in BbrDrain, then cycles through
+    PROBE_BW_GAINS in BbrProbeBW, one round trip time per gain. If the
+    smallest round trip time has not been measured again for MIN_RTT_WINDOW
+    seconds, the flow spends PROBE_RTT_TIME with at most MIN_WINDOW packets
+    in flight in BbrProbeRTT to measure it.
+
+    Each ack gives a delivery rate sample: the packets delivered between the
+    send of the acked packet and its ack, over the longer of the send and
+    ack intervals. The acks do not carry sequence numbers of the data they
+    ack, so the acked packet is found by the send time it echoes.
+
+    Attributes:
+        _state: The FlowStates state.
+        _sent: The (send time, delivered, delivered time, first sent time)
+            of the packets sent and not acked yet, in the order sent.
+        _bw_samples: The (round, delivery rate in packets per second) samples
+            of the bandwidth window, with decreasing rates.
+        _btl_bw: The estimated bottleneck bandwidth in packets per second, or
+            None before the first sample.
+        _min_rtt_time: The time _min_rtt was measured at.
+        _delivered: The number of packets acked.
+        _delivered_time: The time _delivered last changed.
+        _first_sent_time: The send time of the packet acked last.
+        _round_count: The number of round trips completed.
+        _round_end: The sequence number whose ack ends the current round.
+        _full_bw: The bandwidth that startup last grew to.
+        _full_bw_rounds: The number of rounds without enough growth.
+        _filled_pipe: True once the startup found the bottleneck bandwidth.
+        _cycle_index: The index in PROBE_BW_GAINS.
+        _cycle_start_time: The time the current gain cycle phase started.
+        _probe_rtt_done_time: The time BbrProbeRTT ends, or None until few
+            enough packets are in flight.
+        _pacing_gain: The current pacing gain.
+        _cwnd_gain: The current window gain.
+    """
+
+    HIGH_GAIN = 2 / math.log(2)
+    PROBE_BW_GAINS = (1.25, 0.75, 1.0, 1.0, 1.0, 1.0, 1.0, 1.0)
+    PROBE_BW_CWND_GAIN = 2.0
+    BW_WINDOW_ROUNDS = 10
+    MIN_RTT_WINDOW = 10.0
+    PROBE_RTT_TIME = 0.2
+    MIN_WINDOW = 4.0
+    FULL_BW_GROWTH = 1.25
+    FULL_BW_ROUNDS = 3
+
+    def __init__(self, flow, controller):
+        super().__init__(flow, controller)
+        self._state = FlowStates.BbrStartup
+        self._sent = deque()
+        self._bw_samples = deque()
+        self._btl_bw = None
+        self._min_rtt_time = 0.0
+        self._delivered = 0
+        self._delivered_time = None
+        self._first_sent_time = None
+        self._round_count = 0
+        self._round_end = 0
+        self._full_bw = 0.0
+        self._full_bw_rounds = 0
+        self._filled_pipe = False
+        self._cycle_index = 0
+        self._cycle_start_time = 0.0
+        self._probe_rtt_done_time = None
+        self._pacing_gain = self.HIGH_GAIN
+        self._cwnd_gain = self.HIGH_GAIN
+
+    def get_state(self):
+        return self._state
+
+    def get_pacing_rate(self):
+        if self._btl_bw is None:
+            return None
+        return self._pacing_gain * self._btl_bw
+
+    def _bdp(self):
+        """Returns the estimated bandwidth-delay product in packets."""
+        return self._btl_bw * self._min_rtt
+
+    def on_send(self, packet):
+        send_time = packet.get_data_time()
+        if self._delivered_time is None:
+            self._delivered_time = send_time
+            self._first_sent_time = send_time
+        self._sent.append((send_time, self._delivered, self._delivered_time,
+            self._first_sent_time))
+
+    def on_ack(self, ack_number, num_acked, rtt):
+        flow = self._flow
+        now = self._controller.get_current_time()
+        if num_acked > 0:
+            self._delivered += num_acked
+            self._delivered_time = now
+        self._sample_delivery_rate(now, now - rtt)
+
+        min_rtt_expired = now > self._min_rtt_time + self.MIN_RTT_WINDOW
+        if rtt <= self._min_rtt or min_rtt_expired:
+            if min_rtt_expired and self._state != FlowStates.BbrProbeRTT:
+                self._enter_probe_rtt()
+            self._min_rtt = rtt
+            self._min_rtt_time = now
+
+        if num_acked > 0 and ack_number >= self._round_end:
+            self._end_round()
+
+        if self._btl_bw is None:
+            pass
+        elif self._state == FlowStates.BbrDrain:
+            if flow.num_unacked_packets() <= self._bdp():
+                self._enter_probe_bw(now)
+        elif self._state == FlowStates.BbrProbeBW:
+            self._update_gain_cycle(now)
+        elif self._state == FlowStates.BbrProbeRTT:
+            if self._probe_rtt_done_time is None:
+                if flow.num_unacked_packets() <= self.MIN_WINDOW:
+                    self._probe_rtt_done_time = now + max(self.PROBE_RTT_TIME,
+                        self._min_rtt)
+            elif now >= self._probe_rtt_done_time:
+                self._min_rtt_time = now
+                if self._filled_pipe:
+                    self._enter_probe_bw(now)
+                else:
+                    self._state = FlowStates.BbrStartup
+                    self._pacing_gain = self.HIGH_GAIN
+                    self._cwnd_gain = self.HIGH_GAIN
+        self._update_window(num_acked)
+
+    def _sample_delivery_rate(self, now, send_time):
+        """Adds the delivery rate sample of the packet sent at send_time,
+        which was just acked."""
+        sent = None
+        while self._sent and self._sent[0][0] <= send_time:
+            sent = self._sent.popleft()
+        if sent is None or sent[0] != send_time:
+            return
+        _, delivered, delivered_time, first_sent_time = sent
+        self._first_sent_time = send_time
+        interval = max(send_time - first_sent_time, now - delivered_time)
+        if interval <= 0 or interval < self._min_rtt:
+            return
+        rate = (self._delivered - delivered) / interval
+        # Keep the samples of the window in decreasing order of rate, so that
+        # the first one is the largest.
+        while self._bw_samples and self._bw_samples[-1][1] <= rate:
+            self._bw_samples.pop()
+        self._bw_samples.append((self._round_count, rate))
+        while (self._bw_samples[0][0] <=
+                self._round_count - self.BW_WINDOW_ROUNDS):
+            self._bw_samples.popleft()
+        self._btl_bw = self._bw_samples[0][1]
+
+    def _end_round(self):
+        self._round_count += 1
+        self._round_end = self._flow.get_sequence_number()
+        while (self._bw_samples and self._bw_samples[0][0] <=
+                self._round_count - self.BW_WINDOW_ROUNDS):
+            self._bw_samples.popleft()
+        if self._bw_samples:
+            self._btl_bw = self._bw_samples[0][1]
+
+        if self._btl_bw is not None and not self._filled_pipe:
+            if self._btl_bw >= self._full_bw * self.FULL_BW_GROWTH:
+                self._full_bw = self._btl_bw
+                self._full_bw_rounds = 0
+            else:
+                self._full_bw_rounds += 1
+                if self._full_bw_rounds >= self.FULL_BW_ROUNDS:
+                    self._filled_pipe = True
+                    if self._state == FlowStates.BbrStartup:
+                        self._state = FlowStates.BbrDrain
+                        self._pacing_gain = 1 / self.HIGH_GAIN
+
+    def _update_gain_cycle(self, now):
+        """Moves to the next gain of the cycle. The probing phase lasts until
+        the extra packets are in flight or lost, and the draining phase ends
+        early once the queue is drained."""
+        num_in_flight = self._flow.num_unacked_packets()
+        full_length = now - self._cycle_start_time > self._min_rtt
+        if self._pacing_gain > 1:
+            advance = full_length and (self.is_recovering() or
+                num_in_flight >= self._pacing_gain * self._bdp())
+        elif self._pacing_gain < 1:
+            advance = full_length or num_in_flight <= self._bdp()
+        else:
+            advance = full_length
+        if advance:
+            self._cycle_index = (self._cycle_index + 1) % \
+                len(self.PROBE_BW_GAINS)
+            self._cycle_start_time = now
+            self._pacing_gain = self.PROBE_BW_GAINS[self._cycle_index]
+
+    def _enter_probe_bw(self, now):
+        self._state = FlowStates.BbrProbeBW
+        self._cycle_index = 0
+        self._cycle_start_time = now
+        self._pacing_gain = self.PROBE_BW_GAINS[0]
+        self._cwnd_gain = self.PROBE_BW_CWND_GAIN
+
+    def _enter_probe_rtt(self):
+        self._state = FlowStates.BbrProbeRTT
+        self._pacing_gain = 1.0
+        self._probe_rtt_done_time = None
+
+    def _update_window(self, num_acked):
+        flow = self._flow
+        window_size = flow.get_window_size()
+        if self._btl_bw is None:
+            window_size += num_acked
+        else:
+            target = self._cwnd_gain * self._bdp() + self.MIN_WINDOW
+            if self._filled_pipe:
+                window_size = min(window_size + num_acked, target)
+            elif window_size < target:
+                window_size += num_acked
+        if self._state == FlowStates.BbrProbeRTT:
+            window_size = min(window_size, self.MIN_WINDOW)
+        flow.set_window_size(max(window_size, self.MIN_WINDOW))
+
+    def on_loss(self):
+        pass
+
+    def on_timeout(self):
+        super().on_timeout()
+        self._flow.set_window_size(1.0)
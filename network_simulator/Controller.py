@@ -4,12 +4,21 @@ from collections import defaultdict
 from Device import Host, Router
 from EventQueue import EventQueue
 from Flow import Flow
+from Fluid import FluidModel
 from Link import Link
+from Metrics import Accumulator, SteadyStateDetector, open_metrics_sink
+from Profiling import EventProfiler
+from Routing import link_adjacency, link_delay_weight, link_throughput_weight
+from Routing import routing_tables
 import matplotlib
 from matplotlib import pyplot
 from optparse import OptionParser
+import gzip
 import json
 import numpy
+import pickle
+import sys
+import time
 
 font = {
   'weight': 'bold',
@@ -21,6 +30,11 @@ matplotlib.rc('font', **font)
 class Controller(object):
     """The main controller class.
 
+    The whole state of a simulation can be saved to a checkpoint file with
+    save_checkpoint, and loaded back with load_checkpoint to resume it, or to
+    run several different continuations of it. The graphs and the metrics
+    sinks are not part of a checkpoint.
+
     Attributes:
         _filename: The filename of the JSON representation of the network that
             will be used in the simulation.
@@ -33,18 +47,91 @@ class Controller(object):
             that happen and the order in which they happen.
         _links: The list of links in the network.
         _devices: The list of devices (hosts and routers) in the network.
-        _flows: The list of flows in the network, which represents the data
-            source and destination.
+        _flows: The flows in the network that have not finished sending, keyed
+            by flow id.
         _logs: The logs resulting from the simulation.
         _show_on_plot: The set of links to show on the plot.
+        _live_graphing: True if the plots are redrawn as new points arrive,
+            i.e. init_graphing has been called.
+        _keep_time_series: True if the aggregated points are kept in memory
+            for get_time_series and draw_graphs.
+        _metrics_sinks: The sinks the aggregated points are streamed to.
+        _num_events: The number of events processed so far.
+        _routing: The routing mode, one of ROUTING_MODES.
+        _routing_weight: The link weight of the shortest-path routing mode,
+            one of ROUTING_WEIGHTS.
+        _routing_interval: The interval in seconds at which the shortest-path
+            routes are recomputed with the estimated link costs, or 0 to keep
+            the routes computed at load time.
+        _multipath: The equal-cost multipath mode, one of MULTIPATH_MODES, or
+            None for single-path routing.
+        _steady_state_detector: The SteadyStateDetector fed with the
+            aggregated points while run is looking for a steady state, or
+            None.
+        _steady_state_reached: True once the steady state has been detected.
+        _profiler: The EventProfiler that records the events, or None if
+            profiling is disabled.
+        _fluid_model: The FluidModel that fast-forwards the steady flows, or
+            None if the fluid mode is disabled.
+        _max_train_length: The maximum number of packets sent as one packet
+            train, or 0 if packet trains are disabled.
     """
 
+    ROUTING_MODES = ('bellman-ford', 'incremental', 'shortest-path')
+
+    MULTIPATH_MODES = ('hash', 'weighted')
+
+    # The link weights of the shortest-path routing mode.
+    ROUTING_WEIGHTS = {
+        'delay': link_delay_weight,
+        'throughput': link_throughput_weight,
+    }
+
+    # The reasons run can stop for.
+    STOP_REASONS = (
+        'flows-done',
+        'no-events',
+        'time',
+        'max-events',
+        'wall-clock',
+        'steady-state',
+    )
+
+    # The log types that must settle for the steady state.
+    STEADY_STATE_LOG_TYPES = ('flow-rate', 'window-size')
+
+    # The number of events between two checks of the wall-clock budget.
+    WALL_CLOCK_CHECK_INTERVAL = 1024
+
+    # The recursion limit while pickling a checkpoint.
+    CHECKPOINT_RECURSION_LIMIT = 100000
+
+    LOG_TYPES = (
+        'flow-rate',
+        'window-size',
+        'link-rate',
+        'buffer-occupancy',
+        'packet-loss'
+    )
+
     def __init__(self, options):
         """Initializes the Controller instance.
 
         Args:
             options: A dictionary with option attributes. Currently supported
-                options are 'filename' and 'debug'.
+                options are 'filename', 'debug', 'log_interval_length',
+                'network', 'keep_time_series' and 'routing'. If 'network' is
+                given, it is used as the already parsed JSON representation of
+                the network instead of reading 'filename'. If
+                'keep_time_series' is False, the aggregated points are only
+                streamed to the metrics sinks. 'routing', 'routing_weight',
+                'routing_interval' and 'multipath' override the routing
+                settings of the network. If 'fluid' is True, steady flows are
+                fast-forwarded with a fluid model, see FluidModel. If
+                'max_train_length' is at least 2, the only flow sending from
+                a host sends up to that many packets as one train, see Host.
+                If 'sack' is True, all the flows use selective acks, not only
+                the ones with "sack" set in the network.
         """
         self._filename = options['filename']
         self._debug = options['debug']
@@ -56,28 +143,69 @@ class Controller(object):
         else:
             self._log_interval_length = 1.0
         self._event_queue = EventQueue()
+        self._num_events = 0
 
         self._links = {}
         self._devices = {}
         self._flows = {}
 
-        self._logs = {}
+        self._logs = {log_type: {} for log_type in self.LOG_TYPES}
         self._show_on_plot = set()
-
-        # Opens the file and parses the JSON representation of the network.
-        with open(self._filename) as f:
-            json_network = json.loads(f.read())
+        self._live_graphing = False
+        self._keep_time_series = options.get('keep_time_series', True)
+        self._metrics_sinks = []
+        self._steady_state_detector = None
+        self._steady_state_reached = False
+        self._profiler = None
+        self._fluid_model = None
+        if options.get('fluid'):
+            self._fluid_model = FluidModel(self)
+        self._max_train_length = int(options.get('max_train_length') or 0)
+
+        if options.get('network') is not None:
+            json_network = options['network']
+        else:
+            # Opens the file and parses the JSON representation of the network.
+            with open(self._filename) as f:
+                json_network = json.loads(f.read())
 
         json_hosts = json_network['hosts']
         json_links = json_network['links']
         json_flows = json_network['flows']
         json_routers = json_network['routers']
 
+        # The routing mode can be given in the JSON file, and overridden by
+        # the options.
+        if options.get('routing') is not None:
+            self._routing = options['routing']
+        else:
+            self._routing = json_network.get('routing', 'bellman-ford')
+        if self._routing not in self.ROUTING_MODES:
+            raise ValueError("Unsupported routing mode: %s" % self._routing)
+        self._routing_weight = json_network.get('routing_weight', 'delay')
+        if options.get('routing_weight') is not None:
+            self._routing_weight = options['routing_weight']
+        if self._routing_weight not in self.ROUTING_WEIGHTS:
+            raise ValueError("Unsupported routing weight: %s" %
+                self._routing_weight)
+        self._routing_interval = float(json_network.get('routing_interval', 0))
+        if options.get('routing_interval') is not None:
+            self._routing_interval = float(options['routing_interval'])
+        self._multipath = json_network.get('multipath')
+        if options.get('multipath') is not None:
+            self._multipath = options['multipath']
+        if (self._multipath is not None and
+                self._multipath not in self.MULTIPATH_MODES):
+            raise ValueError("Unsupported multipath mode: %s" %
+                self._multipath)
+
         links = {}
         devices = {}
 
         for json_link in json_links:
             link_id = json_link['id']
+            if 'show_on_plot' in json_link and json_link['show_on_plot']:
+                self._show_on_plot.add(link_id)
             # Throughputs are in Mbps; need to convert to MBps.
             self._links[link_id] = Link(
                 controller=self,
@@ -88,8 +216,6 @@ class Controller(object):
                 buffer_size=json_link['buffer_size'],
                 link_id=link_id,
                 )
-            if 'show_on_plot' in json_link and json_link['show_on_plot']:
-                self._show_on_plot.add(link_id)
 
         for json_host in json_hosts:
             host_id = json_host['id']
@@ -110,8 +236,12 @@ class Controller(object):
                 controller=self,
                 links={x: self._links[x] for x in json_router['links']},
                 device_id=router_id,
-                bf_freq=json_router['BFfreq'],
-                routing_table=routing_table
+                # Routes are computed centrally in the shortest-path mode.
+                bf_freq=(0 if self._routing == 'shortest-path'
+                         else json_router['BFfreq']),
+                routing_table=routing_table,
+                incremental_bf=(self._routing == 'incremental'),
+                multipath=self._multipath,
                 )
 
         # Now add the references to the devices onto the links.
@@ -126,6 +256,9 @@ class Controller(object):
             self._links[link_id].set_left_device(left_device)
             self._links[link_id].set_right_device(right_device)
 
+        if self._routing == 'shortest-path':
+            self.update_shortest_path_routes(False)
+
         for json_flow in json_flows:
             # Instantiate the flow in the source host and the event in
             # EventQueue.
@@ -135,6 +268,9 @@ class Controller(object):
             flow_start = json_flow['start_time']
             flow_id = json_flow['id']
             tcp = json_flow['tcp']
+            sack = bool(json_flow.get('sack') or options.get('sack'))
+            if 'show_on_plot' in json_flow and json_flow['show_on_plot']:
+                self._show_on_plot.add(flow_id)
             src_host = self._devices[src_id]
             flow = Flow(
                 self,
@@ -142,23 +278,166 @@ class Controller(object):
                 dst_id,
                 flow_id,
                 tcp,
-                num_bytes
+                num_bytes,
+                sack
                 )
             src_host.add_flow(flow_id, flow)
-            self._event_queue.add_event(flow_start, src_host.send_next_packet,
-                [flow])
-            self._flows[flow_id] = True
-            if 'show_on_plot' in json_flow and json_flow['show_on_plot']:
-                self._show_on_plot.add(flow_id)
+            self._event_queue.add_event(flow_start, self.start_flow, [flow])
+            self._flows[flow_id] = flow
         self.devices = self._devices
+        if self._fluid_model is not None:
+            self._fluid_model.start()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        # Plots and open files can't be pickled; they are set up again after
+        # loading a checkpoint.
+        state['_live_graphing'] = False
+        state['_metrics_sinks'] = []
+        logs = {}
+        for log_type, log in self._logs.items():
+            log = {x: y for x, y in log.items() if x != 'subplot'}
+            if 'devices' in log:
+                log['devices'] = {
+                    device_name: {x: y for x, y in device_log.items()
+                                  if x != 'line'}
+                    for device_name, device_log in log['devices'].items()
+                }
+            logs[log_type] = log
+        state['_logs'] = logs
+        return state
+
+    def save_checkpoint(self, filename):
+        """Saves the whole state of the simulation to a compressed file. Call
+        it between events, e.g. after run returns.
+
+        Args:
+            filename: The name of the checkpoint file.
+        """
+        # The devices, links and flows reference each other, so pickling
+        # recurses deeply on large networks.
+        recursion_limit = sys.getrecursionlimit()
+        sys.setrecursionlimit(max(recursion_limit,
+            self.CHECKPOINT_RECURSION_LIMIT))
+        try:
+            # The top compression levels are much slower for little gain.
+            with gzip.open(filename, 'wb', compresslevel=6) as f:
+                pickle.dump(self, f, pickle.HIGHEST_PROTOCOL)
+        finally:
+            sys.setrecursionlimit(recursion_limit)
+
+    @classmethod
+    def load_checkpoint(cls, filename):
+        """Loads a simulation saved by save_checkpoint. Each call returns an
+        independent copy, so the same checkpoint can be resumed several times,
+        e.g. with different metrics sinks or for different lengths of time.
+
+        Args:
+            filename: The name of the checkpoint file.
+
+        Returns:
+            The Controller of the loaded simulation.
+        """
+        recursion_limit = sys.getrecursionlimit()
+        sys.setrecursionlimit(max(recursion_limit,
+            cls.CHECKPOINT_RECURSION_LIMIT))
+        try:
+            with gzip.open(filename, 'rb') as f:
+                controller = pickle.load(f)
+        finally:
+            sys.setrecursionlimit(recursion_limit)
+        if not isinstance(controller, cls):
+            raise ValueError("Not a checkpoint file: %s" % filename)
+        return controller
 
     def add_event(self, *args):
         """Adds an event to the event queue.
 
         Args:
             *args: The events the add.
+
+        Returns:
+            A handle that can be passed to cancel_event.
+        """
+        return self._event_queue.add_event(*args)
+
+    def cancel_event(self, handle):
+        """Cancels an event that has not happened yet.
+
+        Args:
+            handle: The handle returned by add_event.
+        """
+        self._event_queue.cancel_event(handle)
+
+    def update_shortest_path_routes(self, use_link_costs=True):
+        """Computes the routing tables of all the routers with Dijkstra's
+        algorithm, without sending any packets. If a routing interval is set,
+        the next update is scheduled.
+
+        Args:
+            use_link_costs: True to add the current estimated cost of each link
+                (its queueing delay) to its weight.
+        """
+        weight = self.ROUTING_WEIGHTS[self._routing_weight]
+        if use_link_costs:
+            static_weight = weight
+            weight = lambda link, from_device_id: \
+                static_weight(link, from_device_id) + \
+                link.estimate_cost(from_device_id)
+
+        router_ids = [x for x, device in self._devices.items()
+                      if isinstance(device, Router)]
+        host_ids = [x for x, device in self._devices.items()
+                    if isinstance(device, Host)]
+        tables = routing_tables(link_adjacency(self._links.values(), weight),
+            router_ids, host_ids, self._multipath is not None)
+        for router_id, table in tables.items():
+            self._devices[router_id].set_routing_table(table)
+
+        if self._routing_interval > 0:
+            self.add_event(self._current_time + self._routing_interval,
+                self.update_shortest_path_routes, [True])
+
+    def start_flow(self, flow):
+        """Starts sending the packets of a flow."""
+        if self._fluid_model is not None:
+            self._fluid_model.notify_flow_start(flow)
+        self._devices[flow.get_src_id()].send_next_packet(flow)
+
+    def get_fluid_model(self):
+        """Returns the FluidModel, or None if the fluid mode is disabled."""
+        return self._fluid_model
+
+    def get_max_train_length(self):
+        """Returns the maximum number of packets sent as one packet train, or
+        0 if packet trains are disabled."""
+        return self._max_train_length
+
+    def enable_profiling(self):
+        """Starts recording the count and wall-clock time of the events by
+        callback, the event queue size and the events per simulated second.
+        This slows the simulation down a little.
+
+        Returns:
+            The EventProfiler, which can print a summary after the run.
+        """
+        if self._profiler is None:
+            self._profiler = EventProfiler()
+        return self._profiler
+
+    def get_profiler(self):
+        """Returns the EventProfiler, or None if profiling is disabled."""
+        return self._profiler
+
+    def is_instrumented(self, device_name):
+        """Returns whether the logs of a link or flow are collected. Links and
+        flows call this once when they are constructed, and skip calling log
+        altogether if it returns False.
+
+        Args:
+            device_name: The id of the link or flow.
         """
-        self._event_queue.add_event(*args)
+        return device_name in self._show_on_plot
 
     def get_current_time(self):
         """Returns the current time in the network simulation.
@@ -176,6 +455,24 @@ class Controller(object):
         """
         self._flows.pop(flow.get_flow_id())
 
+    def get_num_events(self):
+        """Returns the number of events processed so far."""
+        return self._num_events
+
+    def get_num_packets_transmitted(self):
+        """Returns the number of packets put on the wire by all the links so
+        far."""
+        return sum(link.get_num_packets_transmitted()
+                   for link in self._links.values())
+
+    def num_active_flows(self):
+        """Returns the number of flows that have not finished sending."""
+        return len(self._flows)
+
+    def get_active_flows(self):
+        """Returns the list of the flows that have not finished sending."""
+        return list(self._flows.values())
+
     def _process_temp_interval_values(self):
         """Moves data point into X, Y lists and resets all temp intervals.
         """
@@ -189,22 +486,41 @@ class Controller(object):
                 for device_name in devices_logs:
                     device_log = self._logs[log_type]['devices'][device_name]
 
-                    temp_values = device_log['temp_interval_values']
-                    if temp_values:
+                    accumulator = device_log['temp_interval_accumulator']
+                    if accumulator.count:
                         time = self._log_interval_start + interval_length / 2.0
                         aggregated_value = self._logs[log_type] \
-                            ['values_aggregator'](temp_values, interval_length)
+                            ['values_aggregator'](accumulator, interval_length)
 
                         self._new_point(log_type, device_name, time,
                             aggregated_value)
 
-                        device_log['temp_interval_values'] = []
+                        accumulator.reset()
 
         self._log_interval_start = int(self._current_time /
             self._log_interval_length) * self._log_interval_length
 
+        if self._steady_state_detector is not None:
+            self._check_steady_state()
+
+    def _check_steady_state(self):
+        """Sets _steady_state_reached if the flows that are still active have
+        all started logging, and all the series that are still being logged
+        have settled."""
+        for flow_id in self._flows:
+            if (flow_id in self._show_on_plot and not
+                    self._steady_state_detector.has_series('flow-rate',
+                        flow_id)):
+                return
+        # Points are logged at the middle of their interval, so allow for one
+        # missed interval before a series counts as finished.
+        min_time = self._current_time - 2 * self._log_interval_length
+        if self._steady_state_detector.is_steady(min_time):
+            self._steady_state_reached = True
+
     def _new_point(self, log_type, device_name, x, y):
-        """Creates a new point in the plot and draws.
+        """Records a new point in the time series and, if graphing live,
+        redraws the plot.
 
         Args:
             log_type: The type of log.
@@ -212,7 +528,19 @@ class Controller(object):
             x: The x position of the point.
             y: The y position of the point.
         """
-        line = self._logs[log_type]['devices'][device_name]['line']
+        for sink in self._metrics_sinks:
+            sink.write_point(log_type, device_name, x, y)
+        if self._steady_state_detector is not None:
+            self._steady_state_detector.add_point(log_type, device_name, x, y)
+
+        device_log = self._logs[log_type]['devices'][device_name]
+        if self._keep_time_series:
+            device_log['x_values'].append(x)
+            device_log['y_values'].append(y)
+        if not self._live_graphing:
+            return
+
+        line = device_log['line']
         line.set_xdata(numpy.append(line.get_xdata(), x))
         line.set_ydata(numpy.append(line.get_ydata(), y))
         self._logs[log_type]['subplot'].set_ymargin(0.05)
@@ -221,14 +549,19 @@ class Controller(object):
         self._logs[log_type]['subplot'].set_ylim(bottom=0, auto=True)
         pyplot.draw()
 
+    @staticmethod
+    def mean_aggregator(accumulator, interval_length):
+        """Returns the average of the values logged in an interval."""
+        return accumulator.mean()
+
     def log(
         self,
         log_type,
         device_name,
         value,
-        values_aggregator=lambda values, interval_length:
-            sum(values) / float(len(values)),
+        values_aggregator=None,
         ylabel=None,
+        quantiles=(),
     ):
         """Logs the data using a given aggregator.
 
@@ -236,12 +569,17 @@ class Controller(object):
             log_type: The type of log.
             device_name: The name of the device.
             value: The value to log.
-            values_aggregator: Function that takes values, and aggregates them.
-                By default, the average aggregator is used.
+            values_aggregator: Function that takes the Accumulator of the
+                values logged in an interval and the interval length, and
+                aggregates them. By default, mean_aggregator is used.
             ylabel: The label on the y-axis. By default, the log type is used.
+            quantiles: The quantiles the Accumulator estimates, for use by the
+                values aggregator.
         """
         if device_name not in self._show_on_plot:
             return
+        if values_aggregator is None:
+            values_aggregator = self.mean_aggregator
         if ylabel is None:
             ylabel = log_type
 
@@ -249,64 +587,210 @@ class Controller(object):
         if 'devices' not in self._logs[log_type]:
             self._logs[log_type]['devices'] = {}
             self._logs[log_type]['values_aggregator'] = values_aggregator
+            self._logs[log_type]['quantiles'] = quantiles
             self._logs[log_type]['min_y'] = 0.0
             self._logs[log_type]['max_y'] = 1.0
             self._logs[log_type]['min_x'] = 0.0
             self._logs[log_type]['max_x'] = 15.0
             self._logs[log_type]['ylabel'] = ylabel
-            self._logs[log_type]['subplot'].set_ylabel(ylabel)
+            if self._live_graphing:
+                self._logs[log_type]['subplot'].set_ylabel(ylabel)
 
         if device_name not in self._logs[log_type]['devices']:
             self._logs[log_type]['devices'][device_name] = {
-                'temp_interval_values': [],
+                'temp_interval_accumulator': Accumulator(
+                    self._logs[log_type]['quantiles']),
+                'x_values': [],
+                'y_values': [],
             }
-            self._logs[log_type]['devices'][device_name]['line'], = \
-                self._logs[log_type]['subplot'].plot([], [], label=device_name)
-            self._logs[log_type]['subplot'].legend(bbox_to_anchor=(1.1, 1.0))
+            if self._live_graphing:
+                self._logs[log_type]['devices'][device_name]['line'], = \
+                    self._logs[log_type]['subplot'].plot([], [],
+                        label=device_name)
+                self._logs[log_type]['subplot'].legend(
+                    bbox_to_anchor=(1.1, 1.0))
 
         if (self._current_time - self._log_interval_length >=
                 self._log_interval_start):
             self._process_temp_interval_values()
 
-        self._logs[log_type]['devices'][device_name]['temp_interval_values'] \
-            .append(value)
+        self._logs[log_type]['devices'][device_name] \
+            ['temp_interval_accumulator'].add(value)
 
     def init_graphing(self):
-        """Initializes the graphing functionality.
+        """Initializes the graphing functionality. The plots are redrawn live
+        as new points are logged. Skip this call to run headless.
         """
         pyplot.ion()
 
-        subplots = (
-            'flow-rate',
-            'window-size',
-            'link-rate',
-            'buffer-occupancy',
-            'packet-loss'
-        )
-        f, axarr = pyplot.subplots(len(subplots), sharex=True)
-
-        for index, subplot in enumerate(subplots):
-            self._logs[subplot] = {}
+        f, axarr = pyplot.subplots(len(self.LOG_TYPES), sharex=True)
+
+        for index, subplot in enumerate(self.LOG_TYPES):
             self._logs[subplot]['subplot'] = axarr[index]
+            # After loading a checkpoint, some devices are already logged.
+            log = self._logs[subplot]
+            if 'devices' not in log:
+                continue
+            axarr[index].set_ylabel(log['ylabel'])
+            for device_name, device_log in sorted(log['devices'].items()):
+                device_log['line'], = axarr[index].plot(
+                    device_log['x_values'], device_log['y_values'],
+                    label=device_name)
+            axarr[index].legend(bbox_to_anchor=(1.1, 1.0))
 
         axarr[-1].set_xlabel('time (s)')
         pyplot.autoscale()
+        self._live_graphing = True
+
+    def add_metrics_sink(self, sink):
+        """Streams the aggregated points to a sink as the simulation runs.
+
+        Args:
+            sink: The MetricsSink, e.g. from Metrics.open_metrics_sink.
+        """
+        self._metrics_sinks.append(sink)
+
+    def flush_logs(self):
+        """Aggregates the points of the interval that is still being
+        collected."""
+        if self._current_time > self._log_interval_start:
+            self._process_temp_interval_values()
+
+    def close_metrics_sinks(self):
+        """Flushes the logs and closes all the metrics sinks."""
+        self.flush_logs()
+        for sink in self._metrics_sinks:
+            sink.close()
+        self._metrics_sinks = []
+
+    def get_logged_devices(self, log_type):
+        """Returns the sorted names of the devices logged for a log type.
+
+        Args:
+            log_type: The type of log.
+        """
+        return sorted(self._logs[log_type].get('devices', {}))
 
-    def run(self, num_seconds):
-        """Runs the simulation.
+    def get_time_series(self, log_type, device_name):
+        """Returns the logged time series for a device.
 
         Args:
-            num_seconds: The number of seconds to run the simulation.
+            log_type: The type of log.
+            device_name: The name of the device.
+
+        Returns:
+            A tuple (x_values, y_values) of lists, or None if nothing has been
+            logged for the device.
+        """
+        devices_logs = self._logs[log_type].get('devices', {})
+        if device_name not in devices_logs:
+            return None
+        device_log = devices_logs[device_name]
+        return (device_log['x_values'], device_log['y_values'])
+
+    def draw_graphs(self, filename=None):
+        """Draws all the logged time series at once. Used after a headless run.
+
+        Args:
+            filename: If given, the figure is saved to this file instead of
+                being shown. The format (e.g. PNG or SVG) is taken from the
+                file extension.
         """
-        while (
-            not self._event_queue.is_empty()
-            and self.get_current_time() < num_seconds
-            and len(self._flows) > 0
-        ):
-            event = self._event_queue.pop_event()
-            event_time, event_method, event_args = event
-            self._current_time = event_time
-            event_method(*event_args)
+        self.flush_logs()
+
+        f, axarr = pyplot.subplots(len(self.LOG_TYPES), sharex=True)
+
+        for index, log_type in enumerate(self.LOG_TYPES):
+            subplot = axarr[index]
+            log = self._logs[log_type]
+            if 'devices' not in log:
+                continue
+            subplot.set_ylabel(log['ylabel'])
+            for device_name, device_log in sorted(log['devices'].items()):
+                subplot.plot(device_log['x_values'], device_log['y_values'],
+                    label=device_name)
+            subplot.legend(bbox_to_anchor=(1.1, 1.0))
+            subplot.set_ymargin(0.05)
+            subplot.relim()
+            subplot.autoscale_view()
+            subplot.set_ylim(bottom=0, auto=True)
+
+        axarr[-1].set_xlabel('time (s)')
+
+        if filename is not None:
+            f.savefig(filename, bbox_inches='tight')
+            pyplot.close(f)
+        else:
+            pyplot.show()
+
+    def run(
+        self,
+        num_seconds=float('inf'),
+        max_events=None,
+        max_wall_seconds=None,
+        steady_state=None,
+        steady_state_window=10,
+    ):
+        """Runs the simulation until all the flows are done, or one of the
+        given stop conditions is met.
+
+        Args:
+            num_seconds: The simulated time to stop at, in seconds.
+            max_events: The largest number of events to process in this call.
+            max_wall_seconds: The wall-clock budget of this call, in seconds.
+                It is checked every WALL_CLOCK_CHECK_INTERVAL events.
+            steady_state: If given, stop once the logged flow rates and
+                window sizes have settled: the mean of each series over the
+                last window is within this tolerance of its mean over the
+                window before, relative to it, e.g. 0.05. Only the flows shown
+                on the plot are watched, see SteadyStateDetector.
+            steady_state_window: The number of log intervals in each window
+                of the steady state detection.
+
+        Returns:
+            The reason the simulation stopped, one of STOP_REASONS.
+        """
+        event_limit = float('inf')
+        if max_events is not None:
+            event_limit = self._num_events + max_events
+        deadline = None
+        if max_wall_seconds is not None:
+            deadline = time.perf_counter() + max_wall_seconds
+        if steady_state is not None:
+            self._steady_state_reached = False
+            self._steady_state_detector = SteadyStateDetector(
+                self.STEADY_STATE_LOG_TYPES, steady_state, steady_state_window)
+
+        try:
+            while True:
+                if not self._flows:
+                    return 'flows-done'
+                if self._event_queue.is_empty():
+                    return 'no-events'
+                if self._current_time >= num_seconds:
+                    return 'time'
+                if self._num_events >= event_limit:
+                    return 'max-events'
+                if self._steady_state_reached:
+                    return 'steady-state'
+                if (deadline is not None and self._num_events %
+                        self.WALL_CLOCK_CHECK_INTERVAL == 0 and
+                        time.perf_counter() >= deadline):
+                    return 'wall-clock'
+
+                event = self._event_queue.pop_event()
+                event_time, event_method, event_args = event
+                self._current_time = event_time
+                if self._profiler is None:
+                    event_method(*event_args)
+                else:
+                    start = time.perf_counter()
+                    event_method(*event_args)
+                    self._profiler.record_event(event_method, event_time,
+                        time.perf_counter() - start, len(self._event_queue))
+                self._num_events += 1
+        finally:
+            self._steady_state_detector = None
 
 
 if __name__ == '__main__':
@@ -318,13 +802,107 @@ if __name__ == '__main__':
     parser.add_option("-q", "--quiet", action="store_false", dest="verbose",
         default=True, help="don't print status messages to stdout")
     parser.add_option("--debug", action="store_true")
+    parser.add_option("--headless", action="store_true", default=False,
+        help="don't redraw the graphs during the simulation; draw them once "
+        "at the end instead")
+    parser.add_option("-o", "--output", dest="output_filename",
+        help="Save the graphs to this file (e.g. graphs.png or graphs.svg) "
+        "instead of showing them; implies --headless")
+    parser.add_option("--routing", dest="routing",
+        help="Routing mode, one of: %s (default: the 'routing' key of the "
+        "json file, or bellman-ford)" % ", ".join(Controller.ROUTING_MODES))
+    parser.add_option("--routing-weight", dest="routing_weight",
+        help="Link weight of the shortest-path routing mode, one of: %s "
+        "(default: delay)" % ", ".join(sorted(Controller.ROUTING_WEIGHTS)))
+    parser.add_option("--routing-interval", dest="routing_interval",
+        help="Recompute the shortest-path routes with the estimated link "
+        "costs at this interval in seconds (default: 0, never)")
+    parser.add_option("--multipath", dest="multipath",
+        help="Equal-cost multipath mode, one of: %s (default: the "
+        "'multipath' key of the json file, or single-path)" %
+        ", ".join(Controller.MULTIPATH_MODES))
+    parser.add_option("-t", "--time", dest="num_seconds", type="float",
+        default=float('inf'), help="Stop at this simulated time in seconds "
+        "(default: when all the flows are done)")
+    parser.add_option("--max-events", dest="max_events", type="int",
+        help="Stop after processing this many events")
+    parser.add_option("--wall-clock", dest="max_wall_seconds", type="float",
+        help="Stop after running for this many seconds of wall-clock time")
+    parser.add_option("--steady-state", dest="steady_state", type="float",
+        help="Stop once the mean flow rates and window sizes of the flows "
+        "shown on the plot change by less than this relative tolerance "
+        "between two windows, e.g. 0.05")
+    parser.add_option("--steady-state-window", dest="steady_state_window",
+        type="int", default=10, help="Number of log intervals per window of "
+        "--steady-state (default: 10)")
+    parser.add_option("--fluid", action="store_true", default=False,
+        help="Fast-forward the flows that are alone on their path and have "
+        "settled with a fluid model instead of simulating every packet")
+    parser.add_option("--trains", dest="max_train_length", type="int",
+        default=0, help="Send up to this many packets of a flow as one train "
+        "when it is the only flow on its host and link (default: 0, off)")
+    parser.add_option("--sack", action="store_true", default=False,
+        help="Use selective acks (SACK) for all the flows")
+    parser.add_option("--profile", action="store_true", default=False,
+        help="Print the count and time of the events by callback at the end")
+    parser.add_option("-m", "--metrics", dest="metrics_filename",
+        help="Stream the aggregated metrics to this file as the simulation "
+        "runs; the format is chosen by the extension: .csv, .jsonl or .bin")
+    parser.add_option("--no-graphs", action="store_false", dest="graphs",
+        default=True, help="don't draw any graphs and don't keep the metrics "
+        "in memory; implies --headless")
+    parser.add_option("--checkpoint", dest="checkpoint_filename",
+        help="Save the state of the simulation to this file at the "
+        "--checkpoint-time, then carry on")
+    parser.add_option("--checkpoint-time", dest="checkpoint_time",
+        type="float", help="Simulated time in seconds of the checkpoint")
+    parser.add_option("--restore", dest="restore_filename",
+        help="Resume the simulation saved in this checkpoint file instead of "
+        "loading a json file")
     options, _ = parser.parse_args()
-
-    network_controller = Controller(vars(options))
-
-    network_controller.init_graphing()
-    network_controller.run(float('inf'))
-
-    # This is necessary since otherwise the graph window disappears after the
-    # simulation finishes.
-    input()
+    if (options.checkpoint_filename is None) != \
+            (options.checkpoint_time is None):
+        parser.error("--checkpoint and --checkpoint-time go together")
+
+    if options.output_filename is not None or not options.graphs:
+        options.headless = True
+        # No display is needed when only saving to a file.
+        pyplot.switch_backend('Agg')
+    options.keep_time_series = options.graphs
+
+    if options.restore_filename is not None:
+        network_controller = Controller.load_checkpoint(
+            options.restore_filename)
+        # The checkpoint has the settings of the run that saved it.
+        network_controller._keep_time_series = options.keep_time_series
+    else:
+        network_controller = Controller(vars(options))
+    if options.metrics_filename is not None:
+        network_controller.add_metrics_sink(
+            open_metrics_sink(options.metrics_filename))
+
+    if options.profile:
+        network_controller.enable_profiling()
+    if not options.headless:
+        network_controller.init_graphing()
+    if options.checkpoint_filename is not None:
+        network_controller.run(options.checkpoint_time)
+        network_controller.save_checkpoint(options.checkpoint_filename)
+    stop_reason = network_controller.run(options.num_seconds,
+        options.max_events, options.max_wall_seconds, options.steady_state,
+        options.steady_state_window)
+    network_controller.close_metrics_sinks()
+    if options.verbose:
+        print("Stopped at %.3f s (%s) after %d events" % (
+            network_controller.get_current_time(), stop_reason,
+            network_controller.get_num_events()))
+    if options.profile:
+        network_controller.get_profiler().print_summary()
+
+    if options.headless:
+        if options.graphs:
+            network_controller.draw_graphs(options.output_filename)
+    else:
+        # This is necessary since otherwise the graph window disappears after
+        # the simulation finishes.
+        input()
@@ -1,5 +1,6 @@
 from Flow import Flow
-from Packet import BFPacket
+from Packet import BFPacket, BFVectorPacket
+import zlib
 
 class Device(object):
     """The Device class that Host and Router derives from.
@@ -25,13 +26,53 @@ class Device(object):
     def get_controller(self):
         return self._controller
 
+    def notify_buffer_space(self, link):
+        """Called by a link when a packet sent by this device leaves its
+        buffer. Devices that wait for buffer space override this."""
+        pass
+
+    def receive_train(self, sending_link, packets, arrival_times):
+        """Called by a link when the first packet of a train arrives. By
+        default, each packet is received on its own at its arrival time.
+
+        Args:
+            sending_link: The link the train arrives on.
+            packets: The packets of the train, in order.
+            arrival_times: The time each packet arrives at; the first one is
+                now.
+        """
+        self.receive_packet(sending_link, packets[0])
+        for packet, arrival_time in zip(packets[1:], arrival_times[1:]):
+            self._controller.add_event(arrival_time, self.receive_packet,
+                [sending_link, packet])
+
 
 class Host(Device):
     """Hosts represent individual endpoint computers, like desktop computers or
     servers.
 
+    Sending is event driven: a flow that can send is paced at one packet per
+    packet transmission time, and a flow that cannot send schedules nothing
+    until an ack opens its window, its link buffer frees up, or a retransmit
+    timer fires. Flows whose congestion control sets a pacing rate are paced
+    at the lower of the two rates. A paused flow sends nothing until it is
+    resumed; the fluid model pauses the flows it takes over.
+
+    With packet trains enabled, the only flow sending from a host queues the
+    packets that its pacing would send next as one train, each with the time
+    it would have been sent at, and a data train is acked with a train of
+    acks. Flows with a pacing rate are never sent as trains, since a train
+    leaves as fast as the link allows. Trains of acks are received one ack
+    at a time, since each ack moves the window.
+
     Attributes:
         _flows: The set of flows for this host.
+        _scheduled_flows: The ids of the flows with a pending send event.
+        _window_stalled_flows: The flows waiting for their window to open,
+            keyed by flow id.
+        _buffer_stalled_flows: The flows waiting for space in the link
+            buffer, keyed by flow id.
+        _paused_flows: The ids of the paused flows.
     """
 
     def __init__(self, controller, links, device_id):
@@ -39,67 +80,225 @@ class Host(Device):
         super().__init__(controller, links, device_id)
         # _flows is a map from device id values to flow
         self._flows = {}
+        self._scheduled_flows = set()
+        self._window_stalled_flows = {}
+        self._buffer_stalled_flows = {}
+        self._paused_flows = set()
 
     def get_link(self):
         return next(iter(self._links.values()))
 
     def add_flow(self, flow_id, flow):
         self._flows[flow_id] = flow
+        flow.set_host(self)
+
+    def get_flow(self, flow_id):
+        """Returns the flow with the given id, or None if no packet of the
+        flow has reached this host yet."""
+        return self._flows.get(flow_id)
+
+    def pause_flow(self, flow):
+        """Stops sending the packets of a flow until resume_flow is called.
+        Acks are still received."""
+        self._paused_flows.add(flow.get_flow_id())
+
+    def resume_flow(self, flow):
+        """Resumes sending the packets of a paused flow."""
+        flow_id = flow.get_flow_id()
+        self._paused_flows.discard(flow_id)
+        if flow_id in self._scheduled_flows:
+            return
+        self._window_stalled_flows.pop(flow_id, None)
+        self._buffer_stalled_flows.pop(flow_id, None)
+        self.send_next_packet(flow)
 
     def send_next_packet(self, flow):
-        if (not self.get_link().buffer_is_full(self.get_device_id(), 1024) \
-            and not flow.window_is_full()):
+        flow_id = flow.get_flow_id()
+        self._scheduled_flows.discard(flow_id)
+        if flow_id in self._paused_flows:
+            return
+        link = self.get_link()
+        if link.buffer_is_full(self.get_device_id(), 1024):
+            self._buffer_stalled_flows[flow_id] = flow
+            return
+        if flow.window_is_full():
+            self._window_stalled_flows[flow_id] = flow
+            return
+
+        now = self.get_controller().get_current_time()
+        transmission_time = 1024.0 / link.get_throughput()
+        pacing_rate = flow.get_pacing_rate()
+        if pacing_rate:
+            transmission_time = max(transmission_time, 1.0 / pacing_rate)
+        train_length = self._train_length(flow, link)
+        if train_length > 1:
+            packets = []
+            queue_times = []
+            for index in range(train_length):
+                queue_time = now + index * transmission_time
+                packet = flow.construct_next_data_packet(queue_time)
+                if not packet:
+                    break
+                packets.append(packet)
+                queue_times.append(queue_time)
+            link.queue_train(self.get_device_id(), packets, queue_times)
+        else:
             packet = flow.construct_next_data_packet()
-            # This operation fails if e.g. we're waiting for the network to
-            # clear.
-            if packet:
-                self.get_link().queue_packet(self.get_device_id(), packet)
-                if (not flow.is_infinite_flow() and flow.num_remaining_bytes()
-                        <= 0):
-                    self.get_controller().remove_flow(flow)
-                    # Don't queue up any more packets.
-                    return
-        t = self.get_controller().get_current_time() + \
-            (1024.0 / self.get_link().get_throughput())
+            if not packet:
+                # Nothing left to send.
+                return
+            link.queue_packet(self.get_device_id(), packet)
+            packets = [packet]
+        if not flow.is_infinite_flow() and flow.num_remaining_bytes() <= 0:
+            self.get_controller().remove_flow(flow)
+            # Don't queue up any more packets.
+            return
+        t = now + len(packets) * transmission_time
         self.get_controller().add_event(t, self.send_next_packet, [flow])
+        self._scheduled_flows.add(flow_id)
 
+    def _train_length(self, flow, link):
+        """Returns the number of packets of a flow to send as a train, which
+        is 1 unless packet trains are enabled, the flow is the only one
+        sending from this host, its link is free for a train, and its
+        congestion control does not pace it."""
+        max_length = self.get_controller().get_max_train_length()
+        if (max_length < 2 or flow.is_recovering() or
+                flow.get_pacing_rate() is not None):
+            return 1
+        flow_id = flow.get_flow_id()
+        for flows in (self._scheduled_flows, self._window_stalled_flows,
+                      self._buffer_stalled_flows):
+            if any(x != flow_id for x in flows):
+                return 1
+        if not link.can_take_train(self.get_device_id(), flow_id):
+            return 1
+        return max(1, min(max_length, flow.window_room(),
+            flow.num_remaining_packets(), link.train_room(
+                self.get_device_id(), flow.DATA_MAX_PACKET_SIZE)))
 
-    def receive_packet(self, sending_link, packet):
-        if not packet.is_TCP_packet():
-            raise Exception("Faulty packet received.")
+    def notify_window_open(self, flow):
+        """Wakes a flow that was waiting for its window to open."""
+        flow_id = flow.get_flow_id()
+        if flow_id in self._window_stalled_flows:
+            del self._window_stalled_flows[flow_id]
+            self.send_next_packet(flow)
+
+    def notify_buffer_space(self, link):
+        """Wakes the flows that were waiting for space in the link buffer."""
+        if not self._buffer_stalled_flows:
+            return
+        stalled_flows = self._buffer_stalled_flows
+        self._buffer_stalled_flows = {}
+        for flow in stalled_flows.values():
+            self.send_next_packet(flow)
 
-        sequence_number = packet.get_sequence_number()
-        sending_device = packet.get_src_id()
+
+    def _receiving_flow(self, packet):
+        """Returns the flow of a received packet, which is created on the
+        first data packet of a flow sent from another host."""
         flow_id = packet.get_flow_id()
         if flow_id not in self._flows:
             # Add the new flow to the host's _flows collection.
-            flow = Flow(self._controller, sending_device, self.get_device_id(),
-                flow_id)
+            flow = Flow(self._controller, packet.get_src_id(),
+                self.get_device_id(), flow_id)
             self.add_flow(flow_id, flow)
+        return self._flows[flow_id]
+
+    def receive_train(self, sending_link, packets, arrival_times):
+        first_packet = packets[0]
+        link = self.get_link()
+        if (not first_packet.is_TCP_packet() or first_packet.is_TCP_ack() or
+                not link.can_take_train(self.get_device_id(),
+                    first_packet.get_flow_id()) or
+                link.train_room(self.get_device_id(), Flow.ACK_PACKET_SIZE) <
+                    len(packets)):
+            super().receive_train(sending_link, packets, arrival_times)
+            return
+
+        # Ack the whole train with a train of acks, each sent when its data
+        # packet arrives.
+        flow = self._receiving_flow(first_packet)
+        ack_packets = []
+        for packet, arrival_time in zip(packets, arrival_times):
+            flow.receive_data(packet)
+            ack_packets.append(flow.construct_next_ack_packet(
+                packet.get_data_time(), arrival_time))
+        link.queue_train(self.get_device_id(), ack_packets, arrival_times)
+
+    def receive_packet(self, sending_link, packet):
+        if not packet.is_TCP_packet():
+            raise Exception("Faulty packet received.")
+
+        flow_id = packet.get_flow_id()
+        self._receiving_flow(packet)
 
         if packet.is_TCP_ack():
             # Update the flow state with the received ack packet.
             self._flows[flow_id].receive_ack(packet)
+            self.notify_window_open(self._flows[flow_id])
         else:
             # Update the flow state with the received data packet.
             self._flows[flow_id].receive_data(packet)
-            # Construct and send an acknowledgement packet.
+            # Construct and send an acknowledgement packet. If the host is also
+            # sending data, its link buffer may be full, in which case the ack
+            # is dropped like any other packet.
             ack_packet_to_send = self._flows[flow_id] \
                 .construct_next_ack_packet(packet.get_data_time())
-            assert(self.get_link().queue_packet(self.get_device_id(),
-                ack_packet_to_send))
+            self.get_link().queue_packet(self.get_device_id(),
+                ack_packet_to_send)
         return True
 
 
 class Router(Device):
     """Routers represent the network equipment that sits between hosts.
 
+    In the incremental Bellman-Ford mode, a router keeps the last distance
+    vector received from each neighboring router. Every round it recomputes
+    its routes, and sends each neighbor a single BFVectorPacket holding only
+    the routes whose cost changed noticeably since they were last advertised
+    to that neighbor. Routes learned through a neighbor are advertised back to
+    it with an infinite cost (poisoned reverse). A route change caused by a
+    received vector triggers an update before the next round, but no sooner
+    than TRIGGERED_UPDATE_INTERVAL after the previous update.
+
+    A routing table entry may list several next hop links for equal-cost
+    multipath (ECMP) forwarding. In the 'hash' multipath mode, the link is
+    picked by hashing the flow id, so the packets of a flow stay in order. In
+    the 'weighted' mode, each flow is pinned to the link with the lowest
+    estimated cost when its first packet arrives.
+
     Attributes:
-        _routing_table: The routing table.
+        _routing_table: The routing table, mapping each host id to a single
+            link id.
+        _multipath: The multipath mode, 'hash' or 'weighted', or None to only
+            use the first link of each entry.
+        _multipath_table: Maps the host ids with several next hops to the
+            tuple of their link ids.
+        _flow_hashes: Caches the hash of each flow id.
+        _flow_routes: Maps (flow id, host id) to the link id the flow is
+            pinned to, in the 'weighted' mode.
         _cost_table: The cost table.
         _bf_freq: The frequency used in the Bellman-Ford algorithm.
+        _incremental_bf: True to use the incremental Bellman-Ford mode.
+        _attached_hosts: Maps the ids of the directly attached hosts to the
+            ids of their links. None until the neighbors are discovered.
+        _neighbor_links: Maps the ids of the links to neighboring routers to
+            the links.
+        _neighbor_vectors: Maps link ids to the last distance vector received
+            over the link.
+        _link_costs: Maps link ids to the last estimated cost of the link.
+        _advertised: Maps link ids to the distance vector last advertised over
+            the link.
+        _triggered_update_event: The handle of the pending triggered update,
+            or None.
+        _last_update_time: The time of the last vector update sent.
     """
 
+    BF_COST_RELATIVE_TOLERANCE = 0.1
+    BF_COST_ABSOLUTE_TOLERANCE = 0.001
+    TRIGGERED_UPDATE_INTERVAL = 0.05
+
     def __init__(
         self,
         controller,
@@ -108,11 +307,24 @@ class Router(Device):
         bf_freq,
         routing_table = {},
         cost_table = {},
+        incremental_bf = False,
+        multipath = None,
     ):
         super().__init__(controller, links, device_id)
-        self._routing_table = routing_table
+        self._multipath = multipath
+        self._flow_hashes = {}
+        self._flow_routes = {}
+        self.set_routing_table(routing_table)
         self._cost_table = {host: float('inf') for host in routing_table}
         self._bf_freq = bf_freq
+        self._incremental_bf = incremental_bf
+        self._attached_hosts = None
+        self._neighbor_links = {}
+        self._neighbor_vectors = {}
+        self._link_costs = {}
+        self._advertised = {}
+        self._triggered_update_event = None
+        self._last_update_time = float('-inf')
         if bf_freq == 0:
             return
         curtime = controller.get_current_time()
@@ -122,6 +334,50 @@ class Router(Device):
     def get_link(self, link_id):
         return self._links[link_id]
 
+    def set_routing_table(self, routing_table):
+        """Replaces the routing table, e.g. with centrally computed routes.
+
+        Args:
+            routing_table: Maps host ids to link ids, or to lists of link ids
+                for multipath routing.
+        """
+        self._routing_table = {}
+        self._multipath_table = {}
+        for host_id, link_ids in routing_table.items():
+            if isinstance(link_ids, str):
+                self._routing_table[host_id] = link_ids
+                continue
+            self._routing_table[host_id] = link_ids[0]
+            if self._multipath is not None and len(link_ids) > 1:
+                self._multipath_table[host_id] = tuple(link_ids)
+
+    def get_next_link_id(self, flow_id, dst_id):
+        """Returns the id of the link that the packets of a flow to a host are
+        forwarded on, or None if there is no route to the host."""
+        if dst_id in self._multipath_table:
+            return self._select_multipath_link(flow_id, dst_id,
+                self._multipath_table[dst_id])
+        return self._routing_table.get(dst_id)
+
+    def _select_multipath_link(self, flow_id, dst_id, link_ids):
+        """Picks the next hop of a flow among equal-cost links, keeping all
+        the packets of a flow on the same link."""
+        if self._multipath == 'weighted':
+            key = (flow_id, dst_id)
+            if key not in self._flow_routes:
+                device_id = self.get_device_id()
+                self._flow_routes[key] = min(link_ids, key=lambda x:
+                    self._links[x].estimate_cost(device_id))
+            return self._flow_routes[key]
+
+        if flow_id not in self._flow_hashes:
+            # Python's str hash is salted per process, so use crc32 to keep
+            # runs reproducible. The router id is mixed in so that routers
+            # don't all make the same choice.
+            self._flow_hashes[flow_id] = zlib.crc32(
+                ('%s/%s' % (self.get_device_id(), flow_id)).encode())
+        return link_ids[self._flow_hashes[flow_id] % len(link_ids)]
+
     def bellman_ford_update(self, host_id, cost, mapped_link):
         """
         1) Updates the host's routing table entry with the given cost and link.
@@ -129,14 +385,15 @@ class Router(Device):
         induced this update.
         """
         self._routing_table[host_id] = mapped_link.get_link_id()
+        self._multipath_table.pop(host_id, None)
         self._cost_table[host_id] = cost
         for link_id, link in self.get_links().items():
             opposite_device = link.opposite_device(self.get_device_id())
             is_host = isinstance(opposite_device, Host)
             if link == mapped_link or is_host:
                 continue
-            update_packet = BFPacket(self.get_controller(),
-                self.get_device_id(), None, 1024, host_id, cost)
+            update_packet = BFPacket(self.get_device_id(), None, 1024, host_id,
+                cost)
             link.queue_packet(self.get_device_id(), update_packet)
 
     def start_bellman_ford_round(self):
@@ -146,6 +403,10 @@ class Router(Device):
         controller.add_event(curtime + 1.0 / self._bf_freq,
             self.start_bellman_ford_round, [])
 
+        if self._incremental_bf:
+            self.start_incremental_round()
+            return
+
         for host_id in self._routing_table:
             self._cost_table[host_id] = float('inf')
 
@@ -158,15 +419,159 @@ class Router(Device):
             # Update all the other links the cost of the attached host.
             self.bellman_ford_update(host_id, cost, link)
 
+    def _discover_neighbors(self):
+        """Finds the attached hosts and the neighboring routers, and the
+        first costs of the links, so that a distance vector can be processed
+        before the first round of the router. Done lazily since the links
+        only know their devices once the network is built."""
+        self._attached_hosts = {}
+        for link_id, link in self.get_links().items():
+            self._link_costs[link_id] = link.estimate_cost(
+                self.get_device_id())
+            opposite_device = link.opposite_device(self.get_device_id())
+            if isinstance(opposite_device, Host):
+                host_id = opposite_device.get_device_id()
+                self._attached_hosts[host_id] = link_id
+                self._cost_table.setdefault(host_id, float('inf'))
+            else:
+                self._neighbor_links[link_id] = link
+                self._neighbor_vectors[link_id] = {}
+                self._advertised[link_id] = {}
+
+    def _is_significant_change(self, old_cost, new_cost):
+        """Returns whether a cost changed enough to be advertised."""
+        if old_cost == new_cost:
+            return False
+        if float('inf') in (old_cost, new_cost):
+            return True
+        return abs(new_cost - old_cost) > max(self.BF_COST_ABSOLUTE_TOLERANCE,
+            self.BF_COST_RELATIVE_TOLERANCE * max(old_cost, new_cost))
+
+    def _update_route(self, host_id):
+        """Recomputes the route to a host from the attached links and the
+        neighbors' distance vectors. On ties, the current route is kept.
+
+        Returns:
+            True if the next hop or the cost changed noticeably.
+        """
+        old_link_id = self._routing_table.get(host_id)
+        old_cost = self._cost_table.get(host_id, float('inf'))
+
+        candidates = []
+        if host_id in self._attached_hosts:
+            link_id = self._attached_hosts[host_id]
+            candidates.append((self._link_costs[link_id], link_id))
+        for link_id, vector in self._neighbor_vectors.items():
+            if host_id in vector:
+                candidates.append(
+                    (vector[host_id] + self._link_costs[link_id], link_id))
+
+        best_cost = float('inf')
+        best_link_id = None
+        for cost, link_id in candidates:
+            if cost < best_cost or (cost == best_cost and
+                                    link_id == old_link_id):
+                best_cost = cost
+                best_link_id = link_id
+
+        self._cost_table[host_id] = best_cost
+        if best_link_id is None:
+            # Keep the current route, if any, until a new one is learned.
+            return self._is_significant_change(old_cost, best_cost)
+        self._routing_table[host_id] = best_link_id
+        self._multipath_table.pop(host_id, None)
+        return (best_link_id != old_link_id or
+                self._is_significant_change(old_cost, best_cost))
+
+    def _send_vector_updates(self):
+        """Sends each neighboring router the routes whose advertised cost
+        changed noticeably since the last update sent to it."""
+        self._last_update_time = self.get_controller().get_current_time()
+        for link_id, link in self._neighbor_links.items():
+            advertised = self._advertised[link_id]
+            vector = {}
+            for host_id, cost in self._cost_table.items():
+                if self._routing_table.get(host_id) == link_id:
+                    # Poisoned reverse.
+                    cost = float('inf')
+                if (host_id not in advertised or
+                        self._is_significant_change(advertised[host_id],
+                                                    cost)):
+                    vector[host_id] = cost
+            if not vector:
+                continue
+            packet = BFVectorPacket(self.get_device_id(), None, vector)
+            # Only count the routes as advertised if the packet got through.
+            if link.queue_packet(self.get_device_id(), packet):
+                advertised.update(vector)
+
+    def start_incremental_round(self):
+        """Refreshes the link costs and routes, and sends the changes."""
+        if self._attached_hosts is None:
+            self._discover_neighbors()
+        for link_id, link in self.get_links().items():
+            self._link_costs[link_id] = link.estimate_cost(
+                self.get_device_id())
+        for host_id in list(self._cost_table):
+            self._update_route(host_id)
+        self._send_vector_updates()
+
+    def send_triggered_update(self):
+        self._triggered_update_event = None
+        self._send_vector_updates()
+
+    def receive_distance_vector(self, sending_link, packet):
+        """Updates the routes with a distance vector from a neighbor, and
+        schedules a rate-limited triggered update if any route changed."""
+        if self._attached_hosts is None:
+            self._discover_neighbors()
+        link_id = sending_link.get_link_id()
+        self._link_costs[link_id] = sending_link.estimate_cost(
+            self.get_device_id())
+        neighbor_vector = self._neighbor_vectors[link_id]
+        changed = False
+        for host_id, cost in packet.get_vector().items():
+            neighbor_vector[host_id] = cost
+            if self._update_route(host_id):
+                changed = True
+
+        if changed and self._triggered_update_event is None:
+            controller = self.get_controller()
+            t = max(controller.get_current_time(),
+                self._last_update_time + self.TRIGGERED_UPDATE_INTERVAL)
+            self._triggered_update_event = controller.add_event(t,
+                self.send_triggered_update, [])
+
     # sending_link is the link which is putting the packet into the router.
+    def receive_train(self, sending_link, packets, arrival_times):
+        first_packet = packets[0]
+        if not first_packet.is_TCP_packet():
+            super().receive_train(sending_link, packets, arrival_times)
+            return
+        link_id = self.get_next_link_id(first_packet.get_flow_id(),
+            first_packet.get_dst_id())
+        if link_id is None:
+            # Drop the train.
+            return
+        # Forward the train whole if it fits, each packet queued when it
+        # arrives.
+        link = self._links[link_id]
+        if (link.can_take_train(self.get_device_id(),
+                first_packet.get_flow_id()) and
+                link.train_room(self.get_device_id(),
+                    first_packet.get_size()) >= len(packets)):
+            link.queue_train(self.get_device_id(), packets, arrival_times)
+        else:
+            super().receive_train(sending_link, packets, arrival_times)
+
     def receive_packet(self, sending_link, packet):
         if packet.is_TCP_packet():
             # Route the packet.
-            dst_id = packet.get_dst_id()
-            if not dst_id in self._routing_table:
+            link_id = self.get_next_link_id(packet.get_flow_id(),
+                packet.get_dst_id())
+            if link_id is None:
                 # Drop the packet.
                 return False
-            link_id = self._routing_table[dst_id]
             link = self._links[link_id]
             link.queue_packet(self.get_device_id(), packet)
         elif packet.is_BF_packet():
@@ -175,6 +580,8 @@ class Router(Device):
                 self.get_device_id())
             if host_cost < self._cost_table[host_id]:
                 self.bellman_ford_update(host_id, host_cost, sending_link)
+        elif packet.is_BF_vector_packet():
+            self.receive_distance_vector(sending_link, packet)
         else:
             raise Exception("Unsupported packet type")
         return True
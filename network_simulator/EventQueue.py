@@ -1,40 +1,104 @@
-from heapq import *
-
-class HeapTuple(object):
-    def __init__(self, t, method, args):
-        self.t = t
-        self.method = method
-        self.args = args
-
-    def __lt__(self, heaptuple):
-        return self.t < heaptuple.t
-
-    def __gt__(self, heaptuple):
-        return self.t > heaptuple.t
-
-    def as_tuple(self):
-        return (self.t, self.method, self.args)
-
+from heapq import heapify, heappop, heappush
 
 class EventQueue(object):
     """The global event queue used in the network simulation.
 
+    Events are stored as plain (time, seq, method, args) tuples, so the heap
+    compares them natively. The sequence number breaks ties between events at
+    the same time in the order they were added, which makes runs
+    deterministic.
+
+    The methods of the events must be public bound methods of picklable
+    objects, so that the queue can be pickled for a checkpoint. They are
+    pickled as (object, method name) pairs.
+
     Attributes:
         priority_queue: The priority queue used for keeping track of all the
             events that occur in the simulation. Since we are using a
             discrete-event model for the network simulation, we need a data
             structure that can efficiently tell us what the next event is.
+        _next_seq: The sequence number of the next event.
+        _cancelled: The sequence numbers of the events that were cancelled but
+            are still in the priority queue.
     """
 
     def __init__(self):
         self.priority_queue = []
+        self._next_seq = 0
+        self._cancelled = set()
+
+    def __getstate__(self):
+        events = []
+        for t, seq, method, args in self.priority_queue:
+            if getattr(method, '__self__', None) is None:
+                raise ValueError("Event method is not a bound method: %r" %
+                    method)
+            events.append((t, seq, method.__self__, method.__name__, args))
+        return {
+            'events': events,
+            'next_seq': self._next_seq,
+            'cancelled': self._cancelled,
+        }
+
+    def __setstate__(self, state):
+        self.priority_queue = [(t, seq, getattr(owner, name), args)
+                               for t, seq, owner, name, args in
+                               state['events']]
+        heapify(self.priority_queue)
+        self._next_seq = state['next_seq']
+        self._cancelled = state['cancelled']
+
+    def __len__(self):
+        return len(self.priority_queue) - len(self._cancelled)
 
     def add_event(self, t, method, args):
-        heaptuple = HeapTuple(t, method, args)
-        heappush(self.priority_queue, heaptuple)
+        """Adds an event to the queue.
+
+        Args:
+            t: The time of the event.
+            method: The method to call at that time.
+            args: The arguments to call the method with.
+
+        Returns:
+            A handle that can be passed to cancel_event.
+        """
+        seq = self._next_seq
+        self._next_seq += 1
+        heappush(self.priority_queue, (t, seq, method, args))
+        return seq
+
+    def cancel_event(self, handle):
+        """Cancels an event that has not happened yet. The event is only
+        removed from the priority queue once it reaches the front. Must not be
+        called for an event that has already happened or been cancelled.
+
+        Args:
+            handle: The handle returned by add_event.
+        """
+        self._cancelled.add(handle)
+
+    def _discard_cancelled(self):
+        """Pops the cancelled events off the front of the priority queue."""
+        while (self._cancelled and self.priority_queue and
+                self.priority_queue[0][1] in self._cancelled):
+            self._cancelled.remove(heappop(self.priority_queue)[1])
+
+    def peek_time(self):
+        """Returns the time of the next event, or None if there is none."""
+        self._discard_cancelled()
+        if not self.priority_queue:
+            return None
+        return self.priority_queue[0][0]
 
     def pop_event(self):
-        return heappop(self.priority_queue).as_tuple()
+        """Removes the next event from the queue.
+
+        Returns:
+            A tuple (time, method, args).
+        """
+        self._discard_cancelled()
+        t, _, method, args = heappop(self.priority_queue)
+        return (t, method, args)
 
     def is_empty(self):
-        return (len(self.priority_queue) == 0)
+        return len(self) == 0
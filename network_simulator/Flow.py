@@ -1,5 +1,9 @@
+from CongestionControl import FlowStates
+from CongestionControl import create_congestion_control
 from Packet import PacketTypes
 from Packet import TCPPacket
+from ReassemblyBuffer import ReassemblyBuffer
+import math
 
 def debug_print(x):
     """Function to use in place of print so that it can easily be disabled."""
@@ -7,16 +11,6 @@ def debug_print(x):
     pass
 
 
-class FlowStates(object):
-    """Enum for the different flow states in the TCP algorithms."""
-
-    RenoSlowStartPart1 = 0
-    RenoSlowStartPart2 = 1
-    RenoFastRecovery = 2
-    RenoCA = 3
-    Fast = 4
-
-
 class Flow(object):
     """A flow represents the transfer of data from one host to another.
 
@@ -31,23 +25,68 @@ class Flow(object):
         __tcp_sequence_number: The sequence number as used in TCP.
         __last_ack_number_received: The number of the last acknowledgement
             received.
-        __num_acks_repeated: The number of repeated acknowledgements.
         __window_size: The window size.
         __tcp: The TCP algorithm to use specified as a string, e.g. 'reno' or
             'fast'.
+        __congestion_control: The CongestionControl instance of the TCP
+            algorithm, which updates the window on every ack.
+        __host: The host that the flow is attached to, which is notified when
+            the window opens outside of an ack.
+        __smoothed_rtt: The exponentially weighted moving average of the
+            round trip times measured from the acks, or None before the first
+            ack.
+        __rtt_variance: The exponentially weighted moving average of the
+            deviation of the round trip times from __smoothed_rtt.
+        __rto: The retransmission timeout, see RFC 6298.
+        __retransmit_deadline: The time the retransmission timer expires at,
+            or None if it is stopped.
+        __retransmit_timer: The pending retransmit_timeout event, or None.
+            Restarting the timer only moves the deadline, and the event
+            reschedules itself if it fires before the deadline, so that most
+            acks do not touch the event queue.
+        __retransmit_timer_time: The time of __retransmit_timer.
+        __instrumented: True if the flow is logged by the controller.
+        __fast_recovery_sequence_number: A sequence number to retransmit
+            next, or None.
+        __reassembly_buffer: The ReassemblyBuffer of the sequence numbers
+            received by the destination.
+        __sack: True if the flow uses selective acks (SACK). The destination
+            learns it from the data packets.
+        __last_data_sequence_number: The sequence number of the last data
+            packet received by the destination, or None.
+        __sack_scoreboard: The ReassemblyBuffer of the sequence numbers that
+            the acks and their SACK blocks report as received, or None
+            without SACK.
+        __hole_cursor: During a SACK loss recovery, the sequence number from
+            which to look for the next lost packet to retransmit, or None.
+        __sack_recovery_point: The sequence number that ends the SACK loss
+            recovery once acked, or None.
+        __sack_lost_point: After a retransmission timeout, the sequence number
+            below which every packet not reported as received counts as lost
+            until the SACK loss recovery ends, or None.
+        __retransmitted_holes: The sequence numbers retransmitted during the
+            SACK loss recovery and not acked yet, mapped to the sequence
+            number of the next new data packet when they were retransmitted.
     """
 
     NUM_ACKS_THRESHOLD = 5
+    RTT_SMOOTHING = 0.125
+    RTT_VARIANCE_SMOOTHING = 0.25
+    INITIAL_RTO = 1.0
+    MIN_RTO = 0.2
+    MAX_RTO = 60.0
     ACK_PACKET_SIZE = 64
     DATA_MAX_PACKET_SIZE = 1024
-    RENO_SLOW_START_TIMEOUT = 1.0
     FAST_ALPHA = 0.5
-    FAST_RECOVERY_RETRANSMIT_TIME = 0.5
     FAST_BASE_RTT = -1  # -1 indicates no base RTT recorded yet.
+    CUBIC_C = 0.4
+    CUBIC_BETA = 0.7
+    MAX_SACK_BLOCKS = 3
+    SACK_BLOCK_SIZE = 8
 
     # num_bytes = None specifies that the flow should continue ad infinitum.
     def __init__(self, controller, src_id, dst_id, flow_id, tcp="reno",
-            num_bytes = 0):
+            num_bytes = 0, sack=False):
         self.i = 0
         self.__controller = controller
         self.__src_id = src_id
@@ -57,29 +96,31 @@ class Flow(object):
         self.__flow_id = flow_id
         self.__tcp_sequence_number = 0
         self.__last_ack_number_received = 0
-        self.__num_acks_repeated = 0
         self.__window_size = 1.0
-        self.__window_start = 0
         self.__tcp = tcp  # TCP algorithm
+        self.__host = None
+        self.__smoothed_rtt = None
+        self.__rtt_variance = None
+        self.__rto = self.INITIAL_RTO
+        self.__retransmit_deadline = None
+        self.__retransmit_timer = None
+        self.__retransmit_timer_time = None
+        self.__instrumented = controller.is_instrumented(flow_id)
         debug_print(tcp)
-
-        self.__SSthreshold = float('inf')
-        if tcp == "reno":
-            self.__state = FlowStates.RenoSlowStartPart1
-        elif tcp == "fast":
-            self.__state = FlowStates.Fast
-        else:
-            raise NotImplementedError(
-                "Unsupported TCP Congestion Control Algorithm")
+        self.__congestion_control = create_congestion_control(tcp, self,
+            controller)
 
         # Denotes a sequence number to retransmit.
         self.__fast_recovery_sequence_number = None
 
-        # e.g. if we receive TCP data packets of sequence numbers [1,2,3,7,8]
-        # then __max_contiguous_sequence_number = 3,
-        # __uncounted_sequence_numbers = [7,8]
-        self.__max_contiguous_sequence_number = -1  # Nothing received yet.
-        self.__uncounted_sequence_numbers = {}
+        self.__reassembly_buffer = ReassemblyBuffer()
+        self.__sack = sack
+        self.__last_data_sequence_number = None
+        self.__sack_scoreboard = ReassemblyBuffer() if sack else None
+        self.__hole_cursor = None
+        self.__sack_recovery_point = None
+        self.__sack_lost_point = None
+        self.__retransmitted_holes = {}
 
     # Returns whether or not the flow should continue ad infinitum.
     def is_infinite_flow(self):
@@ -100,188 +141,343 @@ class Flow(object):
     def get_tcp_algorithm(self):
         return self.__tcp
 
-    def transition_to_retransmit(self, next_tcp_sequence_number, SSthreshold):
-        # If this condition isn't satisfied, then FR worked.
-        if next_tcp_sequence_number > self.__last_ack_number_received:
-            # Transition into slow start.
-            self.__SSthreshold = SSthreshold
-            self.__window_size = 1.0
-            self.__state = FlowStates.RenoSlowStartPart2
-            self.__tcp_sequence_number = self.__last_ack_number_received
-            self.__num_acks_repeated = 0
+    def uses_sack(self):
+        return self.__sack
 
-    def receive_ack(self, ack_packet):
-        if self.__tcp == "reno":
-            self.receive_ack_reno(ack_packet)
-        elif self.__tcp == "fast":
-            self.receive_ack_fast(ack_packet)
-        else:
-            raise NotImplementedError(
-                "Unsupported TCP Congestion Control Algorithm")
+    def set_host(self, host):
+        self.__host = host
 
-        self.__controller.log(
-            "window-size",
-            self.__flow_id,
-            self.__window_size,
-            ylabel="window size (pkts)",
-        )
+    def get_state(self):
+        """Returns the congestion control state, one of FlowStates."""
+        return self.__congestion_control.get_state()
 
-    def receive_ack_fast(self, ack_packet):
-        ack_number = ack_packet.get_ack_number()
-        if (self.__last_ack_number_received == ack_number):
-            self.__num_acks_repeated += 1
-            if self.__num_acks_repeated == self.NUM_ACKS_THRESHOLD - 1:
-                # Go back N
-                self.__tcp_sequence_number = ack_number
-        self.__last_ack_number_received = ack_number
+    def get_congestion_control(self):
+        return self.__congestion_control
 
-        if (ack_number > self.__window_start):
-            # Slide the window upon receipt of an ack above the window_start variable.
-            self.__window_start = ack_number
+    def get_window_size(self):
+        return self.__window_size
 
-        rtt = self.__controller.get_current_time() - ack_packet.get_data_time()
-        if(self.FAST_BASE_RTT == -1):
-            self.__window_size = self.__window_size + self.FAST_ALPHA
-            self.FAST_BASE_RTT = rtt
-        else:
-            self.__window_size = (self.FAST_BASE_RTT/rtt)*self.__window_size + \
-                self.FAST_ALPHA
-            if(self.FAST_BASE_RTT > rtt):
-                self.FAST_BASE_RTT = rtt
-
-    def handle_reno_SS1(self, ack_number):
-        if self.__last_ack_number_received == ack_number:
-            self.__SSthreshold = self.__window_size / 2
-            self.__window_size = 1.0
-            self.__state = FlowStates.RenoSlowStartPart2
-            self.__tcp_sequence_number = ack_number
+    def get_pacing_rate(self):
+        """Returns the rate in packets per second that the congestion control
+        paces the data packets at, or None."""
+        return self.__congestion_control.get_pacing_rate()
+
+    def set_window_size(self, window_size):
+        self.__window_size = window_size
+
+    def get_sequence_number(self):
+        """Returns the sequence number of the next new data packet."""
+        return self.__tcp_sequence_number
+
+    def set_sequence_number(self, sequence_number):
+        """Moves the sequence number of the next new data packet."""
+        self.__tcp_sequence_number = sequence_number
+
+    def go_back_to(self, sequence_number):
+        """Resends the data packets from a sequence number on. Without SACK,
+        the flow goes back N, i.e. moves its sequence number back to it. With
+        SACK, it only retransmits that packet, and then the ones the
+        scoreboard shows as lost, see retransmit."""
+        if self.__sack_scoreboard is None:
+            self.__tcp_sequence_number = sequence_number
         else:
-            self.__window_size += 1
+            self.retransmit(sequence_number)
+
+    def retransmit(self, sequence_number):
+        """Makes the next data packet a retransmission of a sequence number.
+
+        With SACK, this starts a loss recovery that lasts until everything
+        sent so far is acked, as in RFC 6675. During it, a packet counts as
+        lost once NUM_ACKS_THRESHOLD - 1 packets above it are reported as
+        received, and the lost packets are retransmitted before any new data,
+        each at most once. A packet already retransmitted and not acked yet
+        is not retransmitted again.
+        """
+        if self.__sack_scoreboard is not None:
+            if self.__hole_cursor is None:
+                self.__hole_cursor = sequence_number
+                self.__sack_recovery_point = self.__tcp_sequence_number
+            else:
+                self.__hole_cursor = min(self.__hole_cursor, sequence_number)
+            if sequence_number in self.__retransmitted_holes:
+                return
+        self.__fast_recovery_sequence_number = sequence_number
+
+    def notify_window_open(self):
+        """Tells the host that the window opened outside of an ack."""
+        if self.__host is not None:
+            self.__host.notify_window_open(self)
+
+    def get_smoothed_rtt(self):
+        return self.__smoothed_rtt
+
+    def get_rto(self):
+        """Returns the current retransmission timeout, in seconds."""
+        return self.__rto
+
+    def has_started(self):
+        """Returns whether the flow has sent any data."""
+        return self.__sent_bytes > 0
+
+    def get_last_ack_number(self):
+        """Returns the ack number of the last ack received, i.e. the number of
+        data packets acked so far."""
+        return self.__last_ack_number_received
+
+    def num_unacked_packets(self):
+        """Returns the number of data packets sent but not acked yet."""
+        return self.__tcp_sequence_number - self.__last_ack_number_received
+
+    def is_recovering(self):
+        """Returns whether a loss is being recovered from, i.e. a packet is due
+        to be retransmitted or the congestion control is in recovery."""
+        return (self.__fast_recovery_sequence_number is not None or
+                self.__hole_cursor is not None or
+                self.__congestion_control.is_recovering())
+
+    def advance_fluid(self, num_packets, window_size):
+        """Moves the sender forward as if num_packets more data packets had
+        been sent and acked, for the fluid model.
+
+        Args:
+            num_packets: The number of data packets.
+            window_size: The window size after these packets.
+
+        Returns:
+            The number of bytes sent, which is less than num_packets full
+            packets if the flow runs out of data.
+        """
+        num_bytes = num_packets * self.DATA_MAX_PACKET_SIZE
+        if not self.is_infinite_flow():
+            num_bytes = min(num_bytes, self.__num_remaining_bytes)
+            self.__num_remaining_bytes -= num_bytes
+        self.__sent_bytes += num_bytes
+        self.__tcp_sequence_number += num_packets
+        self.__last_ack_number_received = self.__tcp_sequence_number
+        self.__congestion_control.skip_to(self.__tcp_sequence_number)
+        self.__window_size = window_size
+        self.restart_retransmit_timer()
+
+        if self.__instrumented:
+            self.__controller.log(
+                "window-size",
+                self.__flow_id,
+                self.__window_size,
+                ylabel="window size (pkts)",
+            )
+        return num_bytes
+
+    def receive_fluid_data(self, num_packets, num_bytes):
+        """Moves the receiver forward as if num_packets more data packets
+        holding num_bytes bytes had been received in order, for the fluid
+        model."""
+        if self.__instrumented:
+            self.__controller.log(
+                "flow-rate",
+                self.__flow_id,
+                num_bytes,
+                values_aggregator=self.flow_rate_aggregator,
+                ylabel="flow rate (Mbps)",
+            )
+        self.__reassembly_buffer.advance(num_packets)
 
-    def handle_reno_SS2(self, ack_number):
-        if self.__window_size < self.__SSthreshold:
-            self.__window_size += 1
+    def receive_ack(self, ack_packet):
+        rtt = self.__controller.get_current_time() - ack_packet.get_data_time()
+        if self.__smoothed_rtt is None:
+            self.__smoothed_rtt = rtt
+            self.__rtt_variance = rtt / 2
         else:
-            self.__state = FlowStates.RenoCA
-
-    def handle_duplicate_ack(self, ack_number):
-        if self.__last_ack_number_received == ack_number:
-            self.__num_acks_repeated += 1
-            if self.__num_acks_repeated == self.NUM_ACKS_THRESHOLD - 1:
-                # Retransmit.
-                self.__fast_recovery_sequence_number = ack_number
-                # Store for when we break out of the repetitions.
-                self.__old_window_size = self.__window_size
-                self.__window_size = self.__window_size / 2 + \
-                    self.NUM_ACKS_THRESHOLD - 1
-                self.__state = FlowStates.RenoFastRecovery
-                self.__tcp_sequence_number -= 1
-                transition_time = self.__controller.get_current_time() + \
-                                  self.FAST_RECOVERY_RETRANSMIT_TIME
-                # Add an event to go into the retransmit state if necessary.
-                self.__controller.add_event(transition_time,
-                    self.transition_to_retransmit, [self.__tcp_sequence_number,
-                    self.__old_window_size / 2])
-
-    def handle_reno_FR(self, ack_number):
-        if self.__last_ack_number_received == ack_number:
-            self.__num_acks_repeated += 1
-            if self.__num_acks_repeated > self.NUM_ACKS_THRESHOLD - 1:
-                self.__window_size += 1
-        elif self.__num_acks_repeated >= self.NUM_ACKS_THRESHOLD - 1:
-            self.__window_size = self.__old_window_size / 2.5
-            self.__state = FlowStates.RenoCA
-            self.__num_acks_repeated = 0
-
-    def handle_reno_CA(self, ack_number):
-        self.__window_size += 1.0 / self.__window_size
-        self.handle_duplicate_ack(ack_number)
-
-    def receive_ack_reno(self, ack_packet):
+            self.__rtt_variance += self.RTT_VARIANCE_SMOOTHING * (
+                abs(self.__smoothed_rtt - rtt) - self.__rtt_variance)
+            self.__smoothed_rtt += self.RTT_SMOOTHING * (rtt -
+                self.__smoothed_rtt)
+        # Acks echo the send time of the data packet they answer, so every
+        # ack is a valid sample, even for retransmissions, and a backed off
+        # timeout is recomputed on the next ack.
+        self.__rto = min(max(self.__smoothed_rtt + 4 * self.__rtt_variance,
+            self.MIN_RTO), self.MAX_RTO)
+
+        if self.__sack_scoreboard is not None:
+            self.update_sack_scoreboard(ack_packet)
+
+        last_ack_number = self.__last_ack_number_received
+        self.__congestion_control.receive_ack(ack_packet, rtt)
+        self.__last_ack_number_received = ack_packet.get_ack_number()
+        if (self.__last_ack_number_received > last_ack_number and
+                not self.__congestion_control.keeps_retransmit_timer()):
+            self.restart_retransmit_timer()
+
+        if self.__instrumented:
+            self.__controller.log(
+                "window-size",
+                self.__flow_id,
+                self.__window_size,
+                ylabel="window size (pkts)",
+            )
+
+    def update_sack_scoreboard(self, ack_packet):
+        """Records the sequence numbers that an ack reports as received."""
+        scoreboard = self.__sack_scoreboard
         ack_number = ack_packet.get_ack_number()
-        if self.__state == FlowStates.RenoSlowStartPart1:
-            self.handle_reno_SS1(ack_number)
-        elif self.__state == FlowStates.RenoSlowStartPart2:
-            self.handle_reno_SS2(ack_number)
-        elif self.__state == FlowStates.RenoCA:
-            self.handle_reno_CA(ack_number)
-        elif self.__state == FlowStates.RenoFastRecovery:
-            self.handle_reno_FR(ack_number)
-
-        if ack_number > self.__tcp_sequence_number:
-            self.__tcp_sequence_number = ack_number
-            self.__num_acks_repeated = 0
-        self.__last_ack_number_received = ack_number
-
+        if ack_number > scoreboard.get_next_sequence_number():
+            scoreboard.advance(ack_number -
+                scoreboard.get_next_sequence_number())
+        for start, end in ack_packet.get_sack_blocks() or ():
+            scoreboard.add_range(start, end)
+        if self.__retransmitted_holes:
+            # A retransmission is lost too once NUM_ACKS_THRESHOLD - 1 packets
+            # sent after it are reported as received, and is then
+            # retransmitted again.
+            lost_limit = scoreboard.find_highest(self.NUM_ACKS_THRESHOLD - 1)
+            retransmitted_holes = {}
+            for hole, sequence_number in self.__retransmitted_holes.items():
+                if scoreboard.next_missing(hole) != hole:
+                    continue
+                if lost_limit is not None and lost_limit >= sequence_number:
+                    if self.__hole_cursor is not None:
+                        self.__hole_cursor = min(self.__hole_cursor, hole)
+                    continue
+                retransmitted_holes[hole] = sequence_number
+            self.__retransmitted_holes = retransmitted_holes
+        if (self.__hole_cursor is not None and
+                ack_number >= self.__sack_recovery_point):
+            self.__hole_cursor = None
+            self.__sack_recovery_point = None
+            self.__sack_lost_point = None
+
+    def __lost_limit(self):
+        """Returns the sequence number below which the packets not reported
+        as received count as lost, i.e. have NUM_ACKS_THRESHOLD - 1 packets
+        reported as received above them (IsLost in RFC 6675), or were sent
+        before a retransmission timeout."""
+        scoreboard = self.__sack_scoreboard
+        limit = scoreboard.find_highest(self.NUM_ACKS_THRESHOLD - 1)
+        if limit is None:
+            limit = scoreboard.get_next_sequence_number()
+        if self.__sack_lost_point is not None:
+            limit = max(limit, self.__sack_lost_point)
+        return limit
+
+    def restart_retransmit_timer(self):
+        """Restarts the retransmission timer if data is in flight, or stops
+        it otherwise."""
+        if self.__tcp_sequence_number > self.__last_ack_number_received:
+            self._start_retransmit_timer(
+                self.__controller.get_current_time() + self.__rto)
+        else:
+            self.__retransmit_deadline = None
+
+    def _start_retransmit_timer(self, deadline):
+        self.__retransmit_deadline = deadline
+        if self.__retransmit_timer is not None:
+            if self.__retransmit_timer_time <= deadline:
+                return
+            self.__controller.cancel_event(self.__retransmit_timer)
+        self.__retransmit_timer = self.__controller.add_event(deadline,
+            self.retransmit_timeout, [])
+        self.__retransmit_timer_time = deadline
+
+    def retransmit_timeout(self):
+        """Called when no new data was acked for a retransmission timeout.
+        The timeout is doubled, and the flow goes back to its last ack, which
+        restarts the timer. With SACK, every packet sent so far and not
+        reported as received counts as lost, and is retransmitted once, as in
+        RFC 6675."""
+        self.__retransmit_timer = None
+        deadline = self.__retransmit_deadline
+        if deadline is None:
+            return
+        if deadline > self.__controller.get_current_time():
+            self._start_retransmit_timer(deadline)
+            return
+        self.__retransmit_deadline = None
+        self.__rto = min(self.__rto * 2, self.MAX_RTO)
+        self.__fast_recovery_sequence_number = None
+        if self.__sack_scoreboard is not None:
+            self.__hole_cursor = None
+            self.__retransmitted_holes = {}
+            self.__sack_lost_point = self.__tcp_sequence_number
+        self.go_back_to(self.__last_ack_number_received)
+        self.__congestion_control.on_timeout()
+        if self.__instrumented:
+            self.__controller.log(
+                "window-size",
+                self.__flow_id,
+                self.__window_size,
+                ylabel="window size (pkts)",
+            )
+        self.notify_window_open()
 
     @staticmethod
-    def flow_rate_aggregator(values, interval_length):
+    def flow_rate_aggregator(accumulator, interval_length):
         """Returns the average flow rate in megabits per second (Mbps)."""
-        return sum(values) / float(interval_length) * 8.0 / 1000000.0
+        return accumulator.sum / float(interval_length) * 8.0 / 1000000.0
 
     def receive_data(self, data_packet):
-        self.__controller.log(
-            "flow-rate",
-            self.__flow_id,
-            data_packet.get_size(),
-            values_aggregator=self.flow_rate_aggregator,
-            ylabel="flow rate (Mbps)",
-        )
-
-        sequence_number = data_packet.get_sequence_number()
-        self.__uncounted_sequence_numbers[sequence_number] = True
-        while (self.__max_contiguous_sequence_number + 1 in
-                self.__uncounted_sequence_numbers):
-            self.__max_contiguous_sequence_number += 1
-            self.__uncounted_sequence_numbers.pop(
-                self.__max_contiguous_sequence_number)
+        if self.__instrumented:
+            self.__controller.log(
+                "flow-rate",
+                self.__flow_id,
+                data_packet.get_size(),
+                values_aggregator=self.flow_rate_aggregator,
+                ylabel="flow rate (Mbps)",
+            )
+
+        self.__reassembly_buffer.add(data_packet.get_sequence_number())
+        self.__last_data_sequence_number = data_packet.get_sequence_number()
+        if data_packet.get_sack_blocks() is not None:
+            self.__sack = True
 
     def window_is_full(self):
-        if self.__tcp == "reno":
-            return self.window_is_full_reno()
-        else:
-            return self.window_is_full_fast()
-
-    def window_is_full_reno(self):
-        return (self.__last_ack_number_received + self.__window_size <=
-            self.__tcp_sequence_number)
-
-    def window_is_full_fast(self):
-        return (self.__window_start + self.__window_size <=
-            self.__tcp_sequence_number)
-
-    def construct_next_data_packet(self):
-        if self.__tcp == "reno":
-            return self.construct_next_data_packet_reno()
-        elif self.__tcp == "fast":
-            return self.construct_next_data_packet_fast()
-        else:
-            raise NotImplementedError(
-                "Unsupported TCP Congestion Control Algorithm")
-
-    def construct_next_data_packet_fast(self):
-        if not (self.is_infinite_flow() or self.num_remaining_bytes() > 0):
+        # With SACK, the first retransmission of a recovery is sent right
+        # away, as in RFC 6675.
+        if (self.__fast_recovery_sequence_number is not None and
+                (self.__congestion_control.RETRANSMIT_IMMEDIATELY or
+                 self.__sack_scoreboard is not None)):
             return False
-        user_bytes = min(self.DATA_MAX_PACKET_SIZE, self.num_remaining_bytes())
-        self.__num_remaining_bytes -= user_bytes
-        self.__sent_bytes += user_bytes
-        packet_type = PacketTypes.TCP_DATA
+        return self.__window_size <= self.num_packets_in_window()
+
+    def window_room(self):
+        """Returns the number of data packets that can be sent before the
+        window is full."""
+        return max(0, int(math.ceil(self.__window_size -
+            self.num_packets_in_window())))
+
+    def num_packets_in_window(self):
+        """Returns the number of data packets that count against the window,
+        i.e. sent since the window start. With SACK, this is the number of
+        packets in flight (pipe in RFC 6675): the packets reported as
+        received and the lost ones do not count, and the retransmitted ones
+        do."""
+        window_start = self.__congestion_control.get_window_start()
         sequence_number = self.__tcp_sequence_number
-        ack_number = 0
-
-        if self.__fast_recovery_sequence_number is not None:
-            sequence_number = self.__fast_recovery_sequence_number
-            self.__fast_recovery_sequence_number = None
-        else:
-            sequence_number = self.__tcp_sequence_number
-            self.__tcp_sequence_number += 1
-
-        t = self.__controller.get_current_time()
-        return TCPPacket(self.__controller, self.get_src_id(),
-                self.get_dst_id(), user_bytes, packet_type,
-                         sequence_number, ack_number, self.get_flow_id(), t, t)
-
-    def construct_next_data_packet_reno(self):
+        num_packets = sequence_number - window_start
+        scoreboard = self.__sack_scoreboard
+        if scoreboard is not None and (scoreboard.num_intervals() or
+                self.__sack_lost_point is not None):
+            lost_limit = min(max(self.__lost_limit(), window_start),
+                sequence_number)
+            num_packets -= (lost_limit - window_start) + \
+                scoreboard.count_received(lost_limit, sequence_number)
+            num_packets += len(self.__retransmitted_holes)
+        return num_packets
+
+    def num_remaining_packets(self):
+        """Returns the number of data packets left to send, which is infinite
+        for flows that never end."""
+        if self.is_infinite_flow():
+            return float('inf')
+        return int(math.ceil(self.__num_remaining_bytes /
+            float(self.DATA_MAX_PACKET_SIZE)))
+
+    def construct_next_data_packet(self, data_time=None):
+        """Returns the next data packet to send, or False if there is nothing
+        left to send.
+
+        Args:
+            data_time: The time the packet is sent at, if not now, e.g. for
+                the later packets of a train.
+        """
         if not (self.is_infinite_flow() or self.num_remaining_bytes() > 0):
             return False
         user_bytes = min(self.DATA_MAX_PACKET_SIZE, self.num_remaining_bytes())
@@ -291,29 +487,84 @@ class Flow(object):
         sequence_number = self.__tcp_sequence_number
         ack_number = 0
 
+        scoreboard = self.__sack_scoreboard
         if self.__fast_recovery_sequence_number is not None:
             sequence_number = self.__fast_recovery_sequence_number
             self.__fast_recovery_sequence_number = None
+            if scoreboard is not None:
+                self.__retransmitted_holes[sequence_number] = \
+                    self.__tcp_sequence_number
         else:
-            sequence_number = self.__tcp_sequence_number
-            self.__tcp_sequence_number += 1
-        t = self.__controller.get_current_time()
-        return TCPPacket(self.__controller, self.get_src_id(),
-                self.get_dst_id(), user_bytes, packet_type,
-                sequence_number, ack_number, self.get_flow_id(), t, t)
-
-    def construct_next_ack_packet(self, data_pack_time):
+            sequence_number = self.__next_lost_packet()
+            if sequence_number is None:
+                sequence_number = self.__tcp_sequence_number
+                self.__tcp_sequence_number += 1
+
+        t = data_time
+        if t is None:
+            t = self.__controller.get_current_time()
+        packet = TCPPacket(self.__src_id, self.__dst_id, user_bytes,
+            packet_type, sequence_number, ack_number, self.__flow_id, t, t,
+            () if self.__sack else None)
+        self.__congestion_control.on_send(packet)
+        if self.__retransmit_deadline is None:
+            self._start_retransmit_timer(t + self.__rto)
+        return packet
+
+    def __next_lost_packet(self):
+        """Returns the next packet to retransmit during a SACK loss recovery,
+        i.e. the lowest sequence number at or above the hole cursor that
+        counts as lost and was not retransmitted yet (NextSeg in RFC 6675),
+        or None if there is none."""
+        if self.__hole_cursor is None:
+            return None
+        scoreboard = self.__sack_scoreboard
+        lost_limit = min(self.__lost_limit(), self.__tcp_sequence_number)
+        hole = scoreboard.next_missing(self.__hole_cursor)
+        while hole < lost_limit and hole in self.__retransmitted_holes:
+            hole = scoreboard.next_missing(hole + 1)
+        # Later acks may show the packets from here on as lost, so the
+        # cursor stays until the recovery ends.
+        self.__hole_cursor = hole
+        if hole >= lost_limit:
+            return None
+        self.__retransmitted_holes[hole] = self.__tcp_sequence_number
+        return hole
+
+    def construct_next_ack_packet(self, data_pack_time, ack_time=None):
+        if ack_time is None:
+            ack_time = self.__controller.get_current_time()
         sequence_number = 0
-        ack_number = self.__max_contiguous_sequence_number + 1
+        ack_number = self.__reassembly_buffer.get_next_sequence_number()
+        size = self.ACK_PACKET_SIZE
+        sack_blocks = None
+        if self.__sack:
+            # The block of the data packet just received comes first, as in
+            # RFC 2018, so that the source learns about the highest data
+            # received, and then the lowest blocks, since the holes below them
+            # are the ones the source retransmits first.
+            buffer = self.__reassembly_buffer
+            last_block = None
+            if self.__last_data_sequence_number is not None:
+                last_block = buffer.get_interval(
+                    self.__last_data_sequence_number)
+            if last_block is None:
+                sack_blocks = buffer.get_intervals(self.MAX_SACK_BLOCKS)
+            else:
+                sack_blocks = [last_block] + [block for block in
+                    buffer.get_intervals(self.MAX_SACK_BLOCKS)
+                    if block != last_block][:self.MAX_SACK_BLOCKS - 1]
+            sack_blocks = tuple(sack_blocks)
+            size += self.SACK_BLOCK_SIZE * len(sack_blocks)
         return TCPPacket(
-            self.__controller,
-            self.get_dst_id(),
-            self.get_src_id(),
-            self.ACK_PACKET_SIZE,
+            self.__dst_id,
+            self.__src_id,
+            size,
             PacketTypes.TCP_ACK,
             sequence_number,
             ack_number,
-            self.get_flow_id(),
+            self.__flow_id,
             data_pack_time,
-            self.__controller.get_current_time()
+            ack_time,
+            sack_blocks
         )
@@ -0,0 +1,319 @@
+from Device import Router
+from Flow import FlowStates
+import math
+
+class FluidFlow(object):
+    """The state of a flow taken over by the fluid model.
+
+    Attributes:
+        flow: The Flow at the source host.
+        data_path: The list of (link, sending device id) of the data packets.
+        ack_path: The list of (link, sending device id) of the acks.
+        buffer_packets: The number of data packets that the bottleneck link
+            buffers.
+        rate: The rate of the flow, in packets per second.
+        window_size: The window size, in packets.
+        initial_window_size: The window size when the flow went fluid.
+        last_update_time: The time up to which the flow has been advanced.
+        packet_fraction: The fraction of a packet carried over between steps.
+        draining: True while waiting for the packets in flight to be acked
+            before the flow goes fluid.
+        num_drain_checks: The number of times the drain has been checked.
+        event: The handle of the pending check_drained or step event.
+    """
+
+    def __init__(self, flow, data_path, ack_path, rate):
+        self.flow = flow
+        self.data_path = data_path
+        self.ack_path = ack_path
+        bottleneck = min((link for link, _ in data_path),
+                         key=lambda x: x.get_throughput())
+        packet_size = float(flow.DATA_MAX_PACKET_SIZE)
+        self.buffer_packets = bottleneck.get_buffer_size() / packet_size
+        self.rate = min(rate, bottleneck.get_throughput() / packet_size)
+        self.window_size = flow.get_window_size()
+        self.initial_window_size = self.window_size
+        self.last_update_time = None
+        self.packet_fraction = 0.0
+        self.draining = True
+        self.num_drain_checks = 0
+        self.event = None
+
+    def max_window_size(self):
+        """Returns the window size at which a Reno flow is handed back to
+        packets, i.e. when the extra packets in flight could fill the
+        bottleneck buffer."""
+        return self.initial_window_size + self.buffer_packets
+
+
+class FluidModel(object):
+    """Fast-forwards long, steady flows with a fluid rate model instead of
+    simulating every packet.
+
+    Every CHECK_INTERVAL seconds, the flows that are alone on the links of
+    their data path and that have settled, i.e. whose ack rate barely changed
+    since the last check and, for Reno, that are in congestion avoidance, are
+    paused. Once their packets in flight are acked, they are advanced in
+    TIME_STEP steps at the ack rate they settled at, capped by the bottleneck
+    link. The rate is measured rather than derived from the window and the
+    link delays, since acks and data share each link and so the round trip
+    time depends on the traffic in both directions. A Reno window grows by one
+    packet per round trip time, i.e. by the rate over the window per second. A
+    FAST window stays where it settled. Flows of other algorithms, whose
+    windows follow neither model, are always simulated packet by packet.
+
+    Only flows whose path was the same at the last two checks are taken over,
+    since route changes reorder packets. A flow goes back to packets when
+    another flow starts sharing one of its links, when its route changes, or,
+    for Reno, when its window grows by as many packets as the bottleneck
+    buffer holds, so that the loss that follows is simulated exactly.
+
+    Attributes:
+        _controller: The controller object.
+        _fluid_flows: Maps the ids of the flows taken over by the model to
+            their FluidFlow.
+        _acks: Maps flow ids to the last ack number seen at the last check.
+        _rates: Maps flow ids to their ack rate over the last check interval,
+            in packets per second, to tell when a flow has settled.
+        _paths: Maps flow ids to the data path seen at the last check, as a
+            list of (link id, sending device id).
+    """
+
+    CHECK_INTERVAL = 1.0
+    TIME_STEP = 0.5
+    RATE_TOLERANCE = 0.05
+    MAX_DRAIN_CHECKS = 10
+    # The TCP algorithms the fluid model can advance.
+    ALGORITHMS = ('reno', 'fast')
+
+    def __init__(self, controller):
+        self._controller = controller
+        self._fluid_flows = {}
+        self._acks = {}
+        self._rates = {}
+        self._paths = {}
+
+    def start(self):
+        """Schedules the first check."""
+        self._controller.add_event(self._controller.get_current_time() +
+            self.CHECK_INTERVAL, self.check_flows, [])
+
+    def num_fluid_flows(self):
+        """Returns the number of flows currently advanced by the model."""
+        return sum(1 for x in self._fluid_flows.values() if not x.draining)
+
+    def _path(self, flow_id, src_id, dst_id):
+        """Returns the list of (link, sending device id) that the packets of a
+        flow follow from a host to another, or None if there is no route."""
+        devices = self._controller.devices
+        device = devices[src_id]
+        link = device.get_link()
+        path = []
+        while len(path) <= len(devices):
+            path.append((link, device.get_device_id()))
+            device = link.opposite_device(device.get_device_id())
+            if device.get_device_id() == dst_id:
+                return path
+            if not isinstance(device, Router):
+                return None
+            link_id = device.get_next_link_id(flow_id, dst_id)
+            if link_id is None:
+                return None
+            link = device.get_links()[link_id]
+        # Routing loop.
+        return None
+
+    def _is_settled(self, flow, rate):
+        if flow.is_recovering():
+            return False
+        if flow.get_tcp_algorithm() not in self.ALGORITHMS:
+            return False
+        if (flow.get_tcp_algorithm() == 'reno' and
+                flow.get_state() != FlowStates.RenoCA):
+            return False
+        previous_rate = self._rates.get(flow.get_flow_id())
+        return (previous_rate is not None and rate is not None and
+                abs(rate - previous_rate) <= self.RATE_TOLERANCE *
+                previous_rate)
+
+    def check_flows(self):
+        """Hands the settled, uncontended flows over to the fluid model, and
+        the fluid flows that are now contended back to packets."""
+        flows = [x for x in self._controller.get_active_flows()
+                 if x.has_started()]
+        paths = {}
+        links_in_use = {}
+        for flow in flows:
+            flow_id = flow.get_flow_id()
+            path = self._path(flow_id, flow.get_src_id(), flow.get_dst_id())
+            if path is not None:
+                path = [(link.get_link_id(), device_id)
+                        for link, device_id in path]
+            paths[flow_id] = path
+            for key in path or ():
+                links_in_use[key] = links_in_use.get(key, 0) + 1
+
+        for flow in flows:
+            flow_id = flow.get_flow_id()
+            path = paths[flow_id]
+            stable = path is not None and path == self._paths.get(flow_id)
+            contended = path is None or any(links_in_use[x] > 1 for x in path)
+            rate = None
+            if flow_id in self._acks:
+                rate = (flow.get_last_ack_number() - self._acks[flow_id]) / \
+                    self.CHECK_INTERVAL
+            if flow_id in self._fluid_flows:
+                if contended or not stable:
+                    self.end_fluid(flow_id)
+            elif stable and not contended and self._is_settled(flow, rate):
+                self._begin_drain(flow, rate)
+            self._acks[flow_id] = flow.get_last_ack_number()
+            self._rates[flow_id] = rate
+            self._paths[flow_id] = path
+
+        self._controller.add_event(self._controller.get_current_time() +
+            self.CHECK_INTERVAL, self.check_flows, [])
+
+    def notify_flow_start(self, flow):
+        """Hands the fluid flows that share a link with a starting flow back
+        to packets."""
+        if not self._fluid_flows:
+            return
+        flow_id = flow.get_flow_id()
+        path = self._path(flow_id, flow.get_src_id(), flow.get_dst_id())
+        if path is None:
+            return
+        keys = {(link.get_link_id(), device_id) for link, device_id in path}
+        for fluid_flow_id, fluid_flow in list(self._fluid_flows.items()):
+            if any((link.get_link_id(), device_id) in keys
+                   for link, device_id in fluid_flow.data_path):
+                self.end_fluid(fluid_flow_id)
+
+    def _begin_drain(self, flow, rate):
+        data_path = self._path(flow.get_flow_id(), flow.get_src_id(),
+            flow.get_dst_id())
+        ack_path = self._path(flow.get_flow_id(), flow.get_dst_id(),
+            flow.get_src_id())
+        if ack_path is None or rate <= 0:
+            return
+        fluid_flow = FluidFlow(flow, data_path, ack_path, rate)
+        self._fluid_flows[flow.get_flow_id()] = fluid_flow
+        self._controller.devices[flow.get_src_id()].pause_flow(flow)
+        fluid_flow.event = self._controller.add_event(
+            self._controller.get_current_time() + flow.get_smoothed_rtt(),
+            self.check_drained, [flow.get_flow_id()])
+
+    def check_drained(self, flow_id):
+        """Starts advancing a paused flow once all its packets are acked, or
+        gives up on it if that takes too long or it lost a packet."""
+        fluid_flow = self._fluid_flows[flow_id]
+        flow = fluid_flow.flow
+        fluid_flow.event = None
+        fluid_flow.num_drain_checks += 1
+        if flow.is_recovering() or (flow.get_tcp_algorithm() == 'reno' and
+                flow.get_state() != FlowStates.RenoCA):
+            self.end_fluid(flow_id)
+            return
+        if flow.num_unacked_packets() > 0:
+            if fluid_flow.num_drain_checks >= self.MAX_DRAIN_CHECKS:
+                self.end_fluid(flow_id)
+            else:
+                fluid_flow.event = self._controller.add_event(
+                    self._controller.get_current_time() +
+                    flow.get_smoothed_rtt(), self.check_drained, [flow_id])
+            return
+
+        fluid_flow.draining = False
+        fluid_flow.window_size = flow.get_window_size()
+        fluid_flow.initial_window_size = fluid_flow.window_size
+        fluid_flow.last_update_time = self._controller.get_current_time()
+        self._schedule_step(fluid_flow)
+
+    def _advance_window(self, fluid_flow, duration):
+        """Returns the window size and the number of packets sent after the
+        given time, from the current window size."""
+        window_size = fluid_flow.window_size
+        num_packets = fluid_flow.rate * duration
+        if fluid_flow.flow.get_tcp_algorithm() == 'reno':
+            # Congestion avoidance: dW/dt = 1 / RTT = rate / W.
+            window_size = math.sqrt(window_size ** 2 + 2 * num_packets)
+        return window_size, num_packets
+
+    def _time_to_full_buffer(self, fluid_flow):
+        """Returns the time until a Reno window fills the bottleneck buffer."""
+        return (fluid_flow.max_window_size() ** 2 -
+                fluid_flow.window_size ** 2) / (2 * fluid_flow.rate)
+
+    def _schedule_step(self, fluid_flow):
+        flow = fluid_flow.flow
+        duration = self.TIME_STEP
+        if flow.get_tcp_algorithm() == 'reno':
+            duration = min(duration, self._time_to_full_buffer(fluid_flow))
+        if not flow.is_infinite_flow():
+            duration = min(duration, (flow.num_remaining_packets() -
+                fluid_flow.packet_fraction) / fluid_flow.rate)
+        fluid_flow.event = self._controller.add_event(
+            fluid_flow.last_update_time + max(duration, 0.0), self.step,
+            [flow.get_flow_id()])
+
+    def _advance(self, fluid_flow):
+        """Advances a fluid flow up to the current time."""
+        flow = fluid_flow.flow
+        now = self._controller.get_current_time()
+        window_size, num_packets = self._advance_window(fluid_flow,
+            now - fluid_flow.last_update_time)
+        num_packets += fluid_flow.packet_fraction
+        # Round to absorb the float error of the step scheduled to end the
+        # flow.
+        whole_packets = int(num_packets + 1e-6)
+        if not flow.is_infinite_flow():
+            whole_packets = min(whole_packets,
+                flow.num_remaining_packets())
+        fluid_flow.packet_fraction = max(num_packets - whole_packets, 0.0)
+        fluid_flow.window_size = window_size
+        fluid_flow.last_update_time = now
+        if whole_packets <= 0:
+            flow.advance_fluid(0, window_size)
+            return
+
+        num_bytes = flow.advance_fluid(whole_packets, window_size)
+        receiver = self._controller.devices[flow.get_dst_id()].get_flow(
+            flow.get_flow_id())
+        if receiver is not None:
+            receiver.receive_fluid_data(whole_packets, num_bytes)
+        for link, _ in fluid_flow.data_path:
+            link.add_fluid_traffic(num_bytes, whole_packets)
+        for link, _ in fluid_flow.ack_path:
+            link.add_fluid_traffic(whole_packets * flow.ACK_PACKET_SIZE,
+                whole_packets)
+
+    def step(self, flow_id):
+        """Advances a fluid flow by one step, and hands it back to packets if
+        it is done or its window fills the bottleneck buffer."""
+        fluid_flow = self._fluid_flows[flow_id]
+        flow = fluid_flow.flow
+        fluid_flow.event = None
+        self._advance(fluid_flow)
+
+        if not flow.is_infinite_flow() and flow.num_remaining_bytes() <= 0:
+            del self._fluid_flows[flow_id]
+            self._controller.devices[flow.get_src_id()].resume_flow(flow)
+            self._controller.remove_flow(flow)
+            return
+        if (flow.get_tcp_algorithm() == 'reno' and fluid_flow.window_size >=
+                fluid_flow.max_window_size() - 1e-6):
+            self.end_fluid(flow_id)
+            return
+        self._schedule_step(fluid_flow)
+
+    def end_fluid(self, flow_id):
+        """Hands a flow back to packet-level simulation."""
+        fluid_flow = self._fluid_flows.pop(flow_id)
+        if fluid_flow.event is not None:
+            self._controller.cancel_event(fluid_flow.event)
+        if not fluid_flow.draining:
+            self._advance(fluid_flow)
+        self._rates.pop(flow_id, None)
+        self._paths.pop(flow_id, None)
+        self._controller.devices[fluid_flow.flow.get_src_id()].resume_flow(
+            fluid_flow.flow)
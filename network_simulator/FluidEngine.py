@@ -0,0 +1,744 @@
+#!/usr/bin/python
+
+from CongestionControl import CONGESTION_CONTROL_ALGORITHMS
+from Flow import Flow, FlowStates
+from Metrics import open_metrics_sink
+from Routing import static_routing_tables
+from matplotlib import pyplot
+from optparse import OptionParser
+import json
+import math
+import numpy
+
+class IncidenceMatrix(object):
+    """A sparse 0/1 matrix whose rows are the directed links and whose columns
+    are the flows, with a 1 where a flow crosses a link. Only the coordinates
+    of the ones are stored, so its size is the total length of the routes.
+
+    Attributes:
+        num_links: The number of rows.
+        num_flows: The number of columns.
+        link_indices: The row of each one.
+        flow_indices: The column of each one.
+    """
+
+    def __init__(self, num_links, num_flows, entries):
+        """Initializes the IncidenceMatrix instance.
+
+        Args:
+            num_links: The number of directed links.
+            num_flows: The number of flows.
+            entries: The (link index, flow index) pairs of the ones.
+        """
+        self.num_links = num_links
+        self.num_flows = num_flows
+        entries = numpy.array(list(entries), dtype=numpy.intp).reshape(-1, 2)
+        self.link_indices = entries[:, 0]
+        self.flow_indices = entries[:, 1]
+
+    def link_sums(self, flow_values):
+        """Returns the matrix times a vector of per-flow values, i.e. the sum
+        over the flows crossing each link."""
+        return numpy.bincount(self.link_indices,
+            weights=flow_values[self.flow_indices], minlength=self.num_links)
+
+    def flow_sums(self, link_values):
+        """Returns the transposed matrix times a vector of per-link values,
+        i.e. the sum over the links of each route."""
+        return numpy.bincount(self.flow_indices,
+            weights=link_values[self.link_indices], minlength=self.num_flows)
+
+
+class FluidEngine(object):
+    """Simulates a network as fluid flows instead of packets, for estimates
+    on large networks.
+
+    It reads the same JSON representation of the network as the Controller.
+    Each link is split into its two directions, which each have the buffer of
+    the link. The state of all the links and flows is kept in NumPy arrays,
+    and the routes in IncidenceMatrix objects, so every time step is a fixed
+    number of array operations whatever the size of the network. The time
+    steps are a fraction of the smallest round trip time, so they lengthen
+    as the queues build up.
+
+    At every time step, each flow sends its window per round trip time, which
+    is the sum of the delays, transmission times and queueing delays of the
+    links its data and acks cross. As in Link, the two directions of a link
+    share its capacity and send their packets in the order they arrived, and
+    turning the link around takes its delay. A link that carries packets both
+    ways turns around after a share of its packets, SWITCH_FRACTION of what
+    arriving in random order would give, 2 * p * (1 - p) with p the share of
+    the packets going one way, so each packet costs that share of a delay on
+    top of its transmission time, which lowers the capacity of the link. Each
+    link buffers what it receives beyond that capacity and drops what
+    overflows the buffers; the drops are shared by the flows in proportion to
+    their rates. As in Host, a flow does not send data that would overflow
+    the buffer of the link of its host, but the acks that would are dropped.
+    The lost data packets are not acked, and neither are those whose acks
+    are lost. The windows then follow the acks received during the step, as
+    in RenoCongestionControl and
+    FastCongestionControl: a Reno window grows by one packet per ack in slow
+    start and by one over the window per ack in congestion avoidance, and is
+    cut when a packet is lost, at most once per round trip time; a FAST window
+    is updated per ack with the ratio of the base round trip time to the
+    current one.
+
+    The routes are the routing tables of the JSON file, completed with the
+    shortest paths by delay, or only the shortest paths if the routing mode
+    is 'shortest-path'; they do not change during the simulation, and only
+    the first next hop of a multipath route is used. Routing packets are not
+    simulated.
+
+    The same five metric families as the Controller are logged, for the links
+    and flows shown on the plot, or all of them if 'log_all' is set.
+
+    Attributes:
+        _current_time: The current time in the simulation, in seconds.
+        _time_step: The length of the last time step, in seconds.
+        _min_time_step: The length of the time steps if they are fixed, and
+            the shortest one otherwise.
+        _adaptive_steps: True if the time steps follow the round trip times
+            of the flows.
+        _num_steps: The number of time steps so far.
+        _log_interval_start: The start time of the current log interval.
+        _log_interval_length: The length of the log intervals, in seconds.
+        _link_ids: The ids of the links; directed link 2 * i is the rightward
+            direction of link i, and 2 * i + 1 its leftward direction.
+        _flow_ids: The ids of the flows.
+        _capacities: The capacity of each link, shared by its two
+            directions, in bytes per second.
+        _delays: The delay of each link, in seconds.
+        _buffer_sizes: The buffer size of each directed link, in bytes.
+        _queues: The number of bytes buffered by each directed link.
+        _service_rates: The number of bytes each link could serve per second
+            during the last time step, given how often it turned around.
+        _host_links: True for the directed links sent over by a host.
+        _data_routes: The IncidenceMatrix of the data packets.
+        _ack_routes: The IncidenceMatrix of the acks.
+        _round_trip_routes: The IncidenceMatrix of the data packets and the
+            acks together.
+        _transmission_times: The time each flow spends transmitting a data
+            packet and its ack over the links of its routes.
+        _start_times: The start time of each flow.
+        _remaining_bytes: The number of bytes left to send by each flow, or
+            inf for flows that never end.
+        _is_fast: True for the FAST flows, False for the Reno ones.
+        _has_fast: True if any flow is a FAST one.
+        _has_reno: True if any flow is a Reno one.
+        _window_sizes: The window size of each flow, in packets.
+        _states: The FlowStates of each Reno flow.
+        _ss_thresholds: The slow start threshold of each Reno flow.
+        _base_rtts: The smallest round trip time seen by each flow.
+        _lost_packets: The packets lost by each Reno flow since it last cut
+            its window.
+        _last_loss_times: The time each Reno flow last cut its window.
+        _logged_links: The indices of the links that are logged.
+        _logged_flows: The indices of the flows that are logged.
+        _interval_sums: Maps the accumulators of the current log interval to
+            arrays of sums.
+        _time_series: Maps (log_type, device_name) to the (x_values,
+            y_values) lists of the aggregated points, if they are kept.
+        _keep_time_series: True if the aggregated points are kept in memory.
+        _metrics_sinks: The sinks the aggregated points are streamed to.
+    """
+
+    LOG_TYPES = (
+        'flow-rate',
+        'window-size',
+        'link-rate',
+        'buffer-occupancy',
+        'packet-loss'
+    )
+
+    YLABELS = {
+        'flow-rate': 'flow rate (Mbps)',
+        'window-size': 'window size (pkts)',
+        'link-rate': 'link rate (Mbps)',
+        'buffer-occupancy': 'buffer occupancy (pkts)',
+        'packet-loss': 'packet loss (pkts)',
+    }
+
+    # The reasons run can stop for.
+    STOP_REASONS = ('flows-done', 'time')
+
+    # The time step, as a fraction of the smallest round trip time of the
+    # active flows, queueing included. It is never shorter than that fraction
+    # of the smallest round trip time with empty buffers, which is the step
+    # while a FAST flow is active.
+    TIME_STEP_FRACTION = 0.25
+
+    # How often a link turns around, as a share of how often it would if the
+    # packets of its two directions arrived in random order. The packets of a
+    # flow tend to arrive in runs, e.g. the acks of a run of data packets.
+    # This is a rough guess, not a measured value: the packet-level links
+    # turn around from 0.3 to 1 times as often, depending on the network.
+    SWITCH_FRACTION = 0.5
+
+    # The TCP algorithms the engine models.
+    ALGORITHMS = ('reno', 'fast')
+
+    def __init__(self, options):
+        """Initializes the FluidEngine instance.
+
+        Args:
+            options: A dictionary with option attributes, as for the
+                Controller: 'filename', 'network', 'log_interval_length' and
+                'keep_time_series' are supported, along with 'time_step', the
+                length of fixed time steps in seconds instead of steps that
+                follow the round trip times, and 'log_all', True to log
+                every link and flow instead of those shown on the plot.
+
+        Raises:
+            NotImplementedError: If a flow uses a TCP algorithm that the
+                engine does not model.
+        """
+        if options.get('network') is not None:
+            json_network = options['network']
+        else:
+            with open(options['filename']) as f:
+                json_network = json.loads(f.read())
+
+        self._current_time = 0.0
+        self._num_steps = 0
+        self._log_interval_start = 0.0
+        if options.get('log_interval_length') is not None:
+            self._log_interval_length = float(options['log_interval_length'])
+        else:
+            self._log_interval_length = 1.0
+        self._keep_time_series = options.get('keep_time_series', True)
+        self._metrics_sinks = []
+        self._time_series = {}
+
+        json_links = json_network['links']
+        json_flows = json_network['flows']
+        self._link_ids = [x['id'] for x in json_links]
+        self._flow_ids = [x['id'] for x in json_flows]
+        link_indices = {x: i for i, x in enumerate(self._link_ids)}
+
+        # Throughputs are in bits per second.
+        self._capacities = numpy.array(
+            [float(x['throughput']) / 8 for x in json_links])
+        self._delays = numpy.array(
+            [float(x['link_delay']) for x in json_links])
+        self._buffer_sizes = numpy.repeat(
+            [float(x['buffer_size']) for x in json_links], 2)
+        self._queues = numpy.zeros(2 * len(json_links))
+        self._service_rates = self._capacities.copy()
+        host_ids = {x['id'] for x in json_network['hosts']}
+        self._host_links = numpy.array([[x['left_device_id'] in host_ids,
+            x['right_device_id'] in host_ids] for x in json_links],
+            dtype=bool).reshape(-1)
+
+        routes = self._routing_tables(json_network)
+        data_entries = []
+        ack_entries = []
+        for flow_index, json_flow in enumerate(json_flows):
+            for link_index in self._route(json_network, routes,
+                    json_flow['src_id'], json_flow['dst_id'], link_indices):
+                data_entries.append((link_index, flow_index))
+            for link_index in self._route(json_network, routes,
+                    json_flow['dst_id'], json_flow['src_id'], link_indices):
+                ack_entries.append((link_index, flow_index))
+        num_directed_links = 2 * len(json_links)
+        self._data_routes = IncidenceMatrix(num_directed_links,
+            len(json_flows), data_entries)
+        self._ack_routes = IncidenceMatrix(num_directed_links,
+            len(json_flows), ack_entries)
+        self._round_trip_routes = IncidenceMatrix(num_directed_links,
+            len(json_flows), data_entries + ack_entries)
+        capacities = numpy.repeat(self._capacities, 2)
+        self._transmission_times = (self._data_routes.flow_sums(
+            Flow.DATA_MAX_PACKET_SIZE / capacities) +
+            self._ack_routes.flow_sums(Flow.ACK_PACKET_SIZE / capacities))
+
+        num_flows = len(json_flows)
+        self._start_times = numpy.array(
+            [float(x['start_time']) for x in json_flows])
+        self._remaining_bytes = numpy.array(
+            [float('inf') if x['num_bytes'] is None else float(x['num_bytes'])
+             for x in json_flows])
+        tcp = [x['tcp'] for x in json_flows]
+        for x in tcp:
+            if x not in CONGESTION_CONTROL_ALGORITHMS:
+                raise NotImplementedError(
+                    "Unsupported TCP Congestion Control Algorithm: %s" % x)
+            if x not in self.ALGORITHMS:
+                raise NotImplementedError(
+                    "The fluid engine only models %s flows, not %s; run the "
+                    "packet-level Controller instead" % (
+                        " and ".join(self.ALGORITHMS), x))
+        self._is_fast = numpy.array([x == 'fast' for x in tcp], dtype=bool)
+        self._has_fast = bool(self._is_fast.any())
+        self._has_reno = not bool(self._is_fast.all())
+        self._window_sizes = numpy.ones(num_flows)
+        self._states = numpy.full(num_flows, FlowStates.RenoSlowStartPart1)
+        self._ss_thresholds = numpy.full(num_flows, float('inf'))
+        self._base_rtts = numpy.full(num_flows, float('inf'))
+        self._lost_packets = numpy.zeros(num_flows)
+        self._last_loss_times = numpy.full(num_flows, -float('inf'))
+
+        self._adaptive_steps = options.get('time_step') is None
+        if not self._adaptive_steps:
+            self._min_time_step = float(options['time_step'])
+        elif num_flows:
+            self._min_time_step = self.TIME_STEP_FRACTION * float(
+                self._empty_rtts().min())
+        else:
+            self._min_time_step = self._log_interval_length
+        if not self._min_time_step > 0:
+            raise ValueError("The time step must be positive")
+        self._time_step = self._min_time_step
+
+        log_all = options.get('log_all', False)
+        self._logged_links = numpy.array([i for i, x in enumerate(json_links)
+            if log_all or x.get('show_on_plot')], dtype=numpy.intp)
+        self._logged_flows = numpy.array([i for i, x in enumerate(json_flows)
+            if log_all or x.get('show_on_plot')], dtype=numpy.intp)
+        self._reset_interval_sums()
+
+    @staticmethod
+    def _routing_tables(json_network):
+        """Returns the routing table of every router, mapping host ids to a
+        single link id."""
+        tables = static_routing_tables(json_network)
+        if json_network.get('routing') == 'shortest-path':
+            return tables
+        for json_router in json_network['routers']:
+            for host_id, link_ids in json_router.get('routing_table',
+                    {}).items():
+                if not isinstance(link_ids, str):
+                    link_ids = link_ids[0]
+                # Entries for links the router does not have are ignored.
+                if link_ids in json_router['links']:
+                    tables[json_router['id']][host_id] = link_ids
+        return tables
+
+    @staticmethod
+    def _route(json_network, tables, src_id, dst_id, link_indices):
+        """Returns the indices of the directed links from a host to another.
+
+        Raises:
+            ValueError: If there is no route.
+        """
+        json_links = {x['id']: x for x in json_network['links']}
+        host_links = {x['id']: x['links'][0] for x in json_network['hosts']}
+        device_id = src_id
+        link_id = host_links[src_id]
+        route = []
+        while len(route) <= len(json_links):
+            json_link = json_links[link_id]
+            if json_link['left_device_id'] == device_id:
+                route.append(2 * link_indices[link_id])
+                device_id = json_link['right_device_id']
+            else:
+                route.append(2 * link_indices[link_id] + 1)
+                device_id = json_link['left_device_id']
+            if device_id == dst_id:
+                return route
+            if device_id not in tables or dst_id not in tables[device_id]:
+                break
+            link_id = tables[device_id][dst_id]
+        raise ValueError("No route from %s to %s" % (src_id, dst_id))
+
+    def _rtts(self, link_delays):
+        """Returns the round trip time of each flow, given the time it takes
+        to cross each link besides the transmission time."""
+        return self._transmission_times + self._round_trip_routes.flow_sums(
+            numpy.repeat(link_delays, 2))
+
+    def _empty_rtts(self):
+        """Returns the round trip time of each flow with empty buffers."""
+        return self._rtts(self._delays)
+
+    def _reset_interval_sums(self):
+        num_links = len(self._link_ids)
+        num_flows = len(self._flow_ids)
+        self._interval_sums = {
+            'flow-bytes': numpy.zeros(num_flows),
+            'window-time': numpy.zeros(num_flows),
+            'active-time': numpy.zeros(num_flows),
+            'link-bytes': numpy.zeros(num_links),
+            'buffer-time': numpy.zeros(num_links),
+            'lost-packets': numpy.zeros(num_links),
+        }
+
+    def get_current_time(self):
+        """Returns the current time in the simulation."""
+        return self._current_time
+
+    def get_time_step(self):
+        """Returns the length of the last time step, in seconds."""
+        return self._time_step
+
+    def get_num_steps(self):
+        """Returns the number of time steps so far."""
+        return self._num_steps
+
+    def num_active_flows(self):
+        """Returns the number of flows that have not finished sending."""
+        return int(numpy.count_nonzero(self._remaining_bytes > 0))
+
+    def step(self):
+        """Advances the simulation by one time step."""
+        now = self._current_time
+        packet_size = float(Flow.DATA_MAX_PACKET_SIZE)
+        active = (self._start_times <= now) & (self._remaining_bytes > 0)
+
+        # The packets queued at a link are served in order, turnarounds
+        # included, at its service rate.
+        link_queues = self._queues.reshape(-1, 2).sum(axis=1)
+        rtts = self._rtts(self._delays + link_queues / self._service_rates)
+        self._base_rtts = numpy.where(active,
+            numpy.minimum(self._base_rtts, rtts), self._base_rtts)
+
+        dt = self._min_time_step
+        if self._adaptive_steps and numpy.any(active) and \
+                not numpy.any(active & self._is_fast):
+            # A Reno window changes by little within a round trip, so the
+            # step only has to be short when some round trip time is. A FAST
+            # window follows the queueing delay ack by ack, so the steps stay
+            # short while a FAST flow is active.
+            dt = max(dt, min(self.TIME_STEP_FRACTION * float(
+                rtts[active].min()), self._log_interval_length))
+            pending = self._start_times[(self._remaining_bytes > 0) &
+                (self._start_times > now)]
+            if pending.size:
+                dt = max(self._min_time_step,
+                    min(dt, float(pending.min()) - now))
+        self._time_step = dt
+
+        # Sending rates, in bytes per second.
+        rates = numpy.where(active, self._window_sizes * packet_size / rtts,
+            0.0)
+        rates = numpy.minimum(rates, self._remaining_bytes / dt)
+
+        # Hosts wait for space in the buffer of their link rather than drop
+        # data packets, so what would not fit there is not sent.
+        arrivals, packet_arrivals = self._arrivals(rates)
+        dropped = self._serve(arrivals, packet_arrivals)[1]
+        refused_fractions = numpy.divide(dropped, arrivals,
+            out=numpy.zeros_like(dropped),
+            where=self._host_links & (arrivals > 0))
+        rates *= 1 - numpy.minimum(
+            self._data_routes.flow_sums(refused_fractions), 1.0)
+
+        arrivals, packet_arrivals = self._arrivals(rates)
+        link_served, dropped = self._serve(arrivals, packet_arrivals, True)
+        loss_fractions = numpy.divide(dropped, arrivals,
+            out=numpy.zeros_like(dropped), where=arrivals > 0)
+        flow_loss_fractions = numpy.minimum(
+            self._data_routes.flow_sums(loss_fractions), 1.0)
+        ack_loss_fractions = numpy.minimum(
+            self._ack_routes.flow_sums(loss_fractions), 1.0)
+
+        delivered = rates * dt * (1 - flow_loss_fractions)
+        self._remaining_bytes -= delivered
+        num_acks = delivered * (1 - ack_loss_fractions) / packet_size
+        self._update_windows(active, rtts, num_acks,
+            rates * dt * flow_loss_fractions / packet_size)
+
+        sums = self._interval_sums
+        sums['flow-bytes'] += delivered
+        sums['window-time'] += numpy.where(active, self._window_sizes * dt,
+            0.0)
+        sums['active-time'] += numpy.where(active, dt, 0.0)
+        sums['link-bytes'] += link_served
+        sums['buffer-time'] += self._queues.reshape(-1, 2).sum(axis=1) / \
+            packet_size * dt
+        sums['lost-packets'] += dropped.reshape(-1, 2).sum(axis=1) / \
+            packet_size
+
+        self._current_time = now + dt
+        self._num_steps += 1
+        if (self._current_time - self._log_interval_length >=
+                self._log_interval_start - 1e-9):
+            self._process_interval()
+
+    def _arrivals(self, rates):
+        """Returns the number of bytes and the number of packets that arrive
+        at each directed link during a time step, given the sending rates of
+        the flows. Every data packet is acked."""
+        packet_rates = rates / Flow.DATA_MAX_PACKET_SIZE
+        data_packets = self._data_routes.link_sums(packet_rates)
+        ack_packets = self._ack_routes.link_sums(packet_rates)
+        return ((data_packets * Flow.DATA_MAX_PACKET_SIZE + ack_packets *
+            Flow.ACK_PACKET_SIZE) * self._time_step,
+            (data_packets + ack_packets) * self._time_step)
+
+    def _service_rates_of(self, arrivals, packet_arrivals):
+        """Returns the number of bytes each link can serve per second, given
+        the bytes and packets arriving at its two directions: each packet
+        takes its transmission time, plus the delay of the link times the
+        share of the packets after which the link turns around."""
+        packets = packet_arrivals.reshape(-1, 2)
+        link_packets = packets.sum(axis=1)
+        shares = numpy.divide(packets[:, 0], link_packets,
+            out=numpy.zeros_like(link_packets), where=link_packets > 0)
+        switches = self.SWITCH_FRACTION * 2 * shares * (1 - shares)
+        # The turnarounds per byte over the transmission time per byte.
+        overheads = numpy.divide(switches * link_packets * self._delays *
+            self._capacities, arrivals.reshape(-1, 2).sum(axis=1),
+            out=numpy.zeros_like(link_packets), where=link_packets > 0)
+        return self._capacities / (1 + overheads)
+
+    def _serve(self, arrivals, packet_arrivals, update_queues=False):
+        """Serves the bytes buffered by the links and those arriving during a
+        time step. Every link serves up to its service rate, shared by its
+        two directions in proportion to their backlog, buffers the rest, and
+        drops what overflows its buffers.
+
+        Args:
+            arrivals: The bytes arriving at each directed link.
+            packet_arrivals: The packets arriving at each directed link.
+            update_queues: True to keep the resulting queues and service
+                rates.
+
+        Returns:
+            A tuple (link_served, dropped) of arrays: the bytes served by each
+            link and the bytes dropped by each directed link.
+        """
+        dt = self._time_step
+        service_rates = self._service_rates_of(arrivals, packet_arrivals)
+        backlogs = self._queues + arrivals
+        link_backlogs = backlogs.reshape(-1, 2).sum(axis=1)
+        link_served = numpy.minimum(link_backlogs, service_rates * dt)
+        queues = backlogs - backlogs * numpy.repeat(numpy.divide(link_served,
+            link_backlogs, out=numpy.zeros_like(link_served),
+            where=link_backlogs > 0), 2)
+        dropped = numpy.minimum(numpy.maximum(queues - self._buffer_sizes,
+            0.0), arrivals)
+        if update_queues:
+            self._queues = numpy.maximum(queues - dropped, 0.0)
+            self._service_rates = service_rates
+        return link_served, dropped
+
+    def _update_windows(self, active, rtts, num_acks, num_lost_packets):
+        """Updates the windows with the acks and losses of one time step, as
+        RenoCongestionControl and FastCongestionControl do per ack."""
+        if self._has_fast:
+            self._update_fast_windows(active, rtts, num_acks)
+        if self._has_reno:
+            self._update_reno_windows(active, rtts, num_acks,
+                num_lost_packets)
+
+    def _update_fast_windows(self, active, rtts, num_acks):
+        windows = self._window_sizes
+        # FAST: W <- (base_rtt / rtt) W + alpha per ack, applied num_acks
+        # times with the rtt of the step.
+        fast = active & self._is_fast
+        ratios = numpy.minimum(self._base_rtts / rtts, 1.0)
+        decay = ratios ** num_acks
+        growth = numpy.where(ratios < 1.0, (1 - decay) / numpy.maximum(
+            1 - ratios, 1e-12), num_acks)
+        self._window_sizes = numpy.where(fast,
+            decay * windows + Flow.FAST_ALPHA * growth, windows)
+
+    def _update_reno_windows(self, active, rtts, num_acks, num_lost_packets):
+        windows = self._window_sizes
+        states = self._states
+        reno = active & ~self._is_fast
+        self._lost_packets += numpy.where(reno, num_lost_packets, 0.0)
+        loss = reno & (self._lost_packets >= 1) & (self._current_time -
+            self._last_loss_times >= rtts)
+        first_loss = loss & (states == FlowStates.RenoSlowStartPart1)
+        later_loss = loss & ~first_loss
+        slow_start = reno & ~loss & ((states ==
+            FlowStates.RenoSlowStartPart1) | (states ==
+            FlowStates.RenoSlowStartPart2))
+        congestion_avoidance = reno & ~loss & (states == FlowStates.RenoCA)
+
+        # The first loss ends the initial slow start, later ones go through
+        # fast recovery back to congestion avoidance.
+        self._ss_thresholds = numpy.where(first_loss, windows / 2,
+            self._ss_thresholds)
+        windows = numpy.where(first_loss, 1.0, windows)
+        windows = numpy.where(later_loss, windows / 2.5, windows)
+        states = numpy.where(first_loss, FlowStates.RenoSlowStartPart2,
+            states)
+        states = numpy.where(later_loss, FlowStates.RenoCA, states)
+        self._lost_packets = numpy.where(loss, 0.0, self._lost_packets)
+        self._last_loss_times = numpy.where(loss, self._current_time,
+            self._last_loss_times)
+
+        windows = numpy.where(slow_start, windows + num_acks, windows)
+        states = numpy.where(slow_start & (states ==
+            FlowStates.RenoSlowStartPart2) & (windows >= self._ss_thresholds),
+            FlowStates.RenoCA, states)
+        # W <- W + 1 / W per ack, i.e. dW / dack = 1 / W.
+        windows = numpy.where(congestion_avoidance,
+            numpy.sqrt(windows ** 2 + 2 * num_acks), windows)
+
+        self._window_sizes = windows
+        self._states = states
+
+    def _process_interval(self):
+        """Turns the sums of the current log interval into points."""
+        interval_length = self._current_time - self._log_interval_start
+        time = self._log_interval_start + interval_length / 2.0
+        sums = self._interval_sums
+        for index in self._logged_flows:
+            if sums['active-time'][index] <= 0:
+                continue
+            flow_id = self._flow_ids[index]
+            self._new_point('flow-rate', flow_id, time,
+                sums['flow-bytes'][index] / interval_length * 8.0 / 1000000.0)
+            self._new_point('window-size', flow_id, time,
+                sums['window-time'][index] / sums['active-time'][index])
+        for index in self._logged_links:
+            if sums['link-bytes'][index] <= 0:
+                continue
+            link_id = self._link_ids[index]
+            self._new_point('link-rate', link_id, time,
+                sums['link-bytes'][index] / interval_length * 8.0 / 1000000.0)
+            self._new_point('buffer-occupancy', link_id, time,
+                sums['buffer-time'][index] / interval_length)
+            self._new_point('packet-loss', link_id, time,
+                sums['lost-packets'][index])
+        self._reset_interval_sums()
+        self._log_interval_start = self._current_time
+
+    def _new_point(self, log_type, device_name, x, y):
+        for sink in self._metrics_sinks:
+            sink.write_point(log_type, device_name, x, y)
+        if self._keep_time_series:
+            x_values, y_values = self._time_series.setdefault(
+                (log_type, device_name), ([], []))
+            x_values.append(x)
+            y_values.append(y)
+
+    def add_metrics_sink(self, sink):
+        """Streams the aggregated points to a sink as the simulation runs.
+
+        Args:
+            sink: The MetricsSink, e.g. from Metrics.open_metrics_sink.
+        """
+        self._metrics_sinks.append(sink)
+
+    def flush_logs(self):
+        """Aggregates the points of the interval that is still being
+        collected."""
+        if self._current_time > self._log_interval_start:
+            self._process_interval()
+
+    def close_metrics_sinks(self):
+        """Flushes the logs and closes all the metrics sinks."""
+        self.flush_logs()
+        for sink in self._metrics_sinks:
+            sink.close()
+        self._metrics_sinks = []
+
+    def get_logged_devices(self, log_type):
+        """Returns the sorted names of the devices logged for a log type."""
+        return sorted(x for t, x in self._time_series if t == log_type)
+
+    def get_time_series(self, log_type, device_name):
+        """Returns the logged time series for a device, as a tuple (x_values,
+        y_values) of lists, or None if nothing has been logged for it."""
+        return self._time_series.get((log_type, device_name))
+
+    def draw_graphs(self, filename=None):
+        """Draws all the logged time series, laid out as by the Controller.
+
+        Args:
+            filename: If given, the figure is saved to this file instead of
+                being shown.
+        """
+        self.flush_logs()
+
+        f, axarr = pyplot.subplots(len(self.LOG_TYPES), sharex=True)
+
+        for index, log_type in enumerate(self.LOG_TYPES):
+            subplot = axarr[index]
+            device_names = self.get_logged_devices(log_type)
+            if not device_names:
+                continue
+            subplot.set_ylabel(self.YLABELS[log_type])
+            for device_name in device_names:
+                x_values, y_values = self._time_series[(log_type,
+                    device_name)]
+                subplot.plot(x_values, y_values, label=device_name)
+            subplot.legend(bbox_to_anchor=(1.1, 1.0))
+            subplot.set_ylim(bottom=0, auto=True)
+
+        axarr[-1].set_xlabel('time (s)')
+
+        if filename is not None:
+            f.savefig(filename, bbox_inches='tight')
+            pyplot.close(f)
+        else:
+            pyplot.show()
+
+    def run(self, num_seconds=float('inf')):
+        """Runs the simulation until all the flows are done or the given time.
+
+        Args:
+            num_seconds: The simulated time to stop at, in seconds.
+
+        Returns:
+            The reason the simulation stopped, one of STOP_REASONS.
+        """
+        while True:
+            if not numpy.any(self._remaining_bytes > 0):
+                return 'flows-done'
+            if self._current_time >= num_seconds:
+                return 'time'
+            pending = self._start_times[(self._remaining_bytes > 0) &
+                (self._start_times > self._current_time)]
+            if (pending.size and not numpy.any((self._remaining_bytes > 0) &
+                    (self._start_times <= self._current_time)) and
+                    not numpy.any(self._queues > 0)):
+                # Nothing is sent until the next flow starts.
+                next_time = min(float(pending.min()), num_seconds)
+                self.flush_logs()
+                self._current_time = next_time
+                self._log_interval_start = math.floor(next_time /
+                    self._log_interval_length) * self._log_interval_length
+                continue
+            self.step()
+
+
+if __name__ == '__main__':
+    parser = OptionParser()
+    parser.add_option("-f", "--file", dest="filename",
+        help="Test json filename (e.g. test0.json)")
+    parser.add_option("-i", "--interval", dest="log_interval_length",
+        help="Log interval length as float > 0.0")
+    parser.add_option("-q", "--quiet", action="store_false", dest="verbose",
+        default=True, help="don't print status messages to stdout")
+    parser.add_option("-o", "--output", dest="output_filename",
+        help="Save the graphs to this file (e.g. graphs.png or graphs.svg) "
+        "instead of showing them")
+    parser.add_option("-t", "--time", dest="num_seconds", type="float",
+        default=float('inf'), help="Stop at this simulated time in seconds "
+        "(default: when all the flows are done)")
+    parser.add_option("--step", dest="time_step", type="float",
+        help="Fixed time step in seconds (default: a quarter of the smallest "
+        "round trip time of the active flows)")
+    parser.add_option("--all", action="store_true", dest="log_all",
+        default=False, help="Log every link and flow, not only those shown "
+        "on the plot")
+    parser.add_option("-m", "--metrics", dest="metrics_filename",
+        help="Stream the aggregated metrics to this file as the simulation "
+        "runs; the format is chosen by the extension: .csv, .jsonl or .bin")
+    parser.add_option("--no-graphs", action="store_false", dest="graphs",
+        default=True, help="don't draw any graphs and don't keep the metrics "
+        "in memory")
+    options, _ = parser.parse_args()
+
+    if options.output_filename is not None or not options.graphs:
+        pyplot.switch_backend('Agg')
+    options.keep_time_series = options.graphs
+
+    try:
+        engine = FluidEngine(vars(options))
+    except NotImplementedError as e:
+        parser.error(str(e))
+    if options.metrics_filename is not None:
+        engine.add_metrics_sink(open_metrics_sink(options.metrics_filename))
+    stop_reason = engine.run(options.num_seconds)
+    engine.close_metrics_sinks()
+    if options.verbose:
+        print("Stopped at %.3f s (%s) after %d steps" % (
+            engine.get_current_time(), stop_reason, engine.get_num_steps()))
+    if options.graphs:
+        engine.draw_graphs(options.output_filename)
@@ -1,3 +1,5 @@
+from collections import deque
+
 class Link(object):
     """Links connect hosts and routers, and carry packets from one end to the
     other. Every link has a specified capacity in bits per second. It is assumed
@@ -6,6 +8,13 @@ class Link(object):
     is free. Link buffers are first-in, first-out. Packets that try to enter a
     full buffer will be dropped.
 
+    When packet trains are enabled, a run of packets of one flow can be queued
+    at once with queue_train, as long as nothing waits in the other direction.
+    Each packet of a train keeps the transmission times it would have had
+    alone, but the whole train is taken off the buffer and reaches the other
+    end in a single event each, when its first packet does. Each packet still
+    takes up its share of the buffer until it is put on the wire.
+
     Attributes:
         __controller: The controller object.
         __left_device: The device on the left side of the link.
@@ -15,11 +24,24 @@ class Link(object):
         __buffer_size: The buffer size in bytes.
         __rightward_buffer: The rightward buffer.
         __leftward_buffer: The leftward buffer.
+        __rightward_buffer_bytes: The number of bytes in the rightward buffer.
+        __leftward_buffer_bytes: The number of bytes in the leftward buffer.
         __link_id: The id of the link.
         __next_leftward_start_transmission_time: The next start transmission
             time for the left.
         __next_rightward_start_transmission_time: The next start transmission
             time for the right.
+        __instrumented: True if the link is logged by the controller.
+        __num_packets_transmitted: The number of packets put on the wire.
+        __max_train_length: The largest number of packets in a train, or 0 if
+            packet trains are disabled.
+        __rightward_departures: The (time, size) pairs of the packets of the
+            rightward trains that were taken off the buffer but are not on
+            the wire yet, and so still count in __rightward_buffer_bytes.
+        __leftward_departures: The same for the leftward trains.
+        __rightward_wakeup: True if a departure_handler event will tell the
+            left device that the rightward buffer has space again.
+        __leftward_wakeup: The same for the leftward buffer.
     """
     def __init__(
         self,
@@ -37,19 +59,50 @@ class Link(object):
         self.__throughput = throughput
         self.__link_delay = link_delay
         self.__buffer_size = buffer_size
-        self.__rightward_buffer = []
-        self.__leftward_buffer = []
+        self.__rightward_buffer = deque()
+        self.__leftward_buffer = deque()
+        self.__rightward_buffer_bytes = 0
+        self.__leftward_buffer_bytes = 0
         self.__link_id = link_id
         self.__next_leftward_start_transmission_time = 0.0
         self.__next_rightward_start_transmission_time = 0.0
+        self.__instrumented = controller.is_instrumented(link_id)
+        self.__num_packets_transmitted = 0
+        self.__max_train_length = controller.get_max_train_length()
+        self.__rightward_departures = deque()
+        self.__leftward_departures = deque()
+        self.__rightward_wakeup = False
+        self.__leftward_wakeup = False
 
-    @staticmethod
-    def bytes_in_buffer(buf):
-        """Returns the total number of bytes in the buffer."""
-        return sum([x.get_size() for x in buf])
+    def __release_departures(self, rightward_direction):
+        """Frees the buffer space of the train packets put on the wire by
+        now."""
+        now = self.__controller.get_current_time()
+        if rightward_direction:
+            departures = self.__rightward_departures
+            while departures and departures[0][0] <= now:
+                self.__rightward_buffer_bytes -= departures.popleft()[1]
+        else:
+            departures = self.__leftward_departures
+            while departures and departures[0][0] <= now:
+                self.__leftward_buffer_bytes -= departures.popleft()[1]
+
+    def bytes_in_buffer(self, rightward_direction):
+        """Returns the total number of bytes in the buffer of the given
+        direction."""
+        self.__release_departures(rightward_direction)
+        if rightward_direction:
+            return self.__rightward_buffer_bytes
+        return self.__leftward_buffer_bytes
 
     def num_packets_in_buffers(self):
-        return len(self.__rightward_buffer) + len(self.__leftward_buffer)
+        self.__release_departures(True)
+        self.__release_departures(False)
+        return (len(self.__rightward_buffer) + len(self.__leftward_buffer) +
+            len(self.__rightward_departures) + len(self.__leftward_departures))
+
+    def get_num_packets_transmitted(self):
+        return self.__num_packets_transmitted
 
     def get_link_id(self):
         return self.__link_id
@@ -61,18 +114,45 @@ class Link(object):
         return self.__controller
 
     def buffer_is_full(self, from_device_id, packet_size):
+        """Returns whether a packet of the given size does not fit in the
+        buffer of the direction a device sends in. If it does not and the
+        packets of a train are still to leave it, the device is told when the
+        next one does, see notify_buffer_space."""
         if from_device_id == self.__left_device.get_device_id():
-            buf = self.__rightward_buffer
+            rightward_direction = True
         elif from_device_id == self.__right_device.get_device_id():
-            buf = self.__leftward_buffer
+            rightward_direction = False
         else:
             raise Exception("Unknown device")
-        return self.__buffer_size - self.bytes_in_buffer(buf) < packet_size
+        if (self.__buffer_size - self.bytes_in_buffer(rightward_direction) >=
+                packet_size):
+            return False
+        if rightward_direction:
+            if self.__rightward_departures and not self.__rightward_wakeup:
+                self.__rightward_wakeup = True
+                self.__controller.add_event(
+                    self.__rightward_departures[0][0],
+                    self.departure_handler, [True])
+        elif self.__leftward_departures and not self.__leftward_wakeup:
+            self.__leftward_wakeup = True
+            self.__controller.add_event(self.__leftward_departures[0][0],
+                self.departure_handler, [False])
+        return True
+
+    def departure_handler(self, rightward_direction):
+        """Called when a packet of a train is put on the wire while the
+        sending device waits for space in the buffer."""
+        if rightward_direction:
+            self.__rightward_wakeup = False
+            self.__left_device.notify_buffer_space(self)
+        else:
+            self.__leftward_wakeup = False
+            self.__right_device.notify_buffer_space(self)
 
     @staticmethod
-    def link_rate_aggregator(values, interval_length):
+    def link_rate_aggregator(accumulator, interval_length):
         """Returns the average link rate in megabits per second (Mbps)."""
-        return sum(values) / float(interval_length) * 8.0 / 1000000.0
+        return accumulator.sum / float(interval_length) * 8.0 / 1000000.0
 
     def packet_on_wire_handler(self, rightward_direction):
         """Called after the packet is put on the wire (e.g. after 1024 /
@@ -80,19 +160,25 @@ class Link(object):
         receive_time = self.__link_delay + self.__controller.get_current_time()
 
         if rightward_direction:
-            packet = self.__rightward_buffer.pop(0)
+            packet = self.__rightward_buffer.popleft()
+            self.__rightward_buffer_bytes -= packet.get_size()
+            sending_device = self.__left_device
             device = self.__right_device
         else:
-            packet = self.__leftward_buffer.pop(0)
+            packet = self.__leftward_buffer.popleft()
+            self.__leftward_buffer_bytes -= packet.get_size()
+            sending_device = self.__right_device
             device = self.__left_device
+        self.__num_packets_transmitted += 1
 
-        self.__controller.log(
-            "link-rate",
-            self.__link_id,
-            packet.get_size(),
-            values_aggregator=self.link_rate_aggregator,
-            ylabel="link rate (Mbps)",
-        )
+        if self.__instrumented:
+            self.__controller.log(
+                "link-rate",
+                self.__link_id,
+                packet.get_size(),
+                values_aggregator=self.link_rate_aggregator,
+                ylabel="link rate (Mbps)",
+            )
 
         self.__controller.add_event(
             receive_time,
@@ -100,6 +186,53 @@ class Link(object):
             [self, packet],
         )
 
+        # The buffer has space again, which may unblock the sending device.
+        sending_device.notify_buffer_space(self)
+
+    def train_on_wire_handler(self, rightward_direction, end_times):
+        """Called after the first packet of a train is put on the wire. The
+        whole train is taken off the buffer, and is received by the device at
+        the other end one link delay after each packet is put on the wire.
+        Each packet frees its share of the buffer when it is put on the wire.
+
+        Args:
+            rightward_direction: The direction of the train.
+            end_times: The times each packet of the train is put on the wire.
+        """
+        if rightward_direction:
+            buf = self.__rightward_buffer
+            departures = self.__rightward_departures
+            sending_device = self.__left_device
+            device = self.__right_device
+        else:
+            buf = self.__leftward_buffer
+            departures = self.__leftward_departures
+            sending_device = self.__right_device
+            device = self.__left_device
+        packets = [buf.popleft() for _ in end_times]
+        num_bytes = sum(packet.get_size() for packet in packets)
+        departures.extend((end_time, packet.get_size())
+            for end_time, packet in zip(end_times, packets))
+        self.__num_packets_transmitted += len(packets)
+
+        if self.__instrumented:
+            self.__controller.log(
+                "link-rate",
+                self.__link_id,
+                num_bytes,
+                values_aggregator=self.link_rate_aggregator,
+                ylabel="link rate (Mbps)",
+            )
+
+        arrival_times = [x + self.__link_delay for x in end_times]
+        self.__controller.add_event(
+            arrival_times[0],
+            device.receive_train,
+            [self, packets, arrival_times],
+        )
+
+        sending_device.notify_buffer_space(self)
+
     def opposite_device(self, from_device_id):
         """I assume that routers can know what device is on the other end of the
         router."""
@@ -123,8 +256,8 @@ class Link(object):
             raise Exception("Invalid device id.")
 
     @staticmethod
-    def packet_loss_aggregator(values, interval_length):
-        return int(sum(values))
+    def packet_loss_aggregator(accumulator, interval_length):
+        return int(accumulator.sum)
 
     def queue_packet(self, from_device_id, packet):
         """Queues a packet. Returns whether or not the request was successful.
@@ -142,12 +275,13 @@ class Link(object):
             max(self.__next_leftward_start_transmission_time,
                 self.__controller.get_current_time())
 
-        self.__controller.log(
-            "buffer-occupancy",
-            self.__link_id,
-            self.num_packets_in_buffers(),
-            ylabel="buffer occupancy (pkts)",
-        )
+        if self.__instrumented:
+            self.__controller.log(
+                "buffer-occupancy",
+                self.__link_id,
+                self.num_packets_in_buffers(),
+                ylabel="buffer occupancy (pkts)",
+            )
 
         # Figure out direction and buffer.
         if from_device_id == self.__left_device.get_device_id():
@@ -160,17 +294,19 @@ class Link(object):
             raise Exception("Invalid device id")
 
         # Reject if buffer full.
-        if self.__buffer_size - self.bytes_in_buffer(buf) < packet.get_size():
+        if (self.__buffer_size - self.bytes_in_buffer(rightward_direction) <
+                packet.get_size()):
             # Log the packet loss, we are dropping this packet
-            self.__controller.log(
-                "packet-loss",
-                self.__link_id,
-                1,
-                values_aggregator=self.packet_loss_aggregator,
-                ylabel="packet loss (pkts)",
-            )
+            if self.__instrumented:
+                self.__controller.log(
+                    "packet-loss",
+                    self.__link_id,
+                    1,
+                    values_aggregator=self.packet_loss_aggregator,
+                    ylabel="packet loss (pkts)",
+                )
             return False
-        else:
+        elif self.__instrumented:
             # Log that packet not lost
             self.__controller.log(
                 "packet-loss",
@@ -184,6 +320,7 @@ class Link(object):
         buf.append(packet)
         transmission_time = float(packet.get_size()) / self.get_throughput()
         if rightward_direction:
+            self.__rightward_buffer_bytes += packet.get_size()
             # Add an event for when the packet is on the wire.
             self.__next_rightward_start_transmission_time += transmission_time
             self.__next_leftward_start_transmission_time = \
@@ -193,6 +330,7 @@ class Link(object):
                 self.__next_rightward_start_transmission_time,
                 self.packet_on_wire_handler, [True])
         else:
+            self.__leftward_buffer_bytes += packet.get_size()
             self.__next_leftward_start_transmission_time += transmission_time
             self.__next_rightward_start_transmission_time = \
                 self.__next_leftward_start_transmission_time + \
@@ -203,6 +341,101 @@ class Link(object):
 
         return True
 
+    def can_take_train(self, from_device_id, flow_id):
+        """Returns whether a train of packets of a flow can be queued, i.e.
+        packet trains are enabled, nothing waits in the other direction, and
+        only packets of the same flow wait in this direction.
+
+        Args:
+            from_device_id: The device sending the train.
+            flow_id: The id of the flow of the train.
+        """
+        if self.__max_train_length < 2:
+            return False
+        if from_device_id == self.__left_device.get_device_id():
+            buf = self.__rightward_buffer
+            opposite_buffer = self.__leftward_buffer
+        else:
+            buf = self.__leftward_buffer
+            opposite_buffer = self.__rightward_buffer
+        if opposite_buffer:
+            return False
+        return all(packet.is_TCP_packet() and packet.get_flow_id() == flow_id
+                   for packet in buf)
+
+    def train_room(self, from_device_id, packet_size):
+        """Returns the number of packets of the given size that fit in the
+        buffer of the direction a device sends in."""
+        rightward_direction = \
+            from_device_id == self.__left_device.get_device_id()
+        return int((self.__buffer_size -
+            self.bytes_in_buffer(rightward_direction)) // packet_size)
+
+    def queue_train(self, from_device_id, packets, queue_times):
+        """Queues a train of packets of one flow, as if each packet were
+        queued with queue_packet at its queue time. The caller checks that
+        the train can be queued and fits in the buffer, see can_take_train
+        and train_room.
+
+        Args:
+            from_device_id: The device sending the train.
+            packets: The packets, in order.
+            queue_times: The time each packet would have been queued at, none
+                of them before now.
+        """
+        rightward_direction = \
+            from_device_id == self.__left_device.get_device_id()
+        if rightward_direction:
+            buf = self.__rightward_buffer
+            next_start_time = self.__next_rightward_start_transmission_time
+        else:
+            buf = self.__leftward_buffer
+            next_start_time = self.__next_leftward_start_transmission_time
+
+        end_times = []
+        num_bytes = 0
+        for packet, queue_time in zip(packets, queue_times):
+            if self.__instrumented:
+                self.__controller.log(
+                    "buffer-occupancy",
+                    self.__link_id,
+                    self.num_packets_in_buffers(),
+                    ylabel="buffer occupancy (pkts)",
+                )
+                self.__controller.log(
+                    "packet-loss",
+                    self.__link_id,
+                    0,
+                    values_aggregator=self.packet_loss_aggregator,
+                    ylabel="packet loss (pkts)",
+                )
+            buf.append(packet)
+            num_bytes += packet.get_size()
+            next_start_time = max(next_start_time, queue_time) + \
+                float(packet.get_size()) / self.get_throughput()
+            end_times.append(next_start_time)
+
+        # As in queue_packet, the other direction waits for the train to
+        # clear the link.
+        if rightward_direction:
+            self.__rightward_buffer_bytes += num_bytes
+            self.__next_rightward_start_transmission_time = next_start_time
+            self.__next_leftward_start_transmission_time = \
+                next_start_time + self.get_link_delay()
+        else:
+            self.__leftward_buffer_bytes += num_bytes
+            self.__next_leftward_start_transmission_time = next_start_time
+            self.__next_rightward_start_transmission_time = \
+                next_start_time + self.get_link_delay()
+        self.__controller.add_event(end_times[0], self.train_on_wire_handler,
+            [rightward_direction, end_times])
+
+    def get_left_device(self):
+        return self.__left_device
+
+    def get_right_device(self):
+        return self.__right_device
+
     def set_left_device(self, device):
         self.__left_device = device
 
@@ -211,3 +444,19 @@ class Link(object):
 
     def get_throughput(self):
         return self.__throughput
+
+    def get_buffer_size(self):
+        return self.__buffer_size
+
+    def add_fluid_traffic(self, num_bytes, num_packets):
+        """Accounts for the traffic of a flow in fluid mode, which crosses the
+        link without any packet being queued."""
+        self.__num_packets_transmitted += num_packets
+        if self.__instrumented:
+            self.__controller.log(
+                "link-rate",
+                self.__link_id,
+                num_bytes,
+                values_aggregator=self.link_rate_aggregator,
+                ylabel="link rate (Mbps)",
+            )
@@ -0,0 +1,361 @@
+from collections import deque
+import csv
+import json
+import numpy
+import struct
+
+class QuantileEstimator(object):
+    """Estimates a quantile of a stream of values in constant memory, using the
+    P-square algorithm of Jain and Chlamtac. Five markers track the minimum, the
+    p/2, p and (1+p)/2 quantiles and the maximum; their heights are adjusted
+    with a piecewise-parabolic formula as values arrive.
+
+    Attributes:
+        _p: The quantile to estimate, between 0 and 1.
+        _heights: The marker heights. Until five values have been seen, this
+            is just the sorted values.
+        _positions: The actual marker positions.
+        _desired_positions: The desired marker positions.
+        _increments: The increments of the desired positions per value.
+    """
+
+    __slots__ = ('_p', '_heights', '_positions', '_desired_positions',
+                 '_increments')
+
+    def __init__(self, p):
+        self._p = p
+        self._heights = []
+        self._positions = [1, 2, 3, 4, 5]
+        self._desired_positions = [1, 1 + 2 * p, 1 + 4 * p, 3 + 2 * p, 5]
+        self._increments = [0, p / 2, p, (1 + p) / 2, 1]
+
+    def add(self, value):
+        heights = self._heights
+        if len(heights) < 5:
+            heights.append(value)
+            heights.sort()
+            return
+
+        # Find the cell the value falls in, extending the extremes if needed.
+        if value < heights[0]:
+            heights[0] = value
+            k = 0
+        elif value >= heights[4]:
+            heights[4] = value
+            k = 3
+        else:
+            k = 0
+            while value >= heights[k + 1]:
+                k += 1
+
+        positions = self._positions
+        for i in range(k + 1, 5):
+            positions[i] += 1
+        for i in range(5):
+            self._desired_positions[i] += self._increments[i]
+
+        # Move the middle markers towards their desired positions.
+        for i in range(1, 4):
+            d = self._desired_positions[i] - positions[i]
+            if ((d >= 1 and positions[i + 1] - positions[i] > 1) or
+                    (d <= -1 and positions[i - 1] - positions[i] < -1)):
+                d = 1 if d > 0 else -1
+                height = self._parabolic(i, d)
+                if not heights[i - 1] < height < heights[i + 1]:
+                    height = self._linear(i, d)
+                heights[i] = height
+                positions[i] += d
+
+    def _parabolic(self, i, d):
+        q = self._heights
+        n = self._positions
+        return q[i] + d / float(n[i + 1] - n[i - 1]) * (
+            (n[i] - n[i - 1] + d) * (q[i + 1] - q[i]) / (n[i + 1] - n[i]) +
+            (n[i + 1] - n[i] - d) * (q[i] - q[i - 1]) / (n[i] - n[i - 1]))
+
+    def _linear(self, i, d):
+        q = self._heights
+        n = self._positions
+        return q[i] + d * (q[i + d] - q[i]) / float(n[i + d] - n[i])
+
+    def value(self):
+        """Returns the estimated quantile, or None if no values were added."""
+        heights = self._heights
+        if not heights:
+            return None
+        if len(heights) < 5:
+            return heights[min(len(heights) - 1,
+                               int(self._p * len(heights)))]
+        return heights[2]
+
+
+class Accumulator(object):
+    """Aggregates the values logged in one interval in constant memory. The
+    controller passes it to the values aggregators, which read the statistics
+    they need from it.
+
+    Attributes:
+        count: The number of values.
+        sum: The sum of the values.
+        min: The smallest value, or None.
+        max: The largest value, or None.
+        last: The last value, or None.
+        _quantile_ps: The quantiles to estimate.
+        _quantiles: Maps each quantile to its QuantileEstimator.
+    """
+
+    __slots__ = ('count', 'sum', 'min', 'max', 'last', '_quantile_ps',
+                 '_quantiles')
+
+    def __init__(self, quantiles=()):
+        """Initializes the Accumulator instance.
+
+        Args:
+            quantiles: The quantiles to estimate, e.g. (0.5, 0.99). Estimating
+                quantiles makes add noticeably slower.
+        """
+        self._quantile_ps = tuple(quantiles)
+        self.reset()
+
+    def reset(self):
+        """Clears the accumulator for the next interval."""
+        self.count = 0
+        self.sum = 0
+        self.min = None
+        self.max = None
+        self.last = None
+        self._quantiles = {p: QuantileEstimator(p) for p in self._quantile_ps}
+
+    def add(self, value):
+        self.count += 1
+        self.sum += value
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+        self.last = value
+        if self._quantiles:
+            for estimator in self._quantiles.values():
+                estimator.add(value)
+
+    def mean(self):
+        return self.sum / float(self.count)
+
+    def quantile(self, p):
+        """Returns the estimate of a quantile given to the constructor."""
+        return self._quantiles[p].value()
+
+
+class SteadyStateDetector(object):
+    """Tells when the aggregated time series have settled. A series has settled
+    once the mean of its last points is within a tolerance of the mean of the
+    points before them. Comparing window means rather than single points lets
+    series that keep oscillating, like TCP window sizes, settle.
+
+    Attributes:
+        _log_types: The log types of the series that are watched.
+        _tolerance: The largest relative change of the mean of a settled
+            series.
+        _window: The number of points in each of the two compared windows.
+        _series: Maps (log_type, device_name) to a list [last_time, values],
+            where values holds the last 2 * window points of the series.
+    """
+
+    def __init__(self, log_types, tolerance, window):
+        """Initializes the SteadyStateDetector instance.
+
+        Args:
+            log_types: The log types of the series to watch, e.g.
+                ('flow-rate', 'window-size').
+            tolerance: The largest change of the mean of a settled series
+                between two consecutive windows, relative to the first one,
+                e.g. 0.05.
+            window: The number of points in each window.
+        """
+        self._log_types = frozenset(log_types)
+        self._tolerance = tolerance
+        self._window = window
+        self._series = {}
+
+    def add_point(self, log_type, device_name, time, value):
+        if log_type not in self._log_types:
+            return
+        key = (log_type, device_name)
+        if key not in self._series:
+            self._series[key] = [time, deque(maxlen=2 * self._window)]
+        self._series[key][0] = time
+        self._series[key][1].append(value)
+
+    def has_series(self, log_type, device_name):
+        return (log_type, device_name) in self._series
+
+    def is_steady(self, min_time):
+        """Returns whether every series that is still being logged has settled.
+
+        Args:
+            min_time: Series with no point since this time are ignored, e.g.
+                the flows that have finished.
+        """
+        active = False
+        for last_time, values in self._series.values():
+            if last_time < min_time:
+                continue
+            active = True
+            if len(values) < 2 * self._window:
+                return False
+            values = list(values)
+            previous_mean = sum(values[:self._window]) / float(self._window)
+            mean = sum(values[self._window:]) / float(self._window)
+            if abs(mean - previous_mean) > self._tolerance * abs(
+                    previous_mean):
+                return False
+        return active
+
+
+class MetricsSink(object):
+    """Base class for the sinks that the controller streams the aggregated
+    interval points to as the simulation runs. Subclasses buffer the points and
+    append them to a file, so that memory stays bounded on long runs.
+    """
+
+    def write_point(self, log_type, device_name, time, value):
+        """Writes one aggregated point.
+
+        Args:
+            log_type: The type of log, e.g. 'flow-rate'.
+            device_name: The name of the device, e.g. 'F1'.
+            time: The time of the point, in seconds.
+            value: The aggregated value of the point.
+        """
+        raise NotImplementedError()
+
+    def close(self):
+        """Flushes the buffered points and closes the file."""
+        raise NotImplementedError()
+
+
+class CSVMetricsSink(MetricsSink):
+    """Writes the points as rows of a CSV file with the columns log_type,
+    device, time and value.
+
+    Attributes:
+        _file: The output file.
+        _writer: The CSV writer.
+    """
+
+    def __init__(self, filename):
+        self._file = open(filename, 'w', newline='')
+        self._writer = csv.writer(self._file)
+        self._writer.writerow(('log_type', 'device', 'time', 'value'))
+
+    def write_point(self, log_type, device_name, time, value):
+        self._writer.writerow((log_type, device_name, time, value))
+
+    def close(self):
+        self._file.close()
+
+
+class JSONLMetricsSink(MetricsSink):
+    """Writes the points as one JSON object per line.
+
+    Attributes:
+        _file: The output file.
+    """
+
+    def __init__(self, filename):
+        self._file = open(filename, 'w')
+
+    def write_point(self, log_type, device_name, time, value):
+        self._file.write(json.dumps({
+            'log_type': log_type,
+            'device': device_name,
+            'time': time,
+            'value': value,
+        }))
+        self._file.write('\n')
+
+    def close(self):
+        self._file.close()
+
+
+class ColumnarMetricsSink(MetricsSink):
+    """Writes the points as fixed-size binary records that load directly into a
+    NumPy structured array, see load_columnar_metrics. Each record holds the
+    series index as a little-endian uint32, followed by the time and the value
+    as little-endian float64. The series names are written to a JSON index file
+    next to the data file when the sink is closed.
+
+    Attributes:
+        RECORD: The struct of one record.
+        FLUSH_SIZE: The number of buffered bytes that triggers a write.
+        _filename: The name of the data file.
+        _file: The data file.
+        _buffer: The records that have not been written yet.
+        _series: Maps (log_type, device_name) to the series index.
+    """
+
+    RECORD = struct.Struct('<Idd')
+    FLUSH_SIZE = 1 << 16
+
+    def __init__(self, filename):
+        self._filename = filename
+        self._file = open(filename, 'wb')
+        self._buffer = bytearray()
+        self._series = {}
+
+    @staticmethod
+    def index_filename(filename):
+        return filename + '.json'
+
+    def write_point(self, log_type, device_name, time, value):
+        key = (log_type, device_name)
+        if key not in self._series:
+            self._series[key] = len(self._series)
+        self._buffer += self.RECORD.pack(self._series[key], time, value)
+        if len(self._buffer) >= self.FLUSH_SIZE:
+            self._file.write(self._buffer)
+            self._buffer = bytearray()
+
+    def close(self):
+        self._file.write(self._buffer)
+        self._buffer = bytearray()
+        self._file.close()
+        series = sorted(self._series, key=self._series.get)
+        with open(self.index_filename(self._filename), 'w') as f:
+            f.write(json.dumps([list(x) for x in series]))
+
+
+def load_columnar_metrics(filename):
+    """Loads the points written by a ColumnarMetricsSink.
+
+    Args:
+        filename: The name of the data file.
+
+    Returns:
+        A dictionary mapping (log_type, device_name) to a tuple of NumPy arrays
+        (times, values).
+    """
+    with open(ColumnarMetricsSink.index_filename(filename)) as f:
+        series = [tuple(x) for x in json.loads(f.read())]
+    records = numpy.fromfile(filename, dtype=numpy.dtype([
+        ('series', '<u4'),
+        ('time', '<f8'),
+        ('value', '<f8'),
+    ]))
+    metrics = {}
+    for index, key in enumerate(series):
+        selected = records[records['series'] == index]
+        metrics[key] = (selected['time'], selected['value'])
+    return metrics
+
+
+def open_metrics_sink(filename):
+    """Returns the metrics sink for a file, chosen by its extension: '.csv',
+    '.jsonl' or '.bin'."""
+    if filename.endswith('.csv'):
+        return CSVMetricsSink(filename)
+    elif filename.endswith('.jsonl'):
+        return JSONLMetricsSink(filename)
+    elif filename.endswith('.bin'):
+        return ColumnarMetricsSink(filename)
+    raise ValueError("Unsupported metrics file extension: %s" % filename)
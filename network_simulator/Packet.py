@@ -4,21 +4,24 @@ class PacketTypes(object):
     TCP_DATA = 0
     TCP_ACK = 1
     BF_DATA = 2  # Bellman-Ford packet.
+    BF_VECTOR = 3  # Batched distance-vector packet.
 
 
 class Packet(object):
-    """Class that represents a packet in the network simulation.
+    """Class that represents a packet in the network simulation. Packets use
+    __slots__ since many thousands of them are alive at once in link buffers
+    and pending events.
 
     Attributes:
-        _controller: The controller object.
         _src_id: The id of the source device.
         _dst_id: The id of the destination device.
         _size: The size of the packet in bytes.
         packet_type: The enum value representing the type of packet.
     """
 
-    def __init__(self, controller, src_id, dst_id, size, packet_type):
-        self._controller = controller
+    __slots__ = ('_src_id', '_dst_id', '_size', 'packet_type')
+
+    def __init__(self, src_id, dst_id, size, packet_type):
         self._src_id = src_id
         self._dst_id = dst_id
         self._size = size
@@ -43,6 +46,9 @@ class Packet(object):
     def is_BF_packet(self):
         return (self.packet_type == PacketTypes.BF_DATA)
 
+    def is_BF_vector_packet(self):
+        return (self.packet_type == PacketTypes.BF_VECTOR)
+
     def is_TCP_ack(self):
         return self.packet_type == PacketTypes.TCP_ACK
 
@@ -54,23 +60,34 @@ class TCPPacket(Packet):
         _sequence_number: The sequence number used in TCP.
         _ack_number: The acknowledgement number used in TCP.
         _flow_id: The id of the flow for this TCP packet.
+        _data_time: The time the data packet was sent.
+        _ack_time: The time the ack packet was sent.
+        _sack_blocks: None if the flow does not use selective acks (SACK).
+            Otherwise, for an ack, the (start, end) ranges of the sequence
+            numbers received above the ack number, and for a data packet, an
+            empty tuple that tells the destination to send them, like the
+            SACK-permitted option of TCP.
     """
 
-    def __init__(self, controller, src_id, dst_id, size, packet_type,
-                 sequence_number, ack_number, flow_id, data_time, ack_time):
-        super().__init__(controller, src_id, dst_id, size, packet_type)
+    __slots__ = ('_sequence_number', '_ack_number', '_flow_id', '_data_time',
+                 '_ack_time', '_sack_blocks')
+
+    def __init__(self, src_id, dst_id, size, packet_type, sequence_number,
+                 ack_number, flow_id, data_time, ack_time, sack_blocks=None):
+        super().__init__(src_id, dst_id, size, packet_type)
         assert (self.is_TCP_packet())
         self._sequence_number = sequence_number
         self._ack_number = ack_number
         self._flow_id = flow_id
-        self.__data_time = data_time
-        self.__ack_time = ack_time
+        self._data_time = data_time
+        self._ack_time = ack_time
+        self._sack_blocks = sack_blocks
 
     def get_data_time(self):
-        return self.__data_time
+        return self._data_time
 
     def get_ack_time(self):
-        return self.__ack_time
+        return self._ack_time
 
     def get_flow_id(self):
         return self._flow_id
@@ -81,6 +98,9 @@ class TCPPacket(Packet):
     def get_ack_number(self):
         return self._ack_number
 
+    def get_sack_blocks(self):
+        return self._sack_blocks
+
 
 class BFPacket(Packet):
     """Class that represents a packet for implementing the Bellman-Ford
@@ -91,8 +111,10 @@ class BFPacket(Packet):
         _cost: The cost for use in the Bellman-Ford algorithm.
     """
 
-    def __init__(self, controller, src_id, dst_id, size, host_id, cost):
-        super().__init__(controller, src_id, dst_id, size, PacketTypes.BF_DATA)
+    __slots__ = ('_host_id', '_cost')
+
+    def __init__(self, src_id, dst_id, size, host_id, cost):
+        super().__init__(src_id, dst_id, size, PacketTypes.BF_DATA)
         self._host_id = host_id
         self._cost = cost
 
@@ -101,3 +123,27 @@ class BFPacket(Packet):
 
     def get_host_id(self):
         return self._host_id
+
+
+class BFVectorPacket(Packet):
+    """Class that represents a packet carrying several distance-vector entries
+    at once, for the incremental Bellman-Ford routing mode. Its size grows with
+    the number of entries.
+
+    Attributes:
+        _vector: The map from host ids to costs.
+    """
+
+    HEADER_SIZE = 64
+    ENTRY_SIZE = 16
+
+    __slots__ = ('_vector',)
+
+    def __init__(self, src_id, dst_id, vector):
+        super().__init__(src_id, dst_id,
+            self.HEADER_SIZE + self.ENTRY_SIZE * len(vector),
+            PacketTypes.BF_VECTOR)
+        self._vector = vector
+
+    def get_vector(self):
+        return self._vector
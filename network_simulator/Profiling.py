@@ -0,0 +1,98 @@
+from collections import defaultdict
+import sys
+
+class EventProfiler(object):
+    """Records where the time of a simulation goes, by the type of the event
+    callbacks. The controller calls record_event after each event once
+    profiling is enabled, see Controller.enable_profiling.
+
+    Attributes:
+        _callbacks: Maps the function of each event callback to a list
+            [count, wall_seconds].
+        _events_per_second: Maps each simulated second to the number of
+            events processed during it.
+        _queue_sizes: A list of (time, size) samples of the event queue size,
+            taken at the first event of each simulated second.
+        _max_queue_size: The largest event queue size seen.
+        _current_second: The simulated second of the last event.
+    """
+
+    def __init__(self):
+        self._callbacks = {}
+        self._events_per_second = defaultdict(int)
+        self._queue_sizes = []
+        self._max_queue_size = 0
+        self._current_second = None
+
+    def record_event(self, method, time, wall_seconds, queue_size):
+        """Records one processed event.
+
+        Args:
+            method: The bound method of the event.
+            time: The simulated time of the event.
+            wall_seconds: The wall-clock time taken by the method.
+            queue_size: The size of the event queue after the event.
+        """
+        function = method.__func__
+        stats = self._callbacks.get(function)
+        if stats is None:
+            stats = self._callbacks[function] = [0, 0.0]
+        stats[0] += 1
+        stats[1] += wall_seconds
+
+        second = int(time)
+        self._events_per_second[second] += 1
+        if second != self._current_second:
+            self._current_second = second
+            self._queue_sizes.append((time, queue_size))
+        if queue_size > self._max_queue_size:
+            self._max_queue_size = queue_size
+
+    def get_callback_stats(self):
+        """Returns a dictionary mapping the qualified name of each event
+        callback, e.g. 'Link.packet_on_wire_handler', to a tuple (count,
+        wall_seconds)."""
+        stats = defaultdict(lambda: [0, 0.0])
+        # Subclasses share the functions they inherit, so merge by name.
+        for function, (count, wall_seconds) in self._callbacks.items():
+            stats[function.__qualname__][0] += count
+            stats[function.__qualname__][1] += wall_seconds
+        return {name: tuple(x) for name, x in stats.items()}
+
+    def get_events_per_second(self):
+        """Returns a sorted list of (simulated second, number of events)."""
+        return sorted(self._events_per_second.items())
+
+    def get_queue_sizes(self):
+        """Returns the list of (time, size) samples of the event queue
+        size."""
+        return list(self._queue_sizes)
+
+    def print_summary(self, out=sys.stdout):
+        """Prints the counters as tables.
+
+        Args:
+            out: The file to print to.
+        """
+        stats = self.get_callback_stats()
+        total_count = sum(x[0] for x in stats.values())
+        total_wall_seconds = sum(x[1] for x in stats.values())
+        out.write('%-36s %10s %10s %10s %7s\n' % ('callback', 'count',
+            'total (s)', 'mean (us)', 'time'))
+        for name, (count, wall_seconds) in sorted(stats.items(),
+                key=lambda x: -x[1][1]):
+            out.write('%-36s %10d %10.3f %10.2f %6.1f%%\n' % (name, count,
+                wall_seconds, wall_seconds / count * 1e6,
+                100.0 * wall_seconds / max(total_wall_seconds, 1e-12)))
+        out.write('%-36s %10d %10.3f\n' % ('total', total_count,
+            total_wall_seconds))
+
+        events_per_second = [x[1] for x in self.get_events_per_second()]
+        if events_per_second:
+            out.write('\nevents per simulated second: mean %.0f, min %d, '
+                'max %d\n' % (sum(events_per_second) /
+                float(len(events_per_second)), min(events_per_second),
+                max(events_per_second)))
+        if self._queue_sizes:
+            out.write('event queue size: max %d, last %d\n' % (
+                self._max_queue_size, self._queue_sizes[-1][1]))
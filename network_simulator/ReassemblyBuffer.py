@@ -0,0 +1,167 @@
+from bisect import bisect_left
+
+
+class ReassemblyBuffer(object):
+    """The sequence numbers received by the destination of a flow.
+
+    The sequence numbers below the next expected one are only counted, and
+    the ones received out of order above it are kept as disjoint intervals,
+    so the memory is bounded by the number of holes in the window rather than
+    by the number of packets received. The intervals are kept sorted by
+    descending start, so that the lowest one, which is the next to be merged
+    into the contiguous range, is removed from the end of the lists.
+
+    e.g. if we receive TCP data packets of sequence numbers [0,1,2,3,7,8,10]
+    then the next expected sequence number is 4, and the intervals are
+    [10, 11) and [7, 9).
+
+    The sender of a flow using SACK keeps one too, as its scoreboard of the
+    sequence numbers the acks and their SACK blocks report as received.
+
+    Attributes:
+        _next_sequence_number: The lowest sequence number not received yet.
+        _neg_starts: The negated first sequence numbers of the intervals, in
+            ascending order.
+        _ends: The sequence numbers just past the intervals, in the same
+            order.
+    """
+
+    def __init__(self):
+        self._next_sequence_number = 0
+        self._neg_starts = []
+        self._ends = []
+
+    def get_next_sequence_number(self):
+        """Returns the lowest sequence number not received yet, i.e. the
+        cumulative ack number."""
+        return self._next_sequence_number
+
+    def num_intervals(self):
+        """Returns the number of intervals received out of order."""
+        return len(self._ends)
+
+    def get_intervals(self, max_count=None):
+        """Returns the intervals received out of order as (start, end) pairs,
+        lowest first.
+
+        Args:
+            max_count: The maximum number of intervals to return, or None for
+                all of them.
+        """
+        n = len(self._ends)
+        if max_count is not None:
+            n = min(n, max_count)
+        return [(-self._neg_starts[-1 - i], self._ends[-1 - i])
+                for i in range(n)]
+
+    def get_interval(self, sequence_number):
+        """Returns the interval received out of order that holds a sequence
+        number as a (start, end) pair, or None if there is none."""
+        i = bisect_left(self._neg_starts, -sequence_number)
+        if i < len(self._ends) and sequence_number < self._ends[i]:
+            return (-self._neg_starts[i], self._ends[i])
+        return None
+
+    def next_missing(self, sequence_number):
+        """Returns the lowest sequence number not received yet, at or above
+        the given one."""
+        if sequence_number < self._next_sequence_number:
+            return self._next_sequence_number
+        i = bisect_left(self._neg_starts, -sequence_number)
+        if i < len(self._ends) and sequence_number < self._ends[i]:
+            return self._ends[i]
+        return sequence_number
+
+    def find_highest(self, count):
+        """Returns the sequence number such that count of the sequence numbers
+        at or above it were received out of order, or None if fewer were."""
+        for i in range(len(self._ends)):
+            length = self._ends[i] + self._neg_starts[i]
+            if count <= length:
+                return self._ends[i] - count
+            count -= length
+        return None
+
+    def count_received(self, start, end):
+        """Returns how many sequence numbers in [start, end) were received
+        out of order, i.e. are in the intervals."""
+        count = 0
+        for i in range(len(self._ends) - 1, -1, -1):
+            interval_start = -self._neg_starts[i]
+            if interval_start >= end:
+                break
+            count += max(0, min(end, self._ends[i]) -
+                max(start, interval_start))
+        return count
+
+    def add(self, sequence_number):
+        """Records a received sequence number.
+
+        Returns:
+            False if the sequence number had already been received, True
+            otherwise.
+        """
+        if sequence_number < self._next_sequence_number:
+            return False
+        if sequence_number == self._next_sequence_number:
+            self._next_sequence_number += 1
+            if (self._ends and
+                    -self._neg_starts[-1] == self._next_sequence_number):
+                self._neg_starts.pop()
+                self._next_sequence_number = self._ends.pop()
+            return True
+
+        # The interval with the largest start at or below the sequence number
+        # is at index i, and the one just above it at index i - 1.
+        i = bisect_left(self._neg_starts, -sequence_number)
+        below = i < len(self._ends)
+        if below and sequence_number < self._ends[i]:
+            return False
+        extends_below = below and self._ends[i] == sequence_number
+        extends_above = i > 0 and -self._neg_starts[i - 1] == \
+            sequence_number + 1
+        if extends_below and extends_above:
+            self._ends[i] = self._ends[i - 1]
+            del self._neg_starts[i - 1]
+            del self._ends[i - 1]
+        elif extends_below:
+            self._ends[i] = sequence_number + 1
+        elif extends_above:
+            self._neg_starts[i - 1] = -sequence_number
+        else:
+            self._neg_starts.insert(i, -sequence_number)
+            self._ends.insert(i, sequence_number + 1)
+        return True
+
+    def add_range(self, start, end):
+        """Records the sequence numbers in [start, end) as received."""
+        start = max(start, self._next_sequence_number)
+        if start >= end:
+            return
+        # The intervals that overlap or touch [start, end) are the ones from
+        # index i, the first starting at or below end, to index j.
+        i = bisect_left(self._neg_starts, -end)
+        j = i
+        while j < len(self._ends) and self._ends[j] >= start:
+            j += 1
+        if j > i:
+            start = min(start, -self._neg_starts[j - 1])
+            end = max(end, self._ends[i])
+        del self._neg_starts[i:j]
+        del self._ends[i:j]
+        if start <= self._next_sequence_number:
+            # Only the lowest interval can touch the contiguous range.
+            self._next_sequence_number = end
+        else:
+            self._neg_starts.insert(i, -start)
+            self._ends.insert(i, end)
+
+    def advance(self, num_packets):
+        """Records the next num_packets sequence numbers as received in
+        order."""
+        self._next_sequence_number += num_packets
+        while (self._ends and
+                -self._neg_starts[-1] <= self._next_sequence_number):
+            self._neg_starts.pop()
+            self._next_sequence_number = max(self._next_sequence_number,
+                self._ends.pop())
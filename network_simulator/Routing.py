@@ -0,0 +1,191 @@
+from heapq import heappop, heappush
+
+def shortest_path_next_hops(adjacency, source):
+    """Runs Dijkstra's algorithm towards a source node, i.e. computes the
+    shortest paths from every node to the source.
+
+    Args:
+        adjacency: A dictionary mapping every node to a list of
+            (neighbor, link_id, weight) tuples, where weight is the cost of
+            sending from the neighbor to the node over the link.
+        source: The node to compute the shortest paths to.
+
+    Returns:
+        A tuple (distances, next_hops) of dictionaries. distances maps every
+        reachable node to its distance to the source, and next_hops maps every
+        reachable node other than the source to the link id of the first hop
+        on its shortest path to the source. Ties are broken by link id, so the
+        result is deterministic.
+    """
+    distances = {source: 0.0}
+    next_hops = {}
+    done = set()
+    heap = [(0.0, '', source)]
+    while heap:
+        distance, _, node = heappop(heap)
+        if node in done:
+            continue
+        done.add(node)
+        for neighbor, link_id, weight in adjacency[node]:
+            if neighbor in done:
+                continue
+            new_distance = distance + weight
+            if (neighbor not in distances or
+                    new_distance < distances[neighbor] or
+                    (new_distance == distances[neighbor] and
+                     link_id < next_hops[neighbor])):
+                distances[neighbor] = new_distance
+                # The link that reaches the neighbor from the source side is
+                # its first hop towards the source.
+                next_hops[neighbor] = link_id
+                heappush(heap, (new_distance, link_id, neighbor))
+    return distances, next_hops
+
+
+def equal_cost_next_hops(adjacency, distances, source, tolerance=1e-9):
+    """Finds every first hop on a shortest path to the source, for equal-cost
+    multipath routing.
+
+    Args:
+        adjacency: The adjacency given to shortest_path_next_hops.
+        distances: The distances returned by shortest_path_next_hops.
+        source: The node the shortest paths lead to.
+        tolerance: The relative difference under which two path costs are
+            considered equal.
+
+    Returns:
+        A dictionary mapping every reachable node other than the source to the
+        sorted list of the link ids of its equal-cost first hops.
+    """
+    next_hops = {}
+    for node, entries in adjacency.items():
+        if node not in distances:
+            continue
+        for neighbor, link_id, weight in entries:
+            if neighbor == source or neighbor not in distances:
+                continue
+            cost = distances[node] + weight
+            if cost - distances[neighbor] <= tolerance * max(cost, 1.0):
+                next_hops.setdefault(neighbor, []).append(link_id)
+    for links in next_hops.values():
+        links.sort()
+    return next_hops
+
+
+def network_adjacency(network, weight):
+    """Returns the adjacency of the routers and hosts of a JSON network, for
+    use with shortest_path_next_hops.
+
+    Args:
+        network: The parsed JSON representation of the network.
+        weight: Function that takes a JSON link and returns its weight.
+    """
+    adjacency = {x['id']: [] for x in network['routers'] + network['hosts']}
+    for json_link in network['links']:
+        left = json_link['left_device_id']
+        right = json_link['right_device_id']
+        link_weight = weight(json_link)
+        adjacency[left].append((right, json_link['id'], link_weight))
+        adjacency[right].append((left, json_link['id'], link_weight))
+    return adjacency
+
+
+def delay_weight(json_link):
+    """Weighs a JSON link by the time it takes to send a 1024 byte packet
+    across it, i.e. its transmission time plus its delay."""
+    return 1024 * 8.0 / float(json_link['throughput']) + json_link['link_delay']
+
+
+def link_delay_weight(link, from_device_id):
+    """Weighs a Link by the time it takes to send a 1024 byte packet across
+    it, i.e. its transmission time plus its delay."""
+    return 1024.0 / link.get_throughput() + link.get_link_delay()
+
+
+def link_throughput_weight(link, from_device_id):
+    """Weighs a Link by the transmission time of a 1024 byte packet, i.e.
+    inversely to its throughput."""
+    return 1024.0 / link.get_throughput()
+
+
+def link_adjacency(links, weight):
+    """Returns the adjacency of the devices connected by Link objects, for use
+    with shortest_path_next_hops.
+
+    Args:
+        links: The Link objects.
+        weight: Function that takes a link and the id of the device sending
+            over it, and returns the weight of that direction of the link.
+    """
+    adjacency = {}
+    for link in links:
+        left_id = link.get_left_device().get_device_id()
+        right_id = link.get_right_device().get_device_id()
+        link_id = link.get_link_id()
+        adjacency.setdefault(left_id, []).append(
+            (right_id, link_id, weight(link, right_id)))
+        adjacency.setdefault(right_id, []).append(
+            (left_id, link_id, weight(link, left_id)))
+    return adjacency
+
+
+def routing_tables(adjacency, router_ids, host_ids, multipath=False):
+    """Computes the shortest-path routing table of every router.
+
+    Args:
+        adjacency: The adjacency of the routers and hosts, see
+            shortest_path_next_hops. It is modified.
+        router_ids: The ids of the routers.
+        host_ids: The ids of the hosts.
+        multipath: True to map each host to the list of all the equal-cost
+            next hop link ids, instead of a single link id.
+
+    Returns:
+        A dictionary mapping every router id to its routing table, which maps
+        host ids to link ids, or lists of link ids if multipath is True.
+    """
+    tables = {x: {} for x in router_ids}
+
+    # Hosts have a single link, so the shortest paths to a host are the
+    # shortest paths to the router it is attached to. Group the hosts by that
+    # router to run Dijkstra's algorithm once per router, over the graph of
+    # the routers only since hosts are never on the way.
+    attached_hosts = {}
+    for host_id in host_ids:
+        for router_id, link_id, _ in adjacency.pop(host_id, ()):
+            if router_id in tables:
+                tables[router_id][host_id] = [link_id] if multipath else \
+                    link_id
+                attached_hosts.setdefault(router_id, []).append(host_id)
+    for router_id in adjacency:
+        adjacency[router_id] = [x for x in adjacency[router_id]
+                                if x[0] in tables]
+
+    for source_router_id, attached_host_ids in attached_hosts.items():
+        distances, next_hops = shortest_path_next_hops(adjacency,
+            source_router_id)
+        if multipath:
+            next_hops = equal_cost_next_hops(adjacency, distances,
+                source_router_id)
+        for router_id, table in tables.items():
+            if router_id in next_hops:
+                for host_id in attached_host_ids:
+                    table[host_id] = next_hops[router_id]
+    return tables
+
+
+def static_routing_tables(network, weight=delay_weight):
+    """Computes the shortest-path routing table of every router of a JSON
+    network.
+
+    Args:
+        network: The parsed JSON representation of the network.
+        weight: Function that takes a JSON link and returns its weight.
+
+    Returns:
+        A dictionary mapping every router id to its routing table, which maps
+        host ids to link ids.
+    """
+    return routing_tables(network_adjacency(network, weight),
+        [x['id'] for x in network['routers']],
+        [x['id'] for x in network['hosts']])
@@ -0,0 +1,251 @@
+#!/usr/bin/python
+
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from Controller import Controller
+from Flow import Flow
+from optparse import OptionParser
+import copy
+import csv
+import itertools
+import json
+import os
+import time
+
+# The JSON sections of the network whose entries can be swept.
+NETWORK_SECTIONS = ('routers', 'hosts', 'links', 'flows')
+
+# The Flow class attributes that can be swept, e.g. 'Flow.FAST_ALPHA'.
+FLOW_PARAMETERS = ('FAST_ALPHA', 'NUM_ACKS_THRESHOLD', 'CUBIC_C',
+                   'CUBIC_BETA', 'INITIAL_RTO', 'MIN_RTO', 'MAX_RTO')
+
+
+def expand_grid(grid):
+    """Expands a parameter grid into the list of runs.
+
+    Args:
+        grid: A dictionary mapping parameter names to lists of values.
+
+    Returns:
+        A list of dictionaries, each mapping every parameter name to one of its
+        values.
+    """
+    names = sorted(grid)
+    return [dict(zip(names, values))
+            for values in itertools.product(*(grid[name] for name in names))]
+
+
+def run_key(parameters):
+    """Returns the string that identifies a run by its parameters."""
+    return json.dumps(parameters, sort_keys=True)
+
+
+def apply_parameters(network, parameters):
+    """Applies the swept parameters to the JSON representation of a network.
+
+    Parameter names take the form 'section.key' to set the key on every entry
+    of the section, e.g. 'links.buffer_size', or 'section.id.key' to set it on
+    the entry with that id only, e.g. 'flows.F2.start_time'. Names of the form
+    'Flow.ATTRIBUTE' are Flow class attributes and are not applied here.
+
+    Args:
+        network: The parsed JSON representation of the network.
+        parameters: A dictionary mapping parameter names to values.
+
+    Returns:
+        A modified copy of the network.
+    """
+    network = copy.deepcopy(network)
+    for name, value in parameters.items():
+        parts = name.split('.')
+        if parts[0] == 'Flow':
+            if len(parts) != 2 or parts[1] not in FLOW_PARAMETERS:
+                raise ValueError("Unknown Flow parameter: %s" % name)
+            continue
+        if parts[0] not in NETWORK_SECTIONS or len(parts) not in (2, 3):
+            raise ValueError("Unknown parameter: %s" % name)
+        entries = network[parts[0]]
+        if len(parts) == 3:
+            entries = [x for x in entries if x['id'] == parts[1]]
+            if not entries:
+                raise ValueError("Unknown id in parameter: %s" % name)
+        for entry in entries:
+            entry[parts[-1]] = value
+    return network
+
+
+def summarize(controller):
+    """Returns the summary metrics of a finished simulation.
+
+    For every logged device the mean of each time series is reported, and for
+    packet loss the total as well.
+
+    Args:
+        controller: The controller that ran the simulation.
+    """
+    metrics = {
+        'end_time': controller.get_current_time(),
+        'active_flows': controller.num_active_flows(),
+    }
+    for log_type in Controller.LOG_TYPES:
+        for device_name in controller.get_logged_devices(log_type):
+            _, y_values = controller.get_time_series(log_type, device_name)
+            if not y_values:
+                continue
+            prefix = '%s:%s' % (log_type, device_name)
+            metrics[prefix + ':mean'] = sum(y_values) / float(len(y_values))
+            if log_type == 'packet-loss':
+                metrics[prefix + ':total'] = sum(y_values)
+    return metrics
+
+
+def run_simulation(network, parameters, num_seconds, log_interval_length,
+                   stop_conditions=None):
+    """Runs one headless simulation of a sweep. Executed in a worker process.
+
+    Args:
+        network: The parsed JSON representation of the base network.
+        parameters: A dictionary mapping parameter names to values.
+        num_seconds: The number of seconds to run the simulation.
+        log_interval_length: The length of the logging interval in seconds.
+        stop_conditions: A dictionary of additional keyword arguments for
+            Controller.run, e.g. {'steady_state': 0.05}.
+
+    Returns:
+        A dictionary with the summary metrics of the run.
+    """
+    flow_defaults = {x: getattr(Flow, x) for x in FLOW_PARAMETERS}
+    try:
+        for name, value in parameters.items():
+            if name.startswith('Flow.'):
+                setattr(Flow, name.split('.', 1)[1], value)
+
+        controller = Controller({
+            'filename': None,
+            'debug': False,
+            'log_interval_length': log_interval_length,
+            'network': apply_parameters(network, parameters),
+        })
+        start = time.time()
+        stop_reason = controller.run(num_seconds, **(stop_conditions or {}))
+        wall_time = time.time() - start
+    finally:
+        # Worker processes are reused, so undo the class attribute changes.
+        for name, value in flow_defaults.items():
+            setattr(Flow, name, value)
+
+    metrics = summarize(controller)
+    metrics['wall_time'] = wall_time
+    metrics['stop_reason'] = stop_reason
+    return metrics
+
+
+def read_completed_runs(results_filename):
+    """Returns the keys of the runs already in a results file, along with the
+    file's header, so that an interrupted sweep can be resumed."""
+    if not os.path.exists(results_filename):
+        return set(), None
+    with open(results_filename, newline='') as f:
+        reader = csv.DictReader(f)
+        completed = {row['run'] for row in reader}
+        return completed, reader.fieldnames
+
+
+def sweep(network, grid, results_filename, num_seconds=float('inf'),
+          log_interval_length=None, max_workers=None, stop_conditions=None):
+    """Runs every combination of a parameter grid in a process pool.
+
+    Each finished run is appended to the results CSV file right away. Runs that
+    are already in the file are skipped, so an interrupted sweep picks up where
+    it left off.
+
+    Args:
+        network: The parsed JSON representation of the base network.
+        grid: A dictionary mapping parameter names to lists of values. See
+            apply_parameters for the parameter names.
+        results_filename: The CSV file to write the results to.
+        num_seconds: The number of seconds to run each simulation.
+        log_interval_length: The length of the logging interval in seconds.
+        max_workers: The number of worker processes. By default, one per CPU.
+        stop_conditions: A dictionary of additional keyword arguments for
+            Controller.run, e.g. {'steady_state': 0.05}.
+
+    Returns:
+        The number of runs that were simulated.
+    """
+    runs = expand_grid(grid)
+    # Fail before starting the pool if a parameter name is wrong.
+    for parameters in runs:
+        apply_parameters(network, parameters)
+
+    completed, fieldnames = read_completed_runs(results_filename)
+    pending = [x for x in runs if run_key(x) not in completed]
+    if not pending:
+        return 0
+
+    with ProcessPoolExecutor(max_workers=max_workers) as executor, \
+            open(results_filename, 'a', newline='') as f:
+        futures = {
+            executor.submit(run_simulation, network, parameters, num_seconds,
+                log_interval_length, stop_conditions): parameters
+            for parameters in pending
+        }
+        writer = None
+        for future in as_completed(futures):
+            parameters = futures[future]
+            row = {'run': run_key(parameters)}
+            row.update(parameters)
+            row.update(future.result())
+            if writer is None:
+                if fieldnames is None:
+                    fieldnames = (['run'] + sorted(grid) +
+                        sorted(set(row) - set(grid) - {'run'}))
+                writer = csv.DictWriter(f, fieldnames, restval='',
+                    extrasaction='ignore')
+                if f.tell() == 0:
+                    writer.writeheader()
+            writer.writerow(row)
+            f.flush()
+    return len(pending)
+
+
+if __name__ == '__main__':
+    parser = OptionParser()
+    parser.add_option("-f", "--file", dest="filename",
+        help="Base network json filename (e.g. test0.json)")
+    parser.add_option("-g", "--grid", dest="grid_filename",
+        help="Parameter grid json filename, mapping parameter names such as "
+        "links.buffer_size, flows.F2.start_time or Flow.FAST_ALPHA to lists "
+        "of values")
+    parser.add_option("-o", "--output", dest="results_filename",
+        default="results.csv", help="Results CSV filename; completed runs in "
+        "it are skipped")
+    parser.add_option("-t", "--time", dest="num_seconds", type="float",
+        default=float('inf'), help="Simulated seconds per run")
+    parser.add_option("-i", "--interval", dest="log_interval_length",
+        help="Log interval length as float > 0.0")
+    parser.add_option("-j", "--jobs", dest="max_workers", type="int",
+        help="Number of worker processes (default: one per CPU)")
+    parser.add_option("--max-events", dest="max_events", type="int",
+        help="Stop each run after processing this many events")
+    parser.add_option("--wall-clock", dest="max_wall_seconds", type="float",
+        help="Stop each run after this many seconds of wall-clock time")
+    parser.add_option("--steady-state", dest="steady_state", type="float",
+        help="Stop each run once its logged flow rates and window sizes have "
+        "settled within this relative tolerance, e.g. 0.05")
+    options, _ = parser.parse_args()
+
+    with open(options.filename) as f:
+        base_network = json.loads(f.read())
+    with open(options.grid_filename) as f:
+        parameter_grid = json.loads(f.read())
+
+    run_stop_conditions = {
+        name: getattr(options, name)
+        for name in ('max_events', 'max_wall_seconds', 'steady_state')
+        if getattr(options, name) is not None
+    }
+    num_runs = sweep(base_network, parameter_grid, options.results_filename,
+        options.num_seconds, options.log_interval_length, options.max_workers,
+        run_stop_conditions)
+    print("Simulated %d runs, results in %s" % (num_runs,
+        options.results_filename))
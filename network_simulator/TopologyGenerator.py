@@ -0,0 +1,335 @@
+#!/usr/bin/python
+
+from optparse import OptionParser
+from Routing import static_routing_tables
+import json
+import math
+import random
+
+class NetworkBuilder(object):
+    """Builds the JSON representation of a network, in the format read by the
+    Controller.
+
+    Attributes:
+        _link_options: The throughput, link_delay and buffer_size of new links.
+        _bf_freq: The Bellman-Ford frequency of the routers.
+        _routers: The JSON routers.
+        _hosts: The JSON hosts.
+        _links: The JSON links.
+        _flows: The JSON flows.
+        _device_links: Maps every device id to the ids of its links.
+    """
+
+    def __init__(self, throughput, link_delay, buffer_size, bf_freq):
+        self._link_options = {
+            'throughput': throughput,
+            'link_delay': link_delay,
+            'buffer_size': buffer_size,
+        }
+        self._bf_freq = bf_freq
+        self._routers = []
+        self._hosts = []
+        self._links = []
+        self._flows = []
+        self._device_links = {}
+
+    def get_host_ids(self):
+        return [x['id'] for x in self._hosts]
+
+    def get_link_option(self, name):
+        return self._link_options[name]
+
+    def add_router(self):
+        router_id = 'R%d' % (len(self._routers) + 1)
+        self._routers.append({'id': router_id, 'BFfreq': self._bf_freq})
+        self._device_links[router_id] = []
+        return router_id
+
+    def add_host(self, router_id):
+        """Adds a host attached to a router."""
+        host_id = 'H%d' % (len(self._hosts) + 1)
+        self._hosts.append({'id': host_id})
+        self._device_links[host_id] = []
+        self.add_link(router_id, host_id)
+        return host_id
+
+    def add_link(self, left_device_id, right_device_id, **options):
+        """Adds a link between two devices.
+
+        Args:
+            left_device_id: The id of the device on the left.
+            right_device_id: The id of the device on the right.
+            **options: Overrides of the throughput, link_delay or buffer_size.
+        """
+        link_id = 'L%d' % (len(self._links) + 1)
+        json_link = {
+            'id': link_id,
+            'left_device_id': left_device_id,
+            'right_device_id': right_device_id,
+        }
+        json_link.update(self._link_options)
+        json_link.update(options)
+        self._links.append(json_link)
+        self._device_links[left_device_id].append(link_id)
+        self._device_links[right_device_id].append(link_id)
+        return link_id
+
+    def add_flow(self, src_id, dst_id, num_bytes, start_time, tcp):
+        flow_id = 'F%d' % (len(self._flows) + 1)
+        self._flows.append({
+            'id': flow_id,
+            'src_id': src_id,
+            'dst_id': dst_id,
+            'num_bytes': num_bytes,
+            'start_time': start_time,
+            'tcp': tcp,
+        })
+        return flow_id
+
+    def add_flows(self, rng, host_pairs, num_bytes, start_window, tcp):
+        """Adds a flow for every (src_id, dst_id) pair of hosts, starting at
+        random times in [0, start_window)."""
+        for src_id, dst_id in host_pairs:
+            self.add_flow(src_id, dst_id, num_bytes,
+                rng.uniform(0, start_window), tcp)
+
+    def to_json(self, num_plotted=0):
+        """Returns the JSON representation of the network, with shortest-path
+        routing tables.
+
+        Args:
+            num_plotted: The number of flows, and of links, to show on the plot.
+        """
+        network = {
+            'routers': [dict(x) for x in self._routers],
+            'hosts': [dict(x) for x in self._hosts],
+            'links': [dict(x) for x in self._links],
+            'flows': [dict(x) for x in self._flows],
+        }
+        for json_device in network['routers'] + network['hosts']:
+            json_device['links'] = self._device_links[json_device['id']]
+        routing_tables = static_routing_tables(network)
+        for json_router in network['routers']:
+            json_router['routing_table'] = routing_tables[json_router['id']]
+        for key in ('links', 'flows'):
+            for entry in network[key][:num_plotted]:
+                entry['show_on_plot'] = True
+        return network
+
+
+def dumbbell(builder, rng, size, hosts_per_router):
+    """Two routers joined by a bottleneck link, with size hosts on each side.
+    Returns the pairs of hosts across the bottleneck, so that each host on the
+    left sends one flow to its counterpart on the right.
+    """
+    left_router = builder.add_router()
+    right_router = builder.add_router()
+    builder.add_link(left_router, right_router)
+    return [(builder.add_host(left_router), builder.add_host(right_router))
+            for _ in range(size)]
+
+
+def ring(builder, rng, size, hosts_per_router):
+    """size routers connected in a ring, each with hosts_per_router hosts."""
+    routers = [builder.add_router() for _ in range(size)]
+    for index, router_id in enumerate(routers):
+        if size > 2 or index == 0:
+            builder.add_link(router_id, routers[(index + 1) % size])
+        for _ in range(hosts_per_router):
+            builder.add_host(router_id)
+
+
+def fat_tree(builder, rng, size, hosts_per_router):
+    """A k-ary fat tree with k = size: k pods of k/2 edge and k/2 aggregation
+    routers, (k/2)^2 core routers and k/2 hosts per edge router, i.e. k^3/4
+    hosts. hosts_per_router is ignored.
+    """
+    if size < 2 or size % 2:
+        raise ValueError("The fat tree size must be an even number >= 2.")
+    half = size // 2
+    cores = [builder.add_router() for _ in range(half * half)]
+    for _ in range(size):
+        aggregations = [builder.add_router() for _ in range(half)]
+        edges = [builder.add_router() for _ in range(half)]
+        for index, aggregation_id in enumerate(aggregations):
+            for core_id in cores[index * half:(index + 1) * half]:
+                builder.add_link(aggregation_id, core_id)
+            for edge_id in edges:
+                builder.add_link(aggregation_id, edge_id)
+        for edge_id in edges:
+            for _ in range(half):
+                builder.add_host(edge_id)
+
+
+def random_geometric(builder, rng, size, hosts_per_router):
+    """size routers placed uniformly at random in the unit square, linked
+    whenever they are closer than a radius chosen so that the graph has an
+    average degree of about 4. Components are then joined to their nearest
+    neighbors so that the network is connected. Link delays are proportional
+    to distance, with the configured delay across the whole square.
+    """
+    routers = [builder.add_router() for _ in range(size)]
+    points = [(rng.random(), rng.random()) for _ in range(size)]
+    radius = math.sqrt(4.0 / (math.pi * max(size, 1)))
+    max_delay = builder.get_link_option('link_delay')
+
+    def distance(i, j):
+        return math.hypot(points[i][0] - points[j][0],
+                          points[i][1] - points[j][1])
+
+    def link(i, j):
+        builder.add_link(routers[i], routers[j],
+            link_delay=max(max_delay * distance(i, j) / math.sqrt(2), 1e-6))
+
+    # Union-find over the routers to track the components.
+    parents = list(range(size))
+
+    def find(i):
+        while parents[i] != i:
+            parents[i] = parents[parents[i]]
+            i = parents[i]
+        return i
+
+    # Bucket the points into a grid of cells of the radius so that only
+    # neighboring cells are compared.
+    cells = {}
+    for i, (x, y) in enumerate(points):
+        cells.setdefault((int(x / radius), int(y / radius)), []).append(i)
+    for (cx, cy), members in cells.items():
+        for dx in (-1, 0, 1):
+            for dy in (-1, 0, 1):
+                for j in cells.get((cx + dx, cy + dy), ()):
+                    for i in members:
+                        if i < j and distance(i, j) < radius:
+                            link(i, j)
+                            parents[find(i)] = find(j)
+
+    # Join every other component to the component of router 0.
+    components = {}
+    for i in range(size):
+        components.setdefault(find(i), []).append(i)
+    main = components.pop(find(0))
+    for _, members in sorted(components.items()):
+        i, j = min(((i, j) for i in members for j in main),
+                   key=lambda pair: distance(*pair))
+        link(i, j)
+        main.extend(members)
+
+    for router_id in routers:
+        for _ in range(hosts_per_router):
+            builder.add_host(router_id)
+
+
+def hierarchical(builder, rng, size, hosts_per_router):
+    """A three-level hierarchy: size core routers in a full mesh, each with
+    size aggregation routers, each with size access routers, each with
+    hosts_per_router hosts. Core and aggregation links have 10 times the
+    configured throughput.
+    """
+    backbone_throughput = builder.get_link_option('throughput') * 10
+    cores = [builder.add_router() for _ in range(size)]
+    for i, core_id in enumerate(cores):
+        for other_id in cores[i + 1:]:
+            builder.add_link(core_id, other_id,
+                throughput=backbone_throughput)
+    for core_id in cores:
+        for _ in range(size):
+            aggregation_id = builder.add_router()
+            builder.add_link(core_id, aggregation_id,
+                throughput=backbone_throughput)
+            for _ in range(size):
+                access_id = builder.add_router()
+                builder.add_link(aggregation_id, access_id)
+                for _ in range(hosts_per_router):
+                    builder.add_host(access_id)
+
+
+# The topology functions add the routers, hosts and links to a builder. They
+# return the (src_id, dst_id) pairs of hosts to add flows between, or None for
+# flows between random hosts.
+TOPOLOGIES = {
+    'dumbbell': dumbbell,
+    'ring': ring,
+    'fat-tree': fat_tree,
+    'random-geometric': random_geometric,
+    'hierarchical': hierarchical,
+}
+
+
+def generate(topology, size, hosts_per_router=1, num_flows=None, seed=0,
+             throughput=10000000, link_delay=0.01, buffer_size=64000,
+             num_bytes=1000000, start_window=10.0, tcp='reno', bf_freq=0,
+             num_plotted=0):
+    """Generates the JSON representation of a network.
+
+    Args:
+        topology: The name of the topology, one of TOPOLOGIES.
+        size: The size of the topology; see the topology functions.
+        hosts_per_router: The number of hosts per (edge) router.
+        num_flows: The number of flows between random hosts. By default, half
+            the number of hosts. Ignored by the dumbbell.
+        seed: The seed of the random number generator.
+        throughput: The link throughput in bits/sec.
+        link_delay: The link delay in seconds.
+        buffer_size: The link buffer size in bytes.
+        num_bytes: The number of bytes of each flow, or None for infinite flows.
+        start_window: The flows start at random times in [0, start_window).
+        tcp: The TCP algorithm of the flows.
+        bf_freq: The Bellman-Ford frequency of the routers; 0 keeps the
+            generated shortest-path routing tables static.
+        num_plotted: The number of flows, and of links, to show on the plot.
+    """
+    rng = random.Random(seed)
+    builder = NetworkBuilder(throughput, link_delay, buffer_size, bf_freq)
+    host_pairs = TOPOLOGIES[topology](builder, rng, size, hosts_per_router)
+    if host_pairs is None:
+        host_ids = builder.get_host_ids()
+        if num_flows is None:
+            num_flows = len(host_ids) // 2
+        host_pairs = [rng.sample(host_ids, 2) for _ in range(num_flows)]
+    builder.add_flows(rng, host_pairs, num_bytes, start_window, tcp)
+    return builder.to_json(num_plotted)
+
+
+if __name__ == '__main__':
+    parser = OptionParser()
+    parser.add_option("-t", "--topology", dest="topology", default="dumbbell",
+        help="One of: %s" % ", ".join(sorted(TOPOLOGIES)))
+    parser.add_option("-n", "--size", dest="size", type="int", default=4,
+        help="Topology size: host pairs for dumbbell, routers for ring and "
+        "random-geometric, k for fat-tree, fanout for hierarchical")
+    parser.add_option("--hosts-per-router", dest="hosts_per_router",
+        type="int", default=1)
+    parser.add_option("--flows", dest="num_flows", type="int",
+        help="Number of flows (default: half the number of hosts)")
+    parser.add_option("--seed", dest="seed", type="int", default=0)
+    parser.add_option("--throughput", dest="throughput", type="float",
+        default=10000000, help="Link throughput in bits/sec")
+    parser.add_option("--delay", dest="link_delay", type="float",
+        default=0.01, help="Link delay in seconds")
+    parser.add_option("--buffer", dest="buffer_size", type="int",
+        default=64000, help="Link buffer size in bytes")
+    parser.add_option("--bytes", dest="num_bytes", type="int",
+        default=1000000, help="Bytes per flow")
+    parser.add_option("--start-window", dest="start_window", type="float",
+        default=10.0, help="Flows start at random times before this")
+    parser.add_option("--tcp", dest="tcp", default="reno")
+    parser.add_option("--bf-freq", dest="bf_freq", type="float", default=0,
+        help="Bellman-Ford frequency (default: 0, static routing tables)")
+    parser.add_option("--plot", dest="num_plotted", type="int", default=0,
+        help="Number of flows, and of links, to show on the plot")
+    parser.add_option("-o", "--output", dest="output_filename",
+        help="Output json filename (default: stdout)")
+    options, _ = parser.parse_args()
+
+    network = generate(options.topology, options.size,
+        options.hosts_per_router, options.num_flows, options.seed,
+        options.throughput, options.link_delay, options.buffer_size,
+        options.num_bytes, options.start_window, options.tcp, options.bf_freq,
+        options.num_plotted)
+    output = json.dumps(network, indent=2)
+    if options.output_filename is None:
+        print(output)
+    else:
+        with open(options.output_filename, 'w') as f:
+            f.write(output)